@@ -0,0 +1,25 @@
+/* ---------------------------------------------------------------------- */
+/* Target DBMS:           PostgreSQL 10                                   */
+/* Project file:          sssb_latest_state.sql                           */
+/* Project name:          sssb_data                                       */
+/* Script type:           Database migration script                       */
+/* Description:           Table holding the newest state per apartment,   */
+/*                        maintained by the state write path.             */
+/* ---------------------------------------------------------------------- */
+
+CREATE TABLE IF NOT EXISTS LatestState(
+    nIdApartment                        INT                   NOT NULL                ,
+    time_stamp                          TIMESTAMPTZ                                   ,
+    nIdOffer                            INT                                           ,
+    no_applicants                       INT                   NOT NULL                ,
+    top_credits                         INT                   NOT NULL                ,
+    CONSTRAINT pk_latest_state          PRIMARY KEY (nIdApartment)                    ,
+    CONSTRAINT fk_latest_state_nIdApartment FOREIGN KEY (nIdApartment)  REFERENCES Apartment(nIdApartment)     ,
+    CONSTRAINT fk_latest_state_nIdOffer FOREIGN KEY (nIdOffer)      REFERENCES Offer(nIdOffer)
+);
+
+INSERT INTO LatestState (time_stamp, nIdApartment, nIdOffer, no_applicants, top_credits)
+    SELECT DISTINCT ON (nIdApartment) time_stamp, nIdApartment, nIdOffer, no_applicants, top_credits
+    FROM State
+    ORDER BY nIdApartment, time_stamp DESC
+ON CONFLICT (nIdApartment) DO NOTHING;
@@ -45,6 +45,21 @@ CREATE TABLE State(
     CONSTRAINT unq_state                UNIQUE      (nIdApartment, time_stamp)
 );
 
+CREATE INDEX idx_state_offer_apartment_time ON State (nIdOffer, nIdApartment, time_stamp);
+CREATE INDEX idx_state_time_stamp ON State (time_stamp);
+CREATE INDEX idx_offer_dates ON Offer (start_date, end_date);
+
+CREATE TABLE LatestState(
+    nIdApartment                        INT                   NOT NULL                ,
+    time_stamp                          TIMESTAMPTZ                                   ,
+    nIdOffer                            INT                                           ,
+    no_applicants                       INT                   NOT NULL                ,
+    top_credits                         INT                   NOT NULL                ,
+    CONSTRAINT pk_latest_state          PRIMARY KEY (nIdApartment)                    ,
+    CONSTRAINT fk_latest_state_nIdApartment FOREIGN KEY (nIdApartment)  REFERENCES Apartment(nIdApartment)     ,
+    CONSTRAINT fk_latest_state_nIdOffer FOREIGN KEY (nIdOffer)      REFERENCES Offer(nIdOffer)
+);
+
 CREATE TABLE IsOffered(
     nIdApartment                        INT           NOT NULL                              ,
     nIdOffer                            INT           NOT NULL                              ,
@@ -0,0 +1,24 @@
+/* ---------------------------------------------------------------------- */
+/* Target DBMS:           PostgreSQL 10                                   */
+/* Project file:          sssb_state_indexes.sql                          */
+/* Project name:          sssb_data                                       */
+/* Script type:           Database migration script                       */
+/* Description:           Indexes backing the State read paths: latest    */
+/*                        snapshot lookups and per-offer time series.     */
+/* ---------------------------------------------------------------------- */
+
+/* Per-offer time series (get_all_*, get_apartment_history) and last state
+   per apartment within an offer (get_current_state, get_last_states). */
+CREATE INDEX IF NOT EXISTS idx_state_offer_apartment_time
+    ON State (nIdOffer, nIdApartment, time_stamp);
+
+/* Newest snapshot lookups (order by time_stamp desc limit 1). */
+CREATE INDEX IF NOT EXISTS idx_state_time_stamp
+    ON State (time_stamp);
+
+/* Offer window lookups by timestamp (get_offer_id). */
+CREATE INDEX IF NOT EXISTS idx_offer_dates
+    ON Offer (start_date, end_date);
+
+ANALYZE State;
+ANALYZE Offer;
@@ -0,0 +1,175 @@
+# coding=utf-8
+"""Script timing the state readers of db_ops against a local PostgreSQL, before and after the
+Schemas/sssb_state_indexes.sql migration, over years of synthetic snapshots.
+
+The tables are created without the migration's indexes in a throwaway schema of the database
+configured for db_ops (see bench_state_writes), seeded, timed, migrated and timed again. Run from
+the repository root:
+
+    python -m benchmarks.bench_state_reads --years 3 --apartments 2000
+
+"""
+
+__author__ = 'Andres'
+
+import argparse
+import logging
+import time
+
+import src.data.db_ops as db_connection
+from benchmarks.bench_state_writes import BENCH_SCHEMA, use_scratch_schema, run_script, create_schema, drop_schema, \
+    make_apartments
+
+
+def seed(conn, years, no_apartments, offer_size, states_per_offer):
+    """Function to fill the throwaway schema with weekly offers over the given number of years, the
+    last one still open, and evenly spread states for every offered apartment.
+
+    Args:
+        conn: connection to the database.
+        years: number of years of history.
+        no_apartments: size of the apartment catalog.
+        offer_size: number of apartments per offer.
+        states_per_offer: number of states stored per apartment and offer.
+
+    Returns:
+        int: number of stored states.
+
+    """
+
+    db_connection.sync_apartments(make_apartments(no_apartments))
+
+    cur = conn.cursor()
+    weeks = int(years * 52)
+    cur.execute("""INSERT INTO offer (start_date, end_date)
+                      SELECT now() - interval '4 days' - k * interval '7 days',
+                             now() + interval '3 days' - k * interval '7 days'
+                        FROM generate_series(%s, 0, -1) k""", (weeks,))
+
+    # Every offer gets a different slice of the catalog
+    cur.execute("""INSERT INTO isoffered (nidapartment, nidoffer)
+                      SELECT apartment.nidapartment, offer.nidoffer
+                        FROM offer CROSS JOIN apartment
+                        WHERE (apartment.nidapartment + offer.nidoffer * %s) %% %s < %s""",
+                (offer_size, no_apartments, offer_size))
+
+    cur.execute("""INSERT INTO state (time_stamp, nidapartment, nidoffer, no_applicants, top_credits)
+                      SELECT offer.start_date + s * (offer.end_date - offer.start_date) / %s,
+                             isoffered.nidapartment, isoffered.nidoffer,
+                             s * 3 + isoffered.nidapartment %% 5,
+                             100 + s * 10 + isoffered.nidapartment %% 50
+                        FROM isoffered JOIN offer
+                          ON isoffered.nidoffer = offer.nidoffer
+                        CROSS JOIN generate_series(0, %s - 1) s
+                        WHERE offer.start_date + s * (offer.end_date - offer.start_date) / %s <= now()""",
+                (states_per_offer, states_per_offer, states_per_offer))
+    cur.execute("""SELECT count(*) FROM state""")
+    no_states = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+
+    run_script(conn, 'sssb_latest_state.sql')
+    db_connection.set_win_credits()
+
+    cur = conn.cursor()
+    cur.execute('ANALYZE')
+    conn.commit()
+    cur.close()
+
+    return no_states
+
+
+def get_readers(conn, credit_days=500):
+    """Function to build the reader calls to time, with arguments taken from the seeded data.
+
+    Args:
+        conn: connection to the database.
+        credit_days: credit days passed to the readers that take them.
+
+    Returns:
+        list: (name, function) pairs.
+
+    """
+
+    offer_id = db_connection.get_current_offer_id()
+    apt_ids = db_connection.get_offered_apartments(offer_id)
+
+    cur = conn.cursor()
+    cur.execute("""SELECT nidoffer FROM offer WHERE end_date < now() ORDER BY nidoffer DESC LIMIT 1""")
+    closed_offer_id = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+
+    return [
+        ('get_last_states', db_connection.get_last_states),
+        ('get_current_state', db_connection.get_current_state),
+        ('get_secured_apartments', lambda: db_connection.get_secured_apartments(credit_days)),
+        ('get_open_offer_states', db_connection.get_open_offer_states),
+        ('get_current_offer_size', db_connection.get_current_offer_size),
+        ('get_apartment_history', lambda: db_connection.get_apartment_history(apt_ids[0], offer_id)),
+        ('get_all_top_credits', lambda: db_connection.get_all_top_credits(offer_id, apt_ids)),
+        ('get_all_no_applicants', lambda: db_connection.get_all_no_applicants(offer_id, apt_ids)),
+        ('get_all_top_credits (1 hour)', lambda: db_connection.get_all_top_credits(offer_id, apt_ids, '1 hour')),
+        ('get_state_history_by_type', lambda: db_connection.get_state_history_by_type(offer_id, 'Type 0')),
+        ('get_state_history_by_type (closed)',
+         lambda: db_connection.get_state_history_by_type(closed_offer_id, 'Type 0')),
+        ('get_closed_offer_trajectories', db_connection.get_closed_offer_trajectories),
+        ('check_latest_state', lambda: db_connection.check_latest_state(repair=False)),
+    ]
+
+
+def time_readers(readers, rounds):
+    """Function to time every reader, keeping the fastest of several runs.
+
+    Args:
+        readers: (name, function) pairs.
+        rounds: number of runs of every reader.
+
+    Returns:
+        dict: seconds taken by the fastest run, per reader.
+
+    """
+
+    timings = {}
+    for name, reader in readers:
+        best = float('inf')
+        for _ in range(rounds):
+            start = time.perf_counter()
+            reader()
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the state readers of db_ops before and after the indexes.')
+    parser.add_argument('--years', type=float, default=3, help='years of weekly offers to seed')
+    parser.add_argument('--apartments', type=int, default=2000, help='size of the apartment catalog')
+    parser.add_argument('--offer-size', type=int, default=200, help='number of apartments per offer')
+    parser.add_argument('--states', type=int, default=50, help='number of states per apartment and offer')
+    parser.add_argument('--rounds', type=int, default=3, help='number of runs of every reader')
+    parser.add_argument('--keep', action='store_true', help='keep the {0} schema afterwards'.format(BENCH_SCHEMA))
+    args = parser.parse_args()
+
+    db_connection.log.setLevel(logging.WARNING)
+    use_scratch_schema()
+
+    with db_connection.session() as conn:
+        create_schema(conn, indexes=False)
+        try:
+            no_states = seed(conn, args.years, args.apartments, args.offer_size, args.states)
+            readers = get_readers(conn)
+
+            before = time_readers(readers, args.rounds)
+            run_script(conn, 'sssb_state_indexes.sql')
+            after = time_readers(readers, args.rounds)
+        finally:
+            if not args.keep:
+                drop_schema(conn)
+
+    print('{0} states'.format(no_states))
+    print('{0:<40}{1:>12}{2:>12}{3:>10}'.format('reader', 'before (ms)', 'after (ms)', 'speedup'))
+    for name, _ in readers:
+        print('{0:<40}{1:>12.1f}{2:>12.1f}{3:>9.1f}x'.format(name, 1000 * before[name], 1000 * after[name],
+                                                             before[name] / after[name]))
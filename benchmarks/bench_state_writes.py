@@ -0,0 +1,212 @@
+# coding=utf-8
+"""Script timing the state write paths of db_ops against a local PostgreSQL: one set_apartment_state
+call per row versus one set_apartment_states call for the whole batch, over the same states.
+
+The tables are created from Schemas/sssb_schema.sql in a throwaway schema of the database
+configured for db_ops, and dropped afterwards, so existing data is never touched. Run from the
+repository root:
+
+    python -m benchmarks.bench_state_writes --apartments 1000 --rounds 3
+
+"""
+
+__author__ = 'Andres'
+
+import argparse
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import src.data.db_ops as db_connection
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Schemas')
+BENCH_SCHEMA = 'sssb_bench'
+
+# Indexes created by sssb_state_indexes.sql
+STATE_INDEXES = ('idx_state_offer_apartment_time', 'idx_state_time_stamp', 'idx_offer_dates')
+
+
+def use_scratch_schema():
+    """Function to make every connection opened by db_ops from now on work in the throwaway schema.
+    It must be called before db_ops opens its first connection.
+
+    """
+
+    os.environ['PGOPTIONS'] = '-c search_path={0}'.format(BENCH_SCHEMA)
+
+
+def run_script(conn, name):
+    """Function to run one of the SQL scripts of the Schemas directory.
+
+    Args:
+        conn: connection to the database.
+        name: file name of the script.
+
+    """
+
+    with open(os.path.join(SCHEMA_DIR, name), encoding='utf-8') as f:
+        sql = f.read()
+
+    cur = conn.cursor()
+    cur.execute(sql)
+    conn.commit()
+    cur.close()
+
+
+def create_schema(conn, indexes=True):
+    """Function to create the sssb_data tables in the throwaway schema, which must not exist yet.
+
+    Args:
+        conn: connection to the database, opened after use_scratch_schema.
+        indexes: if false, the indexes of sssb_state_indexes.sql are left out.
+
+    """
+
+    cur = conn.cursor()
+    cur.execute('CREATE SCHEMA {0}'.format(BENCH_SCHEMA))
+    conn.commit()
+    cur.close()
+
+    run_script(conn, 'sssb_schema.sql')
+
+    if not indexes:
+        cur = conn.cursor()
+        for index in STATE_INDEXES:
+            cur.execute('DROP INDEX {0}'.format(index))
+        conn.commit()
+        cur.close()
+
+
+def drop_schema(conn):
+    """Function to drop the throwaway schema along with everything in it.
+
+    Args:
+        conn: connection to the database.
+
+    """
+
+    conn.rollback()
+    cur = conn.cursor()
+    cur.execute('DROP SCHEMA IF EXISTS {0} CASCADE'.format(BENCH_SCHEMA))
+    conn.commit()
+    cur.close()
+
+
+def make_apartments(no_apartments):
+    """Function to build a synthetic apartment catalog.
+
+    Args:
+        no_apartments: number of apartments.
+
+    Returns:
+        list: (apt_name, apt_type, apt_zone, apt_price, furnitured, electricity, _10_month) tuples.
+
+    """
+
+    return [('Benchvägen {0} / {0:04d}'.format(i), 'Type {0}'.format(i % 5), 'Zone {0}'.format(i % 7),
+             3000 + i % 4000, False, False, False) for i in range(no_apartments)]
+
+
+def make_states(names, time_stamp, rng):
+    """Function to build one scrape worth of states.
+
+    Args:
+        names: apartment names.
+        time_stamp: timestamp of the scrape.
+        rng: random.Random instance.
+
+    Returns:
+        list: (state_timestamp, apt_address, no_applicants, top_credits) tuples.
+
+    """
+
+    return [(time_stamp, name, rng.randint(0, 300), rng.randint(0, 3000)) for name in names]
+
+
+def write_one_by_one(states):
+    """Function to write states the way the pipeline used to, one set_apartment_state call (and
+    transaction) per row.
+
+    Args:
+        states: (state_timestamp, apt_address, no_applicants, top_credits) tuples.
+
+    """
+
+    for state in states:
+        db_connection.set_apartment_state(*state)
+
+
+def write_batch(states):
+    """Function to write states in a single set_apartment_states call.
+
+    Args:
+        states: (state_timestamp, apt_address, no_applicants, top_credits) tuples.
+
+    """
+
+    db_connection.set_apartment_states(states)
+
+
+def benchmark(no_apartments, rounds, seed=0):
+    """Function to time both write paths over the same batches, in the throwaway schema.
+
+    Args:
+        no_apartments: number of apartments, and thus of states per batch.
+        rounds: number of batches written by each path, of which the fastest is kept.
+        seed: seed of the synthetic data.
+
+    Returns:
+        dict: rows per second, per write path.
+
+    """
+
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    apartments = make_apartments(no_apartments)
+    names = [apt[0] for apt in apartments]
+
+    db_connection.sync_apartments(apartments)
+    db_connection.set_offer(now + timedelta(days=7), now - timedelta(days=7))
+    db_connection.warm_id_caches()
+
+    best = {write_one_by_one: float('inf'), write_batch: float('inf')}
+    for i in range(rounds):
+        states = make_states(names, now - timedelta(days=1, minutes=-i), rng)
+
+        # Same values for both paths, one second apart so they do not collide on (apartment, time)
+        for offset, write in enumerate((write_one_by_one, write_batch)):
+            batch = [(state[0] + timedelta(seconds=offset),) + state[1:] for state in states]
+            start = time.perf_counter()
+            write(batch)
+            best[write] = min(best[write], time.perf_counter() - start)
+
+    return {
+        'set_apartment_state (rows/s)': no_apartments / best[write_one_by_one],
+        'set_apartment_states (rows/s)': no_apartments / best[write_batch],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the per-row and batched state writes of db_ops.')
+    parser.add_argument('--apartments', type=int, default=1000, help='number of states per batch')
+    parser.add_argument('--rounds', type=int, default=3, help='number of batches written by each path')
+    parser.add_argument('--keep', action='store_true', help='keep the {0} schema afterwards'.format(BENCH_SCHEMA))
+    args = parser.parse_args()
+
+    # One log line per row would be timed along with the writes
+    db_connection.log.setLevel(logging.WARNING)
+    use_scratch_schema()
+
+    with db_connection.session() as conn:
+        create_schema(conn)
+        try:
+            rates = benchmark(args.apartments, args.rounds)
+        finally:
+            if not args.keep:
+                drop_schema(conn)
+
+    for measure, rate in rates.items():
+        print('{0}: {1:.1f}'.format(measure, rate))
+    print('speedup: {0:.1f}x'.format(rates['set_apartment_states (rows/s)'] / rates['set_apartment_state (rows/s)']))
@@ -2,36 +2,31 @@ import datetime
 import math
 
 import src.control.functions as fn
+from src.data.local_store import LocalStore
 from dotenv import load_dotenv
 import os
 
+# Apartment types to report on, by the label used in the plot titles
+SINGLE_ROOMS = {"Single Rooms": 'Enkelrum, (rum i korridor)'}
+KITCHENETTE = {"Rooms with kitchenette": 'Ett rum med pentry'}
 
-def single_rooms(credits):
-    offer_id = fn.get_last_offer_id()
-    fn.gen_plots_single_room(offer_id, credits)
+# Width of the buckets the plotted series are reduced to
+PLOT_RESOLUTION = '1 hour'
 
-    filepath1 = os.path.join(os.path.dirname(__file__), "topCredits_SR.png")
-    title1 = "Single Rooms: Top credits"
 
-    filepath2 = os.path.join(os.path.dirname(__file__), "numberOfApplicants_SR.png")
-    title2 = "Single Rooms: Number of applicants"
+def post_plots(credits, apartment_types, store=None, resolution=PLOT_RESOLUTION):
+    offer_id = fn.get_last_offer_id(store)
 
-    fn.post_slack_image(filepath1, title1)
-    fn.post_slack_image(filepath2, title2)
+    for title, image in fn.render_plots(offer_id, credits, apartment_types, store, resolution=resolution):
+        fn.post_slack_image(image, title)
 
 
-def kitchenette(credits):
-    offer_id = fn.get_last_offer_id()
-    fn.gen_plots_kitchenette(offer_id, credits)
+def single_rooms(credits, store=None, resolution=PLOT_RESOLUTION):
+    post_plots(credits, SINGLE_ROOMS, store, resolution)
 
-    filepath1 = os.path.join(os.path.dirname(__file__), "topCredits_KN.png")
-    title1 = "Rooms with kitchenette: Top credits"
 
-    filepath2 = os.path.join(os.path.dirname(__file__), "numberOfApplicants_KN.png")
-    title2 = "Rooms with kitchenette: Number of applicants"
-
-    fn.post_slack_image(filepath1, title1)
-    fn.post_slack_image(filepath2, title2)
+def kitchenette(credits, store=None, resolution=PLOT_RESOLUTION):
+    post_plots(credits, KITCHENETTE, store, resolution)
 
 
 if __name__ == '__main__':
@@ -47,5 +42,13 @@ if __name__ == '__main__':
 
     own_credit_days = int(math.floor(td.total_seconds() / (24 * 3600)))
 
-    # single_rooms(own_credit_days)
-    kitchenette(own_credit_days)
+    # Metrics are computed from the local copy, which only fetches the states added since last run
+    store = LocalStore()
+    try:
+        store.sync()
+
+        # post_plots(own_credit_days, dict(SINGLE_ROOMS, **KITCHENETTE), store)
+        kitchenette(own_credit_days, store)
+
+    finally:
+        store.close()
@@ -5,6 +5,7 @@
 import datetime
 import time
 import src.control.functions as fn
+from src.control.selenium_scraper import SSSBBrowserSession
 
 if __name__ == '__main__':
     try:
@@ -19,14 +20,18 @@ if __name__ == '__main__':
         if 0 < diff < 5:
             time.sleep(300)
 
-        # Current offer size
-        db_size = fn.get_db_offering_size()
-        live_size = fn.get_live_offering_size()
+        # One browser, launched and logged in at most once, serves every step of the job
+        with SSSBBrowserSession() as browser:
+            # Current offer size
+            db_size = fn.get_db_offering_size()
+            live_size = fn.get_live_offering_size(browser)
 
-        # Check if any new apartment has been posted
-        if live_size != db_size:
-            fn.scrape_apartments()
-            fn.scrape_offering()
+            # Check if any new apartment has been posted
+            if live_size != db_size:
+                fn.scrape_apartments()
+                fn.scrape_offering(browser, fn.get_offer_workers())
+
+            print("Browser startup timings: {0}".format(browser.get_timings()))
         fn.send_slack_notification("Apartment offer upload", 1)
 
     except Exception as e:
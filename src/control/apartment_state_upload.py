@@ -14,10 +14,14 @@ if __name__ == '__main__':
         current_timestamp = current_timestamp.replace(tzinfo=timezone)
 
         if start_date <= current_timestamp <= end_date:
-            fn.scrape_apartment_states()
+            # Apartments added during the offer are picked up from the same download as the states
+            fn.scrape_apartments_and_states(change_only=True)
         elif end_date < current_timestamp:
+            # The last offer is over: its final states are the winning credits
+            fn.close_offer(fn.get_last_offer_id())
+            # States are not scraped until the new offer exists, or they would belong to no offer
             fn.scrape_apartments()
-            fn.scrape_offering()
+            fn.scrape_offering(no_workers=fn.get_offer_workers())
         else:
             raise Exception("Error in timestamps")
 
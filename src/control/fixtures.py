@@ -0,0 +1,293 @@
+# coding=utf-8
+"""Module for recording SSSB responses to disk and replaying them through the spiders offline, so
+changes to the parsing logic can be checked and timed without hitting the live website.
+
+A fixture directory holds one file per recorded page plus an index.json mapping every URL to its
+file, status and headers.
+
+"""
+
+__author__ = 'Andres'
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from urllib.parse import urljoin
+
+import requests
+import scrapy
+from scrapy.http import HtmlResponse
+
+from src.control.http_scraper import unescape_widget_value
+from src.control.item_loaders import SSSBApartmentLoader, SSSBApartmentStateLoader
+from src.control.selenium_scraper import SSSB_FRONTPAGE
+from src.control.sssb_scraper import SSSBApartmentInfoSpider, SSSBApartmentStateSpider, SSSBApartmentSpider, \
+    get_widget_url, get_no_pages, get_no_listings
+
+INDEX_FILE = 'index.json'
+
+# Spiders which can be replayed, by name
+SPIDERS = {spider.name: spider for spider in (SSSBApartmentInfoSpider, SSSBApartmentStateSpider, SSSBApartmentSpider)}
+
+
+class FixtureException(Exception):
+    """Class for managing requests without a recorded response.
+
+    """
+
+    pass
+
+
+def load_index(fixture_dir):
+    """Function to load the index of a fixture directory.
+
+    Args:
+        fixture_dir: directory holding the recorded responses.
+
+    Returns:
+        dict: file, status and headers of the recorded response, per URL.
+
+    """
+
+    with open(os.path.join(fixture_dir, INDEX_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def record(fixture_dir, details=False, session=None, timeout=30):
+    """Function to record every page of the listing widget and, optionally, the detail page of
+    every apartment into a fixture directory.
+
+    Args:
+        fixture_dir: directory where the responses are written.
+        details: if true, the apartment detail pages are recorded as well.
+        session: requests session to use, e.g. a logged-in one. A new one is used if not given.
+        timeout: timeout of every request, in seconds.
+
+    Returns:
+        dict: index of the recorded responses.
+
+    """
+
+    session = session or requests.Session()
+    os.makedirs(fixture_dir, exist_ok=True)
+    index = {}
+
+    def fetch(url):
+        response = session.get(url, timeout=timeout)
+        response.raise_for_status()
+
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest() + '.html'
+        with open(os.path.join(fixture_dir, name), 'wb') as f:
+            f.write(response.content)
+
+        index[url] = {
+            'file': name,
+            'status': response.status_code,
+            'headers': {'Content-Type': response.headers.get('Content-Type', 'text/html; charset=utf-8')},
+        }
+        return HtmlResponse(url=url, body=response.content, encoding='utf-8')
+
+    pages = [fetch(get_widget_url(0))]
+    pages += [fetch(get_widget_url(page)) for page in range(1, get_no_pages(get_no_listings(pages[0])))]
+
+    if details:
+        for page in pages:
+            for href in page.xpath('//h4[@class=\'\\"ObjektAdress\\"\']/a/@href').extract():
+                url = urljoin(SSSB_FRONTPAGE, unescape_widget_value(href))
+                if url not in index:
+                    fetch(url)
+
+    with open(os.path.join(fixture_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+
+    return index
+
+
+def get_response(fixture_dir, index, request):
+    """Function to build the response of a request out of the recorded one.
+
+    Args:
+        fixture_dir: directory holding the recorded responses.
+        index: index of the fixture directory.
+        request: scrapy.Request to answer.
+
+    Raises:
+        FixtureException: If no response was recorded for the requested URL.
+
+    Returns:
+        scrapy.http.HtmlResponse: recorded response, bound to the request.
+
+    """
+
+    if request.url not in index:
+        raise FixtureException("No recorded response for {0}".format(request.url))
+
+    entry = index[request.url]
+    with open(os.path.join(fixture_dir, entry['file']), 'rb') as f:
+        body = f.read()
+
+    return HtmlResponse(url=request.url, status=entry['status'], headers=entry['headers'], body=body,
+                        encoding='utf-8', request=request)
+
+
+def replay(spider, fixture_dir, fetched=None):
+    """Function to run a spider over recorded responses, without a reactor nor network access.
+    Requests yielded by the spider are answered from the fixture directory as well.
+
+    Args:
+        spider: spider instance to run.
+        fixture_dir: directory holding the recorded responses.
+        fetched: optional list to which the URL of every answered request is appended.
+
+    Returns:
+        list: items yielded by the spider.
+
+    """
+
+    index = load_index(fixture_dir)
+    pending = list(spider.start_requests())
+    items = []
+
+    while pending:
+        request = pending.pop(0)
+        callback = request.callback or spider.parse
+        if fetched is not None:
+            fetched.append(request.url)
+
+        for output in callback(get_response(fixture_dir, index, request)) or []:
+            if isinstance(output, scrapy.Request):
+                pending.append(output)
+            else:
+                items.append(output)
+
+    return items
+
+
+def get_widget_responses(fixture_dir):
+    """Function to load every recorded page of the listing widget.
+
+    Args:
+        fixture_dir: directory holding the recorded responses.
+
+    Returns:
+        list: recorded widget responses, first page first.
+
+    """
+
+    index = load_index(fixture_dir)
+    responses = []
+    for page in range(len(index)):
+        request = scrapy.Request(get_widget_url(page), meta={'page': page})
+        if request.url not in index:
+            break
+        responses.append(get_response(fixture_dir, index, request))
+
+    return responses
+
+
+def time_rate(fn, repeat):
+    """Function to measure how many elements per second a function processes, keeping the best of
+    several runs.
+
+    Args:
+        fn: function to time, returning the number of processed elements.
+        repeat: number of runs.
+
+    Returns:
+        float: elements per second.
+
+    """
+
+    best = float('inf')
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = fn()
+        best = min(best, time.perf_counter() - start)
+
+    return count / best if best > 0 else float('inf')
+
+
+def benchmark(fixture_dir, repeat=10):
+    """Function to measure the throughput of the widget parsers and of the loader processors over
+    recorded responses.
+
+    Args:
+        fixture_dir: directory holding the recorded responses.
+        repeat: number of runs of every measure, of which the best one is kept.
+
+    Returns:
+        dict: items (or values) per second, per measure.
+
+    """
+
+    responses = get_widget_responses(fixture_dir)
+
+    def parse_apartments():
+        spider = SSSBApartmentInfoSpider()
+        return sum(1 for response in responses for _ in spider.parse_apartments(response))
+
+    def parse_states():
+        spider = SSSBApartmentStateSpider(state_path=os.devnull)
+        return sum(1 for response in responses for _ in spider.parse_states(response))
+
+    # Raw values as extracted by the spiders, before any processor ran
+    names = [x for r in responses for x in r.xpath('//h4[@class=\'\\"ObjektAdress\\"\']/a/text()').extract()]
+    prices = [x for r in responses for x in r.xpath('//dd[@class=\'\\"ObjektHyra\\"\']/text()').extract()]
+    interests = [x for r in responses for x in r.xpath('//dd[@class=\'\\"ObjektAntalIntresse\']/text()').extract()]
+
+    def apartment_processors():
+        SSSBApartmentLoader.apt_name_in(names)
+        SSSBApartmentLoader.apt_price_in(prices)
+        return len(names) + len(prices)
+
+    def state_processors():
+        SSSBApartmentStateLoader.apt_name_in(names)
+        SSSBApartmentStateLoader.apt_no_applicants_in(interests)
+        SSSBApartmentStateLoader.apt_top_credits_in(interests)
+        return len(names) + 2 * len(interests)
+
+    return {
+        'info parser (items/s)': time_rate(parse_apartments, repeat),
+        'state parser (items/s)': time_rate(parse_states, repeat),
+        'apartment loader processors (values/s)': time_rate(apartment_processors, repeat),
+        'state loader processors (values/s)': time_rate(state_processors, repeat),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record, replay and benchmark SSSB responses offline.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    record_parser = subparsers.add_parser('record', help='record the live website into a fixture directory')
+    record_parser.add_argument('fixture_dir', help='directory where the responses are written')
+    record_parser.add_argument('--details', action='store_true', help='record the apartment detail pages too')
+
+    replay_parser = subparsers.add_parser('replay', help='run a spider over a fixture directory')
+    replay_parser.add_argument('fixture_dir', help='directory holding the recorded responses')
+    replay_parser.add_argument('--spider', choices=sorted(SPIDERS), default=SSSBApartmentSpider.name,
+                               help='spider to run')
+
+    bench_parser = subparsers.add_parser('bench', help='benchmark the parsers over a fixture directory')
+    bench_parser.add_argument('fixture_dir', help='directory holding the recorded responses')
+    bench_parser.add_argument('--repeat', type=int, default=10, help='number of runs of every measure')
+
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        print('Recorded {0} responses'.format(len(record(args.fixture_dir, args.details))))
+
+    elif args.command == 'replay':
+        spider_class = SPIDERS[args.spider]
+        spider = spider_class() if spider_class is SSSBApartmentInfoSpider else spider_class(state_path=os.devnull)
+        for item in replay(spider, args.fixture_dir):
+            print(json.dumps(dict(item), ensure_ascii=False))
+
+    elif args.command == 'bench':
+        for measure, rate in benchmark(args.fixture_dir, args.repeat).items():
+            print('{0}: {1:.1f}'.format(measure, rate))
+
+    else:
+        parser.print_help()
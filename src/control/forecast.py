@@ -0,0 +1,163 @@
+"""Module forecasting the final winning credits of every apartment of an offering.
+
+A linear model final_credits ~ 1 + top_credits + no_applicants is kept per bucket of offer progress.
+Only the least-squares sufficient statistics (X'X and X'y) are stored, so absorbing a newly closed
+offer is a matter of adding its statistics, without going back to the whole history. Predictions
+for a whole offering are computed in one batched call.
+
+"""
+
+__author__ = 'Andres'
+
+import os
+
+import numpy as np
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'final_credits_model.npz')
+
+# Number of features: intercept, top credits and number of applicants
+NO_FEATURES = 3
+
+
+def get_features(top_credits, no_applicants):
+    """Function to build the design matrix of the model.
+
+    Args:
+        top_credits: array of top credits.
+        no_applicants: array of numbers of applicants.
+
+    Returns:
+        numpy.ndarray: matrix with one row per state.
+
+    """
+
+    top_credits = np.asarray(top_credits, dtype=float)
+    return np.column_stack([np.ones_like(top_credits), top_credits, np.asarray(no_applicants, dtype=float)])
+
+
+class FinalCreditsForecaster(object):
+    """Class holding one incrementally updatable linear model per bucket of offer progress.
+
+    """
+
+    def __init__(self, no_bins=20, ridge=1e-3):
+        """Constructor for an empty model.
+
+        Args:
+            no_bins: number of buckets into which the progress of an offer is split.
+            ridge: regularization keeping buckets with few observations solvable.
+
+        """
+
+        self.no_bins = no_bins
+        self.ridge = ridge
+        self.xtx = np.zeros((no_bins, NO_FEATURES, NO_FEATURES))
+        self.xty = np.zeros((no_bins, NO_FEATURES))
+        self.offers = set()
+
+    def get_bins(self, progress):
+        """Method to map offer progress values onto bucket indexes.
+
+        Args:
+            progress: array of values between 0 (start of the offer) and 1 (end of the offer).
+
+        Returns:
+            numpy.ndarray: bucket index of each value.
+
+        """
+
+        progress = np.nan_to_num(np.asarray(progress, dtype=float))
+        return np.clip((progress * self.no_bins).astype(int), 0, self.no_bins - 1)
+
+    def partial_fit(self, offer_ids, progress, top_credits, no_applicants, final_credits):
+        """Method to absorb the states of completed offers into the model. States of offers which
+        were already absorbed are ignored, so updating with the same offer twice is harmless.
+
+        Args:
+            offer_ids: offer of each state.
+            progress: offer progress at which each state was taken.
+            top_credits: top credits of each state.
+            no_applicants: number of applicants of each state.
+            final_credits: final credits of the apartment and offer of each state.
+
+        Returns:
+            FinalCreditsForecaster: the updated model.
+
+        """
+
+        offer_ids = np.asarray(offer_ids)
+        final_credits = np.asarray(final_credits, dtype=float)
+        new = ~np.isin(offer_ids, list(self.offers)) & ~np.isnan(final_credits)
+
+        bins = self.get_bins(np.asarray(progress)[new])
+        x = get_features(np.asarray(top_credits)[new], np.asarray(no_applicants)[new])
+
+        np.add.at(self.xtx, bins, x[:, :, None] * x[:, None, :])
+        np.add.at(self.xty, bins, x * final_credits[new][:, None])
+
+        self.offers.update(offer_ids[new].tolist())
+        return self
+
+    def get_weights(self):
+        """Method to solve the least-squares problem of every bucket.
+
+        Returns:
+            numpy.ndarray: weights of each bucket, one row per bucket.
+
+        """
+
+        xtx = self.xtx + self.ridge * np.eye(NO_FEATURES)
+        return np.linalg.solve(xtx, self.xty[:, :, None])[:, :, 0]
+
+    def predict(self, progress, top_credits, no_applicants):
+        """Method to forecast the final credits of a batch of apartments. Forecasts never go below
+        the current top credits, as these can only grow.
+
+        Args:
+            progress: current offer progress of each apartment.
+            top_credits: current top credits of each apartment.
+            no_applicants: current number of applicants of each apartment.
+
+        Returns:
+            numpy.ndarray: forecast final credits of each apartment.
+
+        """
+
+        weights = self.get_weights()[self.get_bins(progress)]
+        x = get_features(top_credits, no_applicants)
+        return np.maximum(np.einsum('ij,ij->i', x, weights), x[:, 1])
+
+    def save(self, path=DEFAULT_PATH):
+        """Method to store the model state.
+
+        Args:
+            path: path of the file to write.
+
+        """
+
+        np.savez(path, xtx=self.xtx, xty=self.xty, offers=np.array(sorted(self.offers), dtype=int),
+                 ridge=self.ridge)
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH, no_bins=20):
+        """Method to restore a stored model, or create an empty one if there is none.
+
+        Args:
+            path: path of the file to read.
+            no_bins: number of buckets for a new model.
+
+        Returns:
+            FinalCreditsForecaster: the restored model.
+
+        """
+
+        if not os.path.exists(path):
+            return cls(no_bins)
+
+        with np.load(path) as data:
+            model = cls(data['xtx'].shape[0], float(data['ridge']))
+            model.xtx = data['xtx']
+            model.xty = data['xty']
+            model.offers = set(data['offers'].tolist())
+
+        return model
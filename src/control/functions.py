@@ -1,15 +1,28 @@
-from src.control.sssb_scraper import SSSBApartmentInfoSpider, SSSBApartmentStateSpider
-from scrapy.crawler import CrawlerProcess, CrawlerRunner
+import matplotlib
+
+# Plots are only ever rendered to in-memory buffers
+matplotlib.use('Agg')
+
+from src.control.sssb_scraper import SSSBApartmentInfoSpider, SSSBApartmentStateSpider, SSSBApartmentSpider
+from scrapy.crawler import Crawler, CrawlerRunner
 from scrapy.utils.project import get_project_settings
+from twisted.internet import defer, threads
+import threading
 import time
 import src.data.db_ops as db_connection
 from src.data.db_ops import DatabaseException
-from src.control.selenium_scraper import SSSBApartmentOffer
+from src.control.selenium_scraper import SSSBBrowserSession
+from src.control.http_scraper import SSSBApartmentOfferHTTP
+from src.control.probability import compute_win_probabilities
+from src.control.forecast import FinalCreditsForecaster, DEFAULT_PATH as FORECAST_MODEL_PATH
 import json
 import requests
 import os
 from dotenv import load_dotenv
-from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from concurrent.futures import ProcessPoolExecutor
+import io
 from slackclient import SlackClient
 
 
@@ -45,118 +58,350 @@ def get_last_offer_timestamps():
         datetime.datetime, datetime.datetime = start and ending timestamps respectively.
     """
 
-    db_conn_status = db_connection.is_connected()
-
-    if not db_conn_status:
-        db_connection.connect()
-
     try:
-        start_date, end_date = db_connection.get_current_offer_dates()
-        return start_date, end_date
+        with db_connection.session():
+            start_date, end_date = db_connection.get_current_offer_dates()
+            return start_date, end_date
 
     except DatabaseException as e:
         print(str(e))
 
-    finally:
-        if not db_conn_status:
-            db_connection.disconnect()
-
 
-def get_last_offer_id():
+def get_last_offer_id(store=None):
     """Function to get the id of the current offer.
 
+    Args:
+        store: optional LocalStore to read from instead of the database.
+
     Returns:
         int = id of the desired offer.
     """
 
-    db_conn_status = db_connection.is_connected()
+    if store is not None:
+        return store.get_current_offer_id()
+
+    try:
+        with db_connection.session():
+            offer_id = db_connection.get_current_offer_id()
+            return offer_id
+
+    except DatabaseException as e:
+        print(str(e))
+
 
-    if not db_conn_status:
-        db_connection.connect()
+def close_offer(offer_id=None):
+    """Function to store the winning credits of every apartment of a closed offer, or of all
+    closed offers if none is given.
+
+    Args:
+        offer_id: id of the offer to close out.
+
+    Returns:
+        int: number of apartments whose winning credits were updated.
+    """
 
     try:
-        offer_id = db_connection.get_current_offer_id()
-        return offer_id
+        with db_connection.session():
+            updated = db_connection.set_win_credits(offer_id)
+            return updated
 
     except DatabaseException as e:
         print(str(e))
 
-    finally:
-        if not db_conn_status:
-            db_connection.disconnect()
 
+def check_crawl(crawler):
+    """ Function to check that the items scraped by a crawl were stored.
 
-def scrape_apartments():
-    """ Function to scrape meta data about available apartments via a Scrapy spider,
-    which inserts the acquired data into a database.
+    Args:
+        crawler: finished crawler.
+
+    Raises:
+        DatabaseException: If the pipelines failed to store some items.
+    """
+
+    if crawler.spider is not None and crawler.spider.store_failed:
+        raise DatabaseException("Failure to store the items scraped by {0}".format(crawler.spider.name))
+
+
+# Guards the start of the reactor shared by every crawl of the process
+reactor_lock = threading.Lock()
+
+
+def get_reactor():
+    """ Function to get the reactor every crawl of the process runs on. Unless something else
+        already runs it, e.g. the scheduler, it is started in a background thread and kept running,
+        so that the process can crawl any number of times.
+
+    Returns:
+        twisted.internet.interfaces.IReactorCore: running reactor.
+    """
+
+    # Imported here so that a caller can install another reactor (e.g. asyncio) beforehand
+    from twisted.internet import reactor
+
+    with reactor_lock:
+        if not reactor.running:
+            started = threading.Event()
+            reactor.callWhenRunning(started.set)
+            threading.Thread(target=reactor.run, kwargs={'installSignalHandlers': False},
+                             name='reactor', daemon=True).start()
+            started.wait()
+
+    return reactor
+
+
+def get_crawl_settings(pipelines, **extra):
+    """ Function to build the settings of a crawl.
+
+    Args:
+        pipelines: dictionary mapping the item pipelines of the crawl to their order.
+        extra: additional settings.
+
+    Returns:
+        scrapy.settings.Settings: crawl settings.
     """
 
     s = get_project_settings()
     s.update({
         'LOG_ENABLED': False,
         'LOG_ENCODING ': None,
-        'ITEM_PIPELINES': {
-            'pipelines.SSSBApartmentPipeline': 400,
-        }
+        'ITEM_PIPELINES': pipelines,
     })
+    s.update(extra)
+    return s
+
+
+@defer.inlineCallbacks
+def run_crawls(crawls, chained=True):
+    """ Function running several crawls with one CrawlerRunner, on the running reactor. When chained,
+        every crawl starts once the previous one is over and its items were stored; otherwise all of
+        them run concurrently. It must be called from the reactor thread.
+
+    Args:
+        crawls: list of (spider class, settings, spider arguments) tuples.
+        chained: if true, run the crawls one after the other.
+
+    Raises:
+        DatabaseException: If the pipelines failed to store the items of some crawl.
+
+    Returns:
+        twisted.internet.defer.Deferred: fired with the list of finished crawlers.
+    """
+
+    runner = CrawlerRunner()
+    crawlers = [Crawler(spider_class, settings) for spider_class, settings, _ in crawls]
+
+    if chained:
+        for crawler, (_, _, kwargs) in zip(crawlers, crawls):
+            yield runner.crawl(crawler, **kwargs)
+            check_crawl(crawler)
+    else:
+        yield defer.gatherResults([runner.crawl(crawler, **kwargs) for crawler, (_, _, kwargs) in zip(crawlers, crawls)],
+                                  consumeErrors=True)
+        for crawler in crawlers:
+            check_crawl(crawler)
 
-    process = CrawlerProcess(s)
+    defer.returnValue(crawlers)
 
-    spider = SSSBApartmentInfoSpider()
-    process.crawl(spider)
-    process.start()
 
+def crawl(crawls, chained=True):
+    """ Function running several crawls on the shared reactor and waiting for them to finish. It
+        must not be called from the reactor thread.
 
-def scrape_apartment_states():
+    Args:
+        crawls: list of (spider class, settings, spider arguments) tuples.
+        chained: if true, run the crawls one after the other.
+
+    Raises:
+        DatabaseException: If the pipelines failed to store the items of some crawl.
+
+    Returns:
+        list: finished crawlers.
+    """
+
+    return threads.blockingCallFromThread(get_reactor(), run_crawls, crawls, chained)
+
+
+def get_apartments_crawl():
+    """ Function to describe a crawl of the meta data about available apartments, which inserts the
+        acquired data into a database.
+
+    Returns:
+        (class, scrapy.settings.Settings, dict): spider class, settings and spider arguments.
+    """
+
+    return SSSBApartmentInfoSpider, get_crawl_settings({'pipelines.SSSBApartmentPipeline': 400}), {}
+
+
+def get_apartment_states_crawl(incremental=False, change_only=False):
+    """ Function to describe a crawl of the dynamic data about available apartments, which inserts
+        the acquired data into a database.
+
+    Args:
+        incremental: if true, widget pages unchanged since the previous scrape are skipped, and
+                     only apartments whose applicants or credits changed are parsed into items.
+        change_only: if true, only state transitions with respect to the database are written.
+
+    Returns:
+        (class, scrapy.settings.Settings, dict): spider class, settings and spider arguments.
+    """
+
+    return (SSSBApartmentStateSpider,
+            get_crawl_settings({'pipelines.SSSBApartmentStatePipeline': 400}, STATE_CHANGE_ONLY=change_only),
+            {'incremental': incremental})
+
+
+def get_apartments_and_states_crawl(incremental=False, change_only=False):
+    """ Function to describe a crawl of both meta data and dynamic data about available apartments
+        out of a single download of the listing, which inserts the acquired data into a database.
+
+    Args:
+        incremental: if true, widget pages unchanged since the previous scrape are skipped, and
+                     only apartments whose applicants or credits changed are parsed into items.
+        change_only: if true, only state transitions with respect to the database are written.
+
+    Returns:
+        (class, scrapy.settings.Settings, dict): spider class, settings and spider arguments.
+    """
+
+    # Both pipelines see every item and only process their own type. The catalog comes first so
+    # that it is synchronized before any state is written.
+    pipelines = {
+        'pipelines.SSSBApartmentPipeline': 300,
+        'pipelines.SSSBApartmentStatePipeline': 400,
+    }
+    return (SSSBApartmentSpider, get_crawl_settings(pipelines, STATE_CHANGE_ONLY=change_only),
+            {'incremental': incremental})
+
+
+def scrape_apartments():
+    """ Function to scrape meta data about available apartments via a Scrapy spider,
+    which inserts the acquired data into a database.
+    """
+
+    crawl([get_apartments_crawl()])
+
+
+def scrape_apartment_states(incremental=False, change_only=False):
     """ Function to scrape dynamic data about available apartments via a Scrapy spider,
-        which inserts the acquired data into a database.
+        which inserts the acquired data into a database. Every listing is scraped unless
+        incremental is set.
+
+    Args:
+        incremental: if true, widget pages unchanged since the previous scrape are skipped, and
+                     only apartments whose applicants or credits changed are parsed into items.
+        change_only: if true, only state transitions with respect to the database are written.
     """
 
-    s = get_project_settings()
-    s.update({
-        'LOG_ENABLED': False,
-        'LOG_ENCODING ': None,
-        'ITEM_PIPELINES': {
-            'pipelines.SSSBApartmentStatePipeline': 400,
-        }
-    })
+    crawl([get_apartment_states_crawl(incremental, change_only)])
 
-    process = CrawlerProcess(s)
 
-    spider = SSSBApartmentStateSpider()
-    process.crawl(spider)
-    process.start()
+def scrape_apartments_and_states(incremental=False, change_only=False):
+    """ Function to scrape both meta data and dynamic data about available apartments out of a
+        single download of the listing, which inserts the acquired data into a database. Meant
+        for an open offer: states are only attributed to an offer once it was scraped, so at an
+        offer rollover the catalog and offering have to be loaded first.
+
+    Args:
+        incremental: if true, widget pages unchanged since the previous scrape are skipped, and
+                     only apartments whose applicants or credits changed are parsed into state
+                     items.
+        change_only: if true, only state transitions with respect to the database are written.
+    """
 
+    crawl([get_apartments_and_states_crawl(incremental, change_only)])
 
-def scrape_offering():
-    """ Function to scrape timing data about an apartment offering via a Selenium crawler,
-        which inserts the acquired data into a database.
+
+def get_offer_workers():
+    """ Function to get the number of browsers fetching detail pages concurrently when the offering
+        is scraped with Selenium, as set by SSSB_OFFER_WORKERS.
+
+    Returns:
+        int: number of browsers, 4 if not set.
     """
 
-    sssb_selenium = SSSBApartmentOffer()
+    dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
+    load_dotenv(dotenv_path)
+    return int(os.getenv("SSSB_OFFER_WORKERS") or 4)
+
+
+def scrape_offering(browser=None, no_workers=1):
+    """ Function to scrape timing data about an apartment offering over plain HTTP, which inserts the
+        acquired data into a database. The Selenium crawler takes over the apartments which could
+        not be scraped, or the whole offering if the HTTP crawler could not log in.
+
+    Args:
+        browser: SSSBBrowserSession to borrow the browser from. A new one is used if not given.
+        no_workers: number of browsers fetching detail pages concurrently in the Selenium fallback.
+    """
+
+    failed = None
+    sssb_http = SSSBApartmentOfferHTTP()
     try:
-        sssb_selenium.login()
-        sssb_selenium.scrape_offering()
+        sssb_http.login()
+        if sssb_http.logged_in:
+            failed = sssb_http.scrape_offering()
+            if not failed:
+                return
+
+            print("HTTP offering scrape missed some apartments, falling back to Selenium:\n\t" + ", ".join(failed))
+
+    except Exception as e:
+        print("HTTP offering scrape failed, falling back to Selenium:\n\t" + str(e))
 
     finally:
-        sssb_selenium.close_browser()
+        sssb_http.close()
+
+    if browser is None:
+        with SSSBBrowserSession() as browser:
+            scrape_offering_with_browser(browser, no_workers, failed)
+    else:
+        scrape_offering_with_browser(browser, no_workers, failed)
 
 
-def get_live_offering_size():
+def scrape_offering_with_browser(browser, no_workers=1, urls=None):
+    """ Function to scrape timing data about an apartment offering via the Selenium crawler,
+        either sequentially or with a pool of browsers.
+
+    Args:
+        browser: SSSBBrowserSession to borrow the browser from.
+        no_workers: number of browsers fetching detail pages concurrently.
+        urls: detail page URLs to scrape, instead of the whole offering.
+    """
+
+    crawler = browser.login()
+    if no_workers > 1 or urls:
+        crawler.scrape_offering_parallel(no_workers, urls)
+    else:
+        crawler.scrape_offering()
+
+
+def get_live_offering_size(browser=None):
     """ Function to get the number of apartments currently being offered from the
-    SSSB website.
+    SSSB website, reading the listing over plain HTTP and only falling back to a browser if that fails.
+
+    Args:
+        browser: SSSBBrowserSession to borrow the browser from in the fallback. A new one is used if not given.
 
     Returns:
         int: number of apartments in live offering.
     """
 
-    sssb_selenium = SSSBApartmentOffer()
+    sssb_http = SSSBApartmentOfferHTTP()
     try:
-        no_apts = sssb_selenium.get_no_apartments()
-        return no_apts
+        return sssb_http.get_no_apartments()
+
+    except Exception as e:
+        print("HTTP offering size failed, falling back to Selenium:\n\t" + str(e))
 
     finally:
-        sssb_selenium.close_browser()
+        sssb_http.close()
+
+    if browser is not None:
+        return browser.launch().get_no_apartments()
+
+    with SSSBBrowserSession() as browser:
+        return browser.launch().get_no_apartments()
 
 
 def get_db_offering_size():
@@ -167,104 +412,116 @@ def get_db_offering_size():
         int: number of apartments in last db-inserted offering.
     """
 
-    db_conn_status = db_connection.is_connected()
-
-    if not db_conn_status:
-        db_connection.connect()
-
     try:
-        size = db_connection.get_current_offer_size()
-        return size
+        with db_connection.session():
+            size = db_connection.get_current_offer_size()
+            return size
 
     except DatabaseException as e:
         print(str(e))
 
-    finally:
-        if not db_conn_status:
-            db_connection.disconnect()
-
 
-def get_offered_apartments(offer_id):
+def get_offered_apartments(offer_id, store=None):
     """ Function to get a list of apartment ids for a given offer.
 
     Args:
         offer_id: id of desired apartment offering.
+        store: optional LocalStore to read from instead of the database.
 
     Returns:
         list: list containing the ids of the desired apartments.
     """
 
-    db_conn_status = db_connection.is_connected()
-
-    if not db_conn_status:
-        db_connection.connect()
+    if store is not None:
+        return store.get_offered_apartments(offer_id)
 
     try:
-        apt_list = db_connection.get_offered_apartments(offer_id)
-        return apt_list
+        with db_connection.session():
+            apt_list = db_connection.get_offered_apartments(offer_id)
+            return apt_list
 
     except DatabaseException as e:
         print(str(e))
 
-    finally:
-        if not db_conn_status:
-            db_connection.disconnect()
-
 
-def get_top_credits_hist(offer_id, apartment_list):
+def get_top_credits_hist(offer_id, apartment_list, resolution=None, store=None):
     """Function to get the time series of the top credits for the specified offer and apartments.
 
     Args:
         offer_id: id of desired apartment offering.
         apartment_list: list of apartment ids whose info we want to retrieve.
+        resolution: optional PostgreSQL interval (e.g. '1 hour'). If given, the series is bucketed
+                    by the database, keeping the last value per bucket.
+        store: optional LocalStore to read from instead of the database.
 
     Returns:
         pandas.DataFrame: data frame containing the "top_credits" times series for each apartment.
     """
 
-    db_conn_status = db_connection.is_connected()
-
-    if not db_conn_status:
-        db_connection.connect()
+    if store is not None:
+        return store.get_all_top_credits(offer_id, apartment_list, resolution)
 
     try:
-        df = db_connection.get_all_top_credits(offer_id, apartment_list)
-        return df
+        with db_connection.session():
+            df = db_connection.get_all_top_credits(offer_id, apartment_list, resolution)
+            return df
 
     except DatabaseException as e:
         print(str(e))
 
-    finally:
-        if not db_conn_status:
-            db_connection.disconnect()
-
 
-def get_applicants_hist(offer_id, apartment_list):
+def get_applicants_hist(offer_id, apartment_list, resolution=None, store=None):
     """Function to get the time series of the number of applicants for the specified offer and apartments.
 
     Args:
         offer_id: id of desired apartment offering.
         apartment_list: list of apartment ids whose info we want to retrieve.
+        resolution: optional PostgreSQL interval (e.g. '1 hour'). If given, the series is bucketed
+                    by the database, keeping the last value per bucket.
+        store: optional LocalStore to read from instead of the database.
 
     Returns:
         pandas.DataFrame: data frame containing the "no_applicants" times series for each apartment.
     """
 
-    db_conn_status = db_connection.is_connected()
-
-    if not db_conn_status:
-        db_connection.connect()
+    if store is not None:
+        return store.get_all_no_applicants(offer_id, apartment_list, resolution)
 
     try:
-        df = db_connection.get_all_no_applicants(offer_id, apartment_list)
-        return df
+        with db_connection.session():
+            df = db_connection.get_all_no_applicants(offer_id, apartment_list, resolution)
+            return df
 
     except DatabaseException as e:
         print(str(e))
 
-    finally:
-        if not db_conn_status:
-            db_connection.disconnect()
+
+def get_state_hist_by_type(offer_id, type, resolution=None, store=None):
+    """Function to get the time series of both the top credits and the number of applicants for the
+    apartments having a given type in the specified offer.
+
+    Args:
+        offer_id: id of desired apartment offering.
+        type: apartment type to use for filtering results.
+        resolution: optional PostgreSQL interval (e.g. '1 hour'). If given, the series are bucketed
+                    by the database, keeping the last values per bucket.
+        store: optional LocalStore to read from instead of the database.
+
+    Returns:
+        pandas.DataFrame: data frame whose "top_credits" and "no_applicants" column groups contain
+                          the time series for each apartment.
+    """
+
+    if store is not None:
+        return store.get_state_history_by_type(offer_id, type, resolution)
+
+    try:
+        with db_connection.session():
+            df = db_connection.get_state_history_by_type(offer_id, type, resolution)
+            return df
+
+    except DatabaseException as e:
+        print(str(e))
 
 
 def get_offered_apartments_by_type(offer_id, type):
@@ -278,103 +535,201 @@ def get_offered_apartments_by_type(offer_id, type):
         list: list containing the ids of the desired apartments.
     """
 
-    db_conn_status = db_connection.is_connected()
+    try:
+        with db_connection.session():
+            apt_list = db_connection.get_offered_apartments_by_type(offer_id, type)
+            return apt_list
+
+    except DatabaseException as e:
+        print(str(e))
+
+
+def get_win_probabilities(own_credits):
+    """Function to estimate the probability of getting each apartment currently being offered,
+    learning how top credits evolve from the completed offers.
+
+    Args:
+        own_credits: current credit days.
+
+    Returns:
+        pandas.DataFrame: latest state of every apartment being offered, with a "probability" column.
+    """
+
+    try:
+        with db_connection.session():
+            history = db_connection.get_closed_offer_trajectories()
+            current = db_connection.get_open_offer_states()
+
+        return compute_win_probabilities(history, current, own_credits).sort_values('probability',
+                                                                                    ascending=False)
+
+    except DatabaseException as e:
+        print(str(e))
 
-    if not db_conn_status:
-        db_connection.connect()
+
+def forecast_final_credits(model_path=FORECAST_MODEL_PATH):
+    """Function to forecast the final winning credits of every apartment currently being offered.
+    The stored model is first updated with the offers closed since its last update, if any.
+
+    Args:
+        model_path: path of the file keeping the forecasting model.
+
+    Returns:
+        pandas.DataFrame: latest state of every apartment being offered, with a "forecast" column.
+    """
+
+    model = FinalCreditsForecaster.load(model_path)
 
     try:
-        apt_list = db_connection.get_offered_apartments_by_type(offer_id, type)
-        return apt_list
+        with db_connection.session():
+            history = db_connection.get_closed_offer_trajectories(model.offers)
+            current = db_connection.get_open_offer_states()
 
     except DatabaseException as e:
         print(str(e))
+        return None
 
-    finally:
-        if not db_conn_status:
-            db_connection.disconnect()
+    if not history.empty:
+        model.partial_fit(history['nidoffer'].values, history['progress'].values, history['top_credits'].values,
+                          history['no_applicants'].values, history['final_credits'].values)
+        model.save(model_path)
+
+    current['forecast'] = model.predict(current['progress'].values, current['top_credits'].values,
+                                        current['no_applicants'].values)
+    return current
 
 
-def plot_time_series(series, data=None, own_credits=None):
+def plot_time_series(series, data=None, own_credits=None, store=None):
     """ Function to generate a plot of the top credits or number of applicants time series.
+    The figure is built with the object-oriented API on an Agg canvas, without pyplot global state.
 
     Args:
         series: boolean representing the nature of the data (True for "credits" and False for "applicants").
-        data: id of desired apartment offering.
+        data: data frame containing the times series to plot for each apartment.
         own_credits: current credit days.
+        store: optional LocalStore to read from instead of the database, if no data is given.
 
     Returns:
-        pandas.DataFrame: data frame containing the specified times series for each apartment.
+        matplotlib.figure.Figure: figure containing the plot.
     """
     light_gray = (225 / 255., 225 / 255., 225 / 255.)
     lightest_gray = (250 / 255., 250 / 255., 250 / 255.)
 
-    f = plt.figure(figsize=(12, 6))
+    f = Figure(figsize=(12, 6))
+    FigureCanvasAgg(f)
+    ax = f.add_subplot(111)
 
     if series:
-        plt.title('Top credits', fontsize=18)
-        filename = "topCredits.png"
+        ax.set_title('Top credits', fontsize=18)
     else:
-        plt.title('Number of applicants', fontsize=18)
-        filename = "numberOfApplicants.png"
+        ax.set_title('Number of applicants', fontsize=18)
 
     if data is None:
-        last_offer_id = get_last_offer_id()
-        apts = get_offered_apartments(last_offer_id)
+        last_offer_id = get_last_offer_id(store)
+        apts = get_offered_apartments(last_offer_id, store)
 
         if series:
-            data = get_top_credits_hist(last_offer_id, apts)
+            data = get_top_credits_hist(last_offer_id, apts, store=store)
         else:
-            data = get_applicants_hist(last_offer_id, apts)
-
-    data = data.fillna(method='ffill')
-    data.plot(ax=f.gca())
-    lgd = plt.legend(loc='center left', bbox_to_anchor=(1.0, 0.5))
-    plt.grid(b=True, color=light_gray, linestyle='-')
+            data = get_applicants_hist(last_offer_id, apts, store=store)
 
-    ax = plt.gca()
+    # Every value holds until the next change, so the series are drawn as steps rather than ramps
+    data = data.ffill()
+    data.plot(ax=ax, drawstyle='steps-post')
+    ax.legend(loc='center left', bbox_to_anchor=(1.0, 0.5))
+    ax.grid(True, color=light_gray, linestyle='-')
     ax.set_facecolor(lightest_gray)
 
     if series and own_credits is not None:
-        plt.axhline(own_credits, color='k', linestyle='--')
-
-    f.savefig(filename, bbox_extra_artists=(lgd,), bbox_inches='tight')
+        ax.axhline(own_credits, color='k', linestyle='--')
 
     return f
 
 
-def gen_plots_kitchenette(offer_id, own_credits):
-    knt = get_offered_apartments_by_type(offer_id, 'Ett rum med pentry')
+def render_figure(f):
+    """ Function to render a figure into an in-memory PNG image.
+
+    Args:
+        f: figure to render.
 
-    df1 = get_top_credits_hist(offer_id, knt)
-    df2 = get_applicants_hist(offer_id, knt)
-    data1 = df1.fillna(method='ffill')
-    data2 = df2.fillna(method='ffill')
+    Returns:
+        bytes: PNG image.
+    """
 
-    f = plot_time_series(True, data1, own_credits)
-    g = plot_time_series(False, data2, own_credits)
+    buffer = io.BytesIO()
+    legends = tuple(ax.get_legend() for ax in f.axes if ax.get_legend() is not None)
+    f.savefig(buffer, format='png', bbox_extra_artists=legends, bbox_inches='tight')
+    return buffer.getvalue()
 
-    return f, g
 
+def render_time_series(task):
+    """ Function to render one time series plot into an in-memory PNG image. It only depends on its
+    arguments, so it can run in a worker process.
 
-def gen_plots_single_room(offer_id, own_credits):
-    knt = get_offered_apartments_by_type(offer_id, 'Enkelrum, (rum i korridor)')
+    Args:
+        task: (title, series, data, own_credits) tuple, as taken by plot_time_series.
+
+    Returns:
+        (string, bytes): title and PNG image of the plot.
+    """
+
+    title, series, data, own_credits = task
+    return title, render_figure(plot_time_series(series, data, own_credits))
+
+
+def render_plots(offer_id, own_credits, apartment_types, store=None, no_workers=None, resolution=None):
+    """ Function to render the top credits and number of applicants plots of several apartment types
+    in a process pool, keeping every image in memory.
+
+    Args:
+        offer_id: id of desired apartment offering.
+        own_credits: current credit days.
+        apartment_types: dictionary mapping the label used in the titles to an apartment type.
+        store: optional LocalStore to read from instead of the database.
+        no_workers: number of worker processes, as many as CPUs if None.
+        resolution: optional bucket width (e.g. '1 hour') of the plotted series. Every state is
+                    plotted if None.
+
+    Returns:
+        list: (title, PNG image) pairs.
+    """
 
-    df1 = get_top_credits_hist(offer_id, knt)
-    df2 = get_applicants_hist(offer_id, knt)
-    data1 = df1.fillna(method='ffill')
-    data2 = df2.fillna(method='ffill')
+    tasks = []
+    for label, apt_type in apartment_types.items():
+        data = get_state_hist_by_type(offer_id, apt_type, resolution, store)
+        tasks.append(("{0}: Top credits".format(label), True, data['top_credits'], own_credits))
+        tasks.append(("{0}: Number of applicants".format(label), False, data['no_applicants'], own_credits))
 
-    f = plot_time_series(True, data1, own_credits)
-    g = plot_time_series(False, data2, own_credits)
+    with ProcessPoolExecutor(max_workers=no_workers) as executor:
+        return list(executor.map(render_time_series, tasks))
+
+
+def gen_plots_kitchenette(offer_id, own_credits, store=None):
+    data = get_state_hist_by_type(offer_id, 'Ett rum med pentry', store=store)
+
+    f = plot_time_series(True, data['top_credits'], own_credits)
+    g = plot_time_series(False, data['no_applicants'], own_credits)
 
     return f, g
 
 
-def post_slack_image(filepath, title):
+def gen_plots_single_room(offer_id, own_credits, store=None):
+    data = get_state_hist_by_type(offer_id, 'Enkelrum, (rum i korridor)', store=store)
+
+    f = plot_time_series(True, data['top_credits'], own_credits)
+    g = plot_time_series(False, data['no_applicants'], own_credits)
+
+    return f, g
+
+
+def post_slack_image(image, title):
     """Function in charge of posting notifications to Slack's channel "sssb",
     in the form of apartment data plots.
 
+    Args:
+        image: either the path of an image file or the image contents.
+        title: title of the posted image.
+
     """
 
     dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
@@ -383,14 +738,19 @@ def post_slack_image(filepath, title):
 
     sc = SlackClient(slack_token)
 
-    with open(filepath, 'rb') as file_content:
-        sc.api_call(
-            "files.upload",
-            channels="#sssb_sketch",
-            file=file_content,
-            title=title,
-            username='SlackBot',
-        )
+    if isinstance(image, bytes):
+        file_content = image
+    else:
+        with open(image, 'rb') as f:
+            file_content = f.read()
+
+    sc.api_call(
+        "files.upload",
+        channels="#sssb_sketch",
+        file=file_content,
+        title=title,
+        username='SlackBot',
+    )
 
 
 def send_slack_notification(*args):
@@ -468,4 +828,4 @@ def send_slack_notification(*args):
 
 
 if __name__ == '__main__':
-    post_slack_image('topCredits.png')
+    post_slack_image('topCredits.png', 'Top credits')
@@ -0,0 +1,191 @@
+"""Module defining the plain-HTTP crawler that retrieves logged-in offer data from SSSB, without
+spawning a browser.
+
+"""
+
+__author__ = 'Andres'
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+from dotenv import load_dotenv
+from scrapy import Selector
+
+import src.data.db_ops as db_connection
+from src.data.db_ops import DatabaseException
+from src.control.selenium_scraper import SSSB_FRONTPAGE, parse_offer_deadline
+from src.control.sssb_scraper import get_widget_url, get_no_pages
+
+
+def unescape_widget_value(x):
+    """Function to undo the JSONP escaping of attribute values found in the widget payload.
+
+    Args:
+        x: escaped string, e.g. '\\"https:\\/\\/www.sssb.se\\/...\\"'.
+
+    Returns:
+        string: unescaped value.
+    """
+
+    return x.replace('\\/', '/').strip('\\"')
+
+
+class SSSBApartmentOfferHTTP:
+    """Class for scraping offer deadlines over plain HTTP, fetching detail pages concurrently.
+
+    """
+
+    def __init__(self, max_workers=8, timeout=30):
+        self.session = requests.Session()
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+        self.logged_in = False
+
+    def login(self):
+        """Method to login into the SSSB webpage, keeping the session cookie for later requests.
+        """
+
+        dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
+        load_dotenv(dotenv_path)
+        sssb_username = os.getenv("SSSB_USERNAME")
+        sssb_pass = os.getenv("SSSB_PASS")
+
+        try:
+            response = self.session.get(SSSB_FRONTPAGE, timeout=self.timeout)
+            response.raise_for_status()
+
+            form = Selector(text=response.text).xpath('//*[@id="header-loginform"]')
+            action = urljoin(response.url, form.xpath('@action').extract_first() or '')
+
+            # Hidden fields (nonces, redirects) must be posted back along with the credentials
+            data = {field.xpath('@name').extract_first(): field.xpath('@value').extract_first() or ''
+                    for field in form.xpath('.//input[@type="hidden"]')}
+            data[form.xpath('.//*[@id="user_login"]/@name').extract_first()] = sssb_username
+            data[form.xpath('.//*[@id="user_pass"]/@name').extract_first()] = sssb_pass
+
+            response = self.session.post(action, data=data, timeout=self.timeout)
+            response.raise_for_status()
+
+            # Rejected credentials bring back the login form instead of the member pages
+            if Selector(text=response.text).xpath('//*[@id="header-loginform"]'):
+                print("Could not login:\n\tCredentials rejected")
+                return
+
+            self.logged_in = True
+
+        except Exception as e:
+            print("Could not login:\n\t" + str(e))
+
+    def get_widget_page(self, page):
+        """Method to read a page of the listing widget.
+
+        Args:
+            page: page index, starting at 0.
+
+        Returns:
+            scrapy.Selector: selector over the page.
+        """
+
+        response = self.session.get(get_widget_url(page), timeout=self.timeout)
+        response.raise_for_status()
+
+        return Selector(text=response.text)
+
+    def get_apartment_urls(self):
+        """Method to get the detail page URLs of the apartments currently being offered, reading
+        the first page of the listing widget and then the remaining ones concurrently.
+
+        Returns:
+            list: detail page URLs without duplicates, in listing order.
+        """
+
+        first = self.get_widget_page(0)
+        no_pages = get_no_pages(int(first.xpath('(//strong)[1]/text()').extract_first() or 0))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pages = [first] + list(executor.map(self.get_widget_page, range(1, no_pages)))
+
+        urls = []
+        seen = set()
+        for page in pages:
+            for href in page.xpath('//h4[@class=\'\\"ObjektAdress\\"\']/a/@href').extract():
+                url = urljoin(SSSB_FRONTPAGE, unescape_widget_value(href))
+                # Listings shifting between pages during the crawl may show up twice
+                if url not in seen:
+                    seen.add(url)
+                    urls.append(url)
+
+        return urls
+
+    def get_no_apartments(self):
+        """Method to get the number of apartments currently being offered.
+
+        Returns:
+            int: no. of apartments being offered.
+        """
+
+        return len(self.get_apartment_urls())
+
+    def get_apartment_and_offer(self, url):
+        """Method to get the name and offer deadline for an apartment from its detail page.
+
+        Args:
+            url: URL of the apartment detail page.
+
+        Returns:
+            list: list containing the name of the current apartment (position 0),
+                    as well as the date defining its offer deadline (position 1).
+                    None if the page could not be fetched or parsed.
+        """
+
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+
+            selector = Selector(text=response.text)
+            apt_name = selector.xpath(
+                'normalize-space(//*[@id="SubNavigationContentContainer"]/div/div/div[1]/div[2]/h1)').extract_first()
+            offering = selector.xpath(
+                'normalize-space(//*[@id="SubNavigationContentContainer"]/div/div/div[1]/div[6]/div)').extract_first()
+
+            return [apt_name, parse_offer_deadline(offering)]
+
+        except (requests.RequestException, IndexError, ValueError) as e:
+            print("Error getting apartment {0}: {1}".format(url, str(e)))
+            return None
+
+    def scrape_offering(self):
+        """Method to obtain the name and offer deadline for each available apartment, fetching the
+        detail pages concurrently, and insert them into the database in one batch.
+
+        Returns:
+            list: URLs of the apartments which could not be scraped, None if not logged in.
+        """
+
+        if not self.logged_in:
+            # Apartments from current offering
+            print("Cannot get offering. Not logged in.")
+            return None
+
+        urls = self.get_apartment_urls()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            offers = list(executor.map(self.get_apartment_and_offer, urls))
+
+        try:
+            with db_connection.session():
+                db_connection.set_offered_apartments([info for info in offers if info is not None])
+
+        except DatabaseException as e:
+            print(str(e))
+
+        return [url for url, info in zip(urls, offers) if info is None]
+
+    def close(self):
+        """Method to close the underlying HTTP session.
+        """
+
+        self.session.close()
@@ -5,57 +5,87 @@ import datetime
 
 import src.data.db_ops as db_connection
 from scrapy.exporters import JsonLinesItemExporter
-from scrapy.xlib.pydispatch import dispatcher
-from scrapy import signals
+from src.control.items import SSSBApartmentItem, SSSBApartmentStateItem
 from src.data.db_ops import DatabaseException
 
 __author__ = 'Andres'
 
 
 class SSSBApartmentPipeline(object):
-    """Class for processing scraped apartment items and insert them into database.
+    """Class for processing scraped apartment items and synchronize them with the database.
+        The whole catalog is collected during the crawl and applied as one upsert batch.
 
     """
 
     def __init__(self):
         """Constructor for initializing connection to database and
-            insert counters, as well as spider closed signal.
+            catalog buffer.
 
         """
 
-        # dispatcher.connect(self.spider_opened, signals.spider_opened)
-        dispatcher.connect(self.spider_closed, signals.spider_closed)
+        self.catalog = []
+        self.failed = False
 
         try:
             db_connection.connect()
         except DatabaseException as e:
             print(str(e))
 
-    def spider_closed(self, spider):
+    def flush(self):
+        """Method that synchronizes the buffered catalog with the database.
+
+        """
+
+        if not self.catalog:
+            return
+
+        catalog, self.catalog = self.catalog, []
+
+        try:
+            counts = db_connection.sync_apartments(catalog)
+            print("Apartment catalog: {inserted} inserted, {updated} updated, {unchanged} unchanged".format(**counts))
+
+        except DatabaseException as e:
+            self.failed = True
+            print("Failure to synchronize apartment catalog: " + str(e))
+
+    def close_spider(self, spider):
         """Method that sets action to do when the spider is closed,
-            in this case, close database connection and send slack
-            notification.
+            in this case, synchronize the scraped catalog and close
+            database connection.
 
         Args:
             spider: spider calling this pipeline.
 
         """
 
-        db_connection.disconnect()
+        try:
+            self.flush()
+        finally:
+            db_connection.disconnect()
+
+        if self.failed:
+            # The spider must not remember this crawl as processed
+            spider.store_failed = True
 
     def process_item(self, item, spider):
-        """Method in charge of validating scraped data and insert it into database.
+        """Method in charge of validating scraped data and buffer it for synchronization with database.
 
         Args:
             item: scraped item to validate and insert into database.
             spider: spider calling this pipeline.
 
         Returns:
-            item: validated item, in case everything went smoothly.
-                    None, in case DatabaseException was raised when inserting to database.
+            item: validated item.
 
         """
 
+        if not isinstance(item, SSSBApartmentItem):
+            # Spiders yield the whole catalog before any state, so the catalog is complete and
+            # is synchronized before the states referring to it reach the database.
+            self.flush()
+            return item
+
         apt_name = item['apt_name']
         apt_type = item['apt_type']
         apt_zone = item['apt_zone']
@@ -64,68 +94,114 @@ class SSSBApartmentPipeline(object):
         electricity = item['electricity'] if 'electricity' in item else 'False'
         _10_month = item['_10_month'] if '_10_month' in item else 'False'
 
-        try:
-            db_connection.set_apartment(apt_name, apt_type, apt_zone, apt_price, furnitured, electricity, _10_month)
-            return item
-
-        except DatabaseException as e:
-            print("Failure to insert some data: " + str(e))
-            return None
+        self.catalog.append((apt_name, apt_type, apt_zone, apt_price, furnitured, electricity, _10_month))
+        return item
 
 
 class SSSBApartmentStatePipeline(object):
     """Class for processing scraped apartment state items and insert them into database.
+        Items are buffered and written in batches, each batch within a single transaction.
+        In change-only mode, snapshots equal to the last known state of the apartment in
+        the same offer are not written.
 
     """
 
-    def __init__(self):
+    # Maximum number of buffered items before forcing a flush
+    batch_size = 1000
+
+    def __init__(self, change_only=False):
         """Constructor for initializing connection to database and
-            insert counters, as well as spider closed signal.
+            insert buffer.
+
+        Args:
+            change_only: if true, only state transitions are written.
 
         """
 
-        # dispatcher.connect(self.spider_opened, signals.spider_opened)
-        dispatcher.connect(self.spider_closed, signals.spider_closed)
+        self.buffer = []
+        self.last_states = None
+        self.failed = False
 
         try:
             db_connection.connect()
+            if change_only:
+                self.last_states = db_connection.get_last_states()
         except DatabaseException as e:
             print(str(e))
 
-    def spider_closed(self, spider):
+    @classmethod
+    def from_crawler(cls, crawler):
+        """Method building the pipeline from the crawler settings.
+
+        Args:
+            crawler: crawler running this pipeline.
+
+        """
+
+        return cls(change_only=crawler.settings.getbool('STATE_CHANGE_ONLY'))
+
+    def flush(self):
+        """Method that writes all buffered states into the database in one transaction.
+
+        """
+
+        if not self.buffer:
+            return
+
+        states, self.buffer = self.buffer, []
+        start = time.time()
+
+        try:
+            inserted = db_connection.set_apartment_states(states, self.last_states)
+            elapsed = time.time() - start
+            print("Inserted {0} states in {1:.3f}s ({2:.1f} rows/s)".format(
+                inserted, elapsed, inserted / elapsed if elapsed > 0 else float('inf')))
+
+        except DatabaseException as e:
+            self.failed = True
+            print("Failure to insert some data: " + str(e))
+
+    def close_spider(self, spider):
         """Method that sets action to do when the spider is closed,
-            in this case, close database connection and send slack
-            notification.
+            in this case, flush pending states and close database connection.
 
         Args:
             spider: spider calling this pipeline.
 
         """
 
-        db_connection.disconnect()
+        try:
+            self.flush()
+        finally:
+            db_connection.disconnect()
+
+        if self.failed:
+            # The spider must not remember this crawl as processed
+            spider.store_failed = True
 
     def process_item(self, item, spider):
-        """Method in charge of validating scraped data and insert it into database.
+        """Method in charge of validating scraped data and buffer it for insertion into database.
 
         Args:
             item: scraped item to validate and insert into database.
             spider: spider calling this pipeline.
 
         Returns:
-            item: validated item, in case everything went smoothly.
-                    None, in case DatabaseException was raised when inserting to database.
+            item: validated item.
 
         """
 
+        if not isinstance(item, SSSBApartmentStateItem):
+            return item
+
         state_timestamp = item['state_timestamp']
         apt_name = item['apt_name']
         apt_no_applicants = item['apt_no_applicants']
         apt_top_credits = item['apt_top_credits']
 
-        try:
-            db_connection.set_apartment_state(state_timestamp, apt_name, apt_no_applicants, apt_top_credits)
-            return item
+        self.buffer.append((state_timestamp, apt_name, apt_no_applicants, apt_top_credits))
 
-        except DatabaseException as e:
-            print("Failure to insert some data: " + str(e))
-            return None
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+        return item
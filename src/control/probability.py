@@ -0,0 +1,129 @@
+"""Module estimating the probability of getting an apartment given one's own credit days.
+
+For an apartment whose top credits are currently c, someone with d credit days wins if the credits
+of the best applicant at the end of the offer stay below d. How much the top credits still grow from
+a given point of an offer is learnt from completed offers, per bucket of offer progress, and the
+probability is the share of historical growths smaller than d - c.
+
+Every apartment is evaluated at once over NumPy arrays.
+
+"""
+
+__author__ = 'Andres'
+
+import numpy as np
+
+
+class WinProbabilityModel(object):
+    """Class holding the empirical distribution of top credits growth per bucket of offer progress.
+
+    """
+
+    def __init__(self, no_bins=20):
+        """Constructor for an empty model.
+
+        Args:
+            no_bins: number of buckets into which the progress of an offer is split.
+
+        """
+
+        self.no_bins = no_bins
+        self.span = 1
+        self.keys = np.empty(0)
+        self.counts = np.zeros(no_bins, dtype=int)
+        self.growth = np.empty(0)
+
+    def get_bins(self, progress):
+        """Method to map offer progress values onto bucket indexes.
+
+        Args:
+            progress: array of values between 0 (start of the offer) and 1 (end of the offer).
+
+        Returns:
+            numpy.ndarray: bucket index of each value.
+
+        """
+
+        progress = np.nan_to_num(np.asarray(progress, dtype=float))
+        return np.clip((progress * self.no_bins).astype(int), 0, self.no_bins - 1)
+
+    def fit(self, progress, top_credits, final_credits):
+        """Method to learn the growth distributions from states of completed offers.
+
+        Args:
+            progress: offer progress at which each state was taken.
+            top_credits: top credits of each state.
+            final_credits: final credits of the apartment and offer of each state.
+
+        Returns:
+            WinProbabilityModel: the fitted model.
+
+        """
+
+        bins = self.get_bins(progress)
+        growth = np.maximum(np.asarray(final_credits, dtype=float) - np.asarray(top_credits, dtype=float), 0)
+
+        valid = ~np.isnan(growth)
+        bins, growth = bins[valid], growth[valid]
+
+        # All buckets share one sorted array, each shifted by a multiple of a span exceeding any growth,
+        # so that counting the growths below a threshold is a single searchsorted for every apartment.
+        self.span = growth.max() + 1 if growth.size else 1
+        self.keys = np.sort(bins * self.span + growth)
+        self.counts = np.bincount(bins, minlength=self.no_bins)
+        self.growth = np.sort(growth)
+
+        return self
+
+    def predict(self, progress, top_credits, own_credits):
+        """Method to estimate the probability of getting each apartment.
+
+        Args:
+            progress: current offer progress of each apartment.
+            top_credits: current top credits of each apartment.
+            own_credits: own credit days, either a scalar or one value per apartment.
+
+        Returns:
+            numpy.ndarray: probability of getting each apartment.
+
+        """
+
+        bins = self.get_bins(progress)
+        margin = np.asarray(own_credits, dtype=float) - np.asarray(top_credits, dtype=float)
+        margin = np.clip(np.broadcast_to(margin, bins.shape), 0, self.span)
+
+        if self.growth.size == 0:
+            # No history to learn from: only the current top credits can be compared against
+            return (margin > 0).astype(float)
+
+        base = bins * self.span
+        below = np.searchsorted(self.keys, base + margin, side='left') - np.searchsorted(self.keys, base, side='left')
+        counts = self.counts[bins]
+
+        # Buckets without history fall back to the growth observed over the whole offer
+        pooled = np.searchsorted(self.growth, margin, side='left') / float(self.growth.size)
+
+        return np.where(counts > 0, below / np.maximum(counts, 1).astype(float), pooled)
+
+
+def compute_win_probabilities(history, current, own_credits, no_bins=20):
+    """Function to estimate the probability of getting every apartment currently being offered.
+
+    Args:
+        history: data frame with progress, top_credits and final_credits columns from completed offers.
+        current: data frame with progress and top_credits columns for the apartments being offered.
+        own_credits: own credit days.
+        no_bins: number of buckets into which the progress of an offer is split.
+
+    Returns:
+        pandas.DataFrame: copy of current with an additional "probability" column.
+
+    """
+
+    model = WinProbabilityModel(no_bins).fit(history['progress'].values,
+                                             history['top_credits'].values,
+                                             history['final_credits'].values)
+
+    result = current.copy()
+    result['probability'] = model.predict(current['progress'].values, current['top_credits'].values, own_credits)
+    return result
@@ -0,0 +1,204 @@
+"""Long-running scheduler replacing the cron-invoked upload scripts.
+
+Imports, the database connection pool and the id caches are loaded once and stay warm. Apartment
+states are scraped on an interval that shortens as the end of the current offer approaches, and the
+catalog and offering are refreshed once an offer rolls over. The latency of every job is logged.
+
+The event loop is Twisted's asyncio reactor, so every crawl runs in-process on the one reactor
+Scrapy needs, which is never stopped between crawls.
+
+"""
+
+__author__ = 'Andres'
+
+import asyncio
+
+if __name__ == '__main__':
+    # Installed before anything imports twisted.internet.reactor, which installs the default one
+    from twisted.internet import asyncioreactor
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    asyncioreactor.install(asyncio.get_event_loop())
+
+import datetime
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import src.control.functions as fn
+import src.data.db_ops as db_connection
+
+dirname = os.path.dirname(__file__)
+hdlr = logging.FileHandler(os.path.join(dirname,
+                                        '../../Logs/SSSBScheduler.log'),
+                           encoding="UTF-8")
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+hdlr.setFormatter(formatter)
+consoleHandler = logging.StreamHandler()
+consoleHandler.setFormatter(formatter)
+
+log = logging.getLogger('sssb_scheduler')
+log.addHandler(hdlr)
+log.addHandler(consoleHandler)
+log.setLevel(logging.INFO)
+
+# Bounds of the interval between state scrapes, in seconds
+MIN_STATE_INTERVAL = 5 * 60
+MAX_STATE_INTERVAL = 60 * 60
+
+# Fraction of the time left until the end of the offer waited between state scrapes
+STATE_INTERVAL_FRACTION = 1 / 24.
+
+# Time given to the website to publish a new offering once the current one ends, in seconds
+ROLLOVER_GRACE = 5 * 60
+
+
+class JobMetrics(object):
+    """Class keeping latency statistics per job.
+
+    """
+
+    def __init__(self):
+        self.jobs = {}
+
+    def record(self, name, latency, success):
+        """Method to record one execution of a job.
+
+        Args:
+            name: name of the job.
+            latency: duration of the execution, in seconds.
+            success: whether the execution succeeded.
+
+        """
+
+        job = self.jobs.setdefault(name, {'runs': 0, 'failures': 0, 'last': None, 'mean': 0., 'max': 0.})
+        job['runs'] += 1
+        job['failures'] += 0 if success else 1
+        job['last'] = latency
+        job['mean'] += (latency - job['mean']) / job['runs']
+        job['max'] = max(job['max'], latency)
+
+    def get(self):
+        """Method to get the statistics of every job.
+
+        Returns:
+            dict: runs, failures and last, mean and max latency in seconds, per job.
+
+        """
+
+        return {name: dict(job) for name, job in self.jobs.items()}
+
+
+def get_state_interval(end_date, now):
+    """Function to get the time to wait until the next state scrape, which shortens as the end of
+    the offer approaches.
+
+    Args:
+        end_date: end of the current offer.
+        now: current timestamp.
+
+    Returns:
+        float: seconds to wait.
+
+    """
+
+    remaining = (end_date - now).total_seconds()
+    interval = remaining * STATE_INTERVAL_FRACTION
+    return min(max(interval, MIN_STATE_INTERVAL), MAX_STATE_INTERVAL, max(remaining, 0) + ROLLOVER_GRACE)
+
+
+class Scheduler(object):
+    """Class running the upload jobs on an asyncio event loop.
+
+    """
+
+    def __init__(self):
+        self.metrics = JobMetrics()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.closed_offer = None
+        self.offer_workers = fn.get_offer_workers()
+
+    async def run_job(self, name, target, *args):
+        """Method running a blocking job off the event loop, recording its latency and reporting
+        failures to Slack.
+
+        Args:
+            name: name of the job.
+            target: function to run.
+            args: arguments of the function.
+
+        Returns:
+            result of the job, None if it failed.
+
+        """
+
+        loop = asyncio.get_event_loop()
+        start = time.time()
+        try:
+            result = await loop.run_in_executor(self.executor, lambda: target(*args))
+            self.metrics.record(name, time.time() - start, True)
+            return result
+
+        except Exception as e:
+            self.metrics.record(name, time.time() - start, False)
+            log.error('{0}: {1}'.format(name, str(e)))
+            fn.send_slack_notification(name, 0, str(e))
+            return None
+
+        finally:
+            log.info('{0}: {1}'.format(name, self.metrics.get()[name]))
+
+    async def tick(self):
+        """Method running the jobs due at this point and computing when the next ones are.
+
+        Returns:
+            float: seconds to wait until the next tick.
+
+        """
+
+        timestamps = await self.run_job("Offer timestamps", fn.get_last_offer_timestamps)
+        if timestamps is None:
+            return MIN_STATE_INTERVAL
+
+        start_date, end_date = timestamps
+        now = datetime.datetime.now(end_date.tzinfo)
+
+        if start_date <= now <= end_date:
+            await self.run_job("Apartment state upload", fn.scrape_apartments_and_states, False, True)
+            return get_state_interval(end_date, now)
+
+        if (now - end_date).total_seconds() < ROLLOVER_GRACE:
+            return ROLLOVER_GRACE - (now - end_date).total_seconds()
+
+        # Offer rollover: close the last offer out and load the new catalog and offering
+        offer_id = await self.run_job("Offer id", fn.get_last_offer_id)
+        if offer_id is not None and offer_id != self.closed_offer:
+            await self.run_job("Offer close-out", fn.close_offer, offer_id)
+            self.closed_offer = offer_id
+
+        # States are not scraped until the new offer exists, or they would belong to no offer
+        await self.run_job("Apartment catalog upload", fn.scrape_apartments)
+        await self.run_job("Apartment offering upload", fn.scrape_offering, None, self.offer_workers)
+        return MIN_STATE_INTERVAL
+
+    async def run_forever(self):
+        """Method running ticks until the process is stopped.
+
+        """
+
+        while True:
+            delay = await self.tick()
+            await asyncio.sleep(delay)
+
+
+if __name__ == '__main__':
+    from twisted.internet import defer, reactor
+
+    scheduler = Scheduler()
+    d = defer.Deferred.fromFuture(asyncio.ensure_future(scheduler.run_forever()))
+    d.addErrback(lambda failure: log.error(failure.getTraceback()))
+    d.addBoth(lambda _: reactor.stop())
+    try:
+        reactor.run()
+    finally:
+        db_connection.close_pool()
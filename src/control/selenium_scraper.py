@@ -4,6 +4,10 @@
 
 __author__ = 'Andres'
 
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from selenium import webdriver
 from dotenv import load_dotenv
 import os
@@ -13,12 +17,20 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
 import src.data.db_ops as db_connection
 from src.data.db_ops import DatabaseException
+from src.control.sssb_scraper import PAGE_SIZE, get_no_pages
 from pytz import timezone
 from datetime import datetime
 
 SSSB_FRONTPAGE = 'https://www.sssb.se/en'
 SSSB_AVAILABLE_APARTMENTS = 'https://www.sssb.se/en/find-apartment/apply-for-apartment/available-apartments' \
-                            '/?pagination=0&paginationantal=100 '
+                            '/?pagination={0}&paginationantal={1}'
+SSSB_APARTMENT_LINKS = '//*[@id="SubNavigationContentContainer"]/div[4]/div/div/div/div[2]/div/div[1]/h4/a'
+
+# Maximum number of attempts at scraping a single apartment
+MAX_ATTEMPTS = 5
+
+# Deadline date and time within the offering text, whatever the language of the page
+DEADLINE_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2})\D+?(\d{1,2}:\d{2})')
 
 
 class ApartmentException(Exception):
@@ -29,6 +41,32 @@ class ApartmentException(Exception):
     pass
 
 
+def parse_offer_deadline(offering):
+    """Function to parse the offer deadline out of the text shown in an apartment's detail page.
+
+    Args:
+        offering: text of the offering element, holding the deadline date (YYYY-MM-DD) followed by
+                  its time (HH:MM), e.g. 'Erbjudandet publiceras till 2019-03-04 kl 12:00' or
+                  'Sista dag att anmäla intresse: 2019-03-04 klockan 12:00'.
+
+    Raises:
+        ValueError: If the text holds no deadline.
+
+    Returns:
+        datetime.datetime: timezone-aware offer deadline.
+    """
+
+    match = DEADLINE_PATTERN.search(offering or '')
+    if match is None:
+        raise ValueError("No offer deadline in '{0}'".format(offering))
+
+    end_date_and_time = '{0} {1}:00'.format(match.group(1), match.group(2))
+
+    datetime_object_raw = datetime.strptime(end_date_and_time, '%Y-%m-%d %H:%M:%S')
+    current_tz = timezone('Europe/Stockholm')
+    return current_tz.localize(datetime_object_raw.replace(tzinfo=None))
+
+
 class SSSBApartmentOffer:
     def __init__(self):
         dirname = os.path.dirname(__file__)
@@ -84,7 +122,7 @@ class SSSBApartmentOffer:
         Returns:
             int: no. of apartments being offered.
         """
-        self.browser.get(SSSB_AVAILABLE_APARTMENTS)
+        self.browser.get(SSSB_AVAILABLE_APARTMENTS.format(0, PAGE_SIZE))
 
         try:
             # Wait until the number of available apartments is displayed
@@ -106,14 +144,17 @@ class SSSBApartmentOffer:
         available-apartments list.
 
         Args:
-            index: position in the available apartments list view.
+            index: position in the available apartments list view, starting at 1.
 
         Returns:
             list: list containing the name of the current apartment (position 0),
                     as well as the date defining its offer deadline (position 1).
         """
 
-        self.browser.get(SSSB_AVAILABLE_APARTMENTS)
+        # The list view is paginated, so the index is split into page and position within the page
+        page, index = divmod(index - 1, PAGE_SIZE)
+        index += 1
+        self.browser.get(SSSB_AVAILABLE_APARTMENTS.format(page, PAGE_SIZE))
 
         try:
             # Wait until the corresponding apartment link is loaded
@@ -125,44 +166,121 @@ class SSSBApartmentOffer:
                      )))
             current_apt.click()
 
-            # Wait until the apartment info is loaded
-            self.browser.implicitly_wait(2)
-            try:
-                apt_name = WebDriverWait(self.browser, 15).until(
-                    EC.visibility_of_element_located(
-                        (By.XPATH,
-                         '//*[@id="SubNavigationContentContainer"]/div/div/div[1]/div[2]/h1'
-                         )))
+            return self.read_apartment_and_offer()
+
+        except TimeoutException as e:
+            print("Loading apartment link took too much time!")
+            return None
 
-                apt_name = apt_name.text
+    def get_apartment_urls(self):
+        """Method to get the detail page URLs of every apartment from a single read of each page of
+        the available-apartments list.
+
+        Returns:
+            list: detail page URLs without duplicates, in listing order.
+        """
 
-                offering = WebDriverWait(self.browser, 15).until(
-                    EC.visibility_of_element_located(
-                        (By.XPATH,
-                         '//*[@id="SubNavigationContentContainer"]/div/div/div[1]/div[6]/div'
-                         )))
-                offering = offering.text
-                split_text = offering.split()
-                end_date_and_time = '{0} {1}:00'.format(split_text[3], split_text[5])
+        urls = []
+        for page in range(get_no_pages(self.get_no_apartments())):
+            self.browser.get(SSSB_AVAILABLE_APARTMENTS.format(page, PAGE_SIZE))
 
-                datetime_object_raw = datetime.strptime(end_date_and_time, '%Y-%m-%d %H:%M:%S')
-                current_tz = timezone('Europe/Stockholm')
-                datetime_object = current_tz.localize(datetime_object_raw.replace(tzinfo=None))
+            try:
+                WebDriverWait(self.browser, 10).until(
+                    EC.presence_of_element_located((By.XPATH, SSSB_APARTMENT_LINKS)))
 
-                return [apt_name, datetime_object]
+                for link in self.browser.find_elements_by_xpath(SSSB_APARTMENT_LINKS):
+                    url = link.get_attribute('href')
+                    # Listings shifting between pages during the crawl may show up twice
+                    if url not in urls:
+                        urls.append(url)
 
             except TimeoutException:
-                print("Loading apartment took too much time!")
-                return None
+                print("Loading apartment links took too much time!")
+                raise
 
-            except StaleElementReferenceException as e:
-                print("Error getting element")
-                return None
+        return urls
 
-        except TimeoutException as e:
-            print("Loading apartment link took too much time!")
+    def get_apartment_and_offer_by_url(self, url):
+        """Method to get the name and offer deadline for an apartment by navigating straight to its
+        detail page.
+
+        Args:
+            url: URL of the apartment detail page.
+
+        Returns:
+            list: list containing the name of the current apartment (position 0),
+                    as well as the date defining its offer deadline (position 1).
+        """
+
+        try:
+            self.browser.get(url)
+        except TimeoutException:
+            print("Loading apartment took too much time!")
             return None
 
+        return self.read_apartment_and_offer()
+
+    def read_apartment_and_offer(self):
+        """Method to read the name and offer deadline from the currently loaded apartment detail page.
+
+        Returns:
+            list: list containing the name of the current apartment (position 0),
+                    as well as the date defining its offer deadline (position 1).
+        """
+
+        # Wait until the apartment info is loaded
+        self.browser.implicitly_wait(2)
+        try:
+            apt_name = WebDriverWait(self.browser, 15).until(
+                EC.visibility_of_element_located(
+                    (By.XPATH,
+                     '//*[@id="SubNavigationContentContainer"]/div/div/div[1]/div[2]/h1'
+                     )))
+
+            apt_name = apt_name.text
+
+            offering = WebDriverWait(self.browser, 15).until(
+                EC.visibility_of_element_located(
+                    (By.XPATH,
+                     '//*[@id="SubNavigationContentContainer"]/div/div/div[1]/div[6]/div'
+                     )))
+            datetime_object = parse_offer_deadline(offering.text)
+
+            return [apt_name, datetime_object]
+
+        except TimeoutException:
+            print("Loading apartment took too much time!")
+            return None
+
+        except StaleElementReferenceException as e:
+            print("Error getting element")
+            return None
+
+    def scrape_urls(self, urls):
+        """Method to obtain the name and offer deadline for each of the given apartment detail pages.
+        Apartments which cannot be scraped within the retry cap are skipped and reported.
+
+        Args:
+            urls: detail page URLs to scrape.
+
+        Returns:
+            (list, list): [apartment name, offer deadline] pairs, and URLs which could not be scraped.
+        """
+
+        offers = []
+        failed = []
+        for url in urls:
+            # For avoiding dangerous loops, every apartment gets a bounded number of attempts
+            for attempt in range(MAX_ATTEMPTS):
+                info = self.get_apartment_and_offer_by_url(url)
+                if info is not None:
+                    offers.append(info)
+                    break
+            else:
+                failed.append(url)
+
+        return offers, failed
+
     def scrape_offering(self):
         """Method to systematically obtain the name and offer deadline for each available apartment and
         insert it into the database.
@@ -171,49 +289,171 @@ class SSSBApartmentOffer:
         if self.logged_in:
             no_apts = self.get_no_apartments()
 
-            db_conn_status = db_connection.is_connected()
-
-            if not db_conn_status:
-                db_connection.connect()
-
             try:
-                # For each apartment
-                i = 1
-                # For avoiding dangerous loops
-                j = 0
-                while i <= no_apts:
-
-                    if j >= 5:
-                        raise ApartmentException("Cannot get past apartment \"{0}\"".format(apt_name))
-
-                    info = self.get_apartment_and_offer(i)
-                    if info is not None:
-                        apt_name = info[0]
-                        end_date_and_time = info[1]
-
-                        try:
-                            db_connection.set_is_offered(apt_name, end_date_and_time)
-                            # Only advance to next apartment if the current one was successfully scraped.
-                            i = i + 1
-                            j = 0
-
-                        except DatabaseException as e:
+                with db_connection.session():
+                    # For each apartment
+                    i = 1
+                    # For avoiding dangerous loops
+                    j = 0
+                    while i <= no_apts:
+
+                        if j >= MAX_ATTEMPTS:
+                            raise ApartmentException("Cannot get past apartment no. {0}".format(i))
+
+                        info = self.get_apartment_and_offer(i)
+                        if info is None:
                             j = j + 1
-                            print("Failure to insert some data: " + str(e))
+                        else:
+                            apt_name = info[0]
+                            end_date_and_time = info[1]
+
+                            try:
+                                db_connection.set_is_offered(apt_name, end_date_and_time)
+                                # Only advance to next apartment if the current one was successfully scraped.
+                                i = i + 1
+                                j = 0
+
+                            except DatabaseException as e:
+                                j = j + 1
+                                print("Failure to insert some data: " + str(e))
 
             except DatabaseException as e:
                 print(str(e))
 
-            finally:
-                if not db_conn_status:
-                    db_connection.disconnect()
-
         else:
             # Apartments from current offering
             print("Cannot get offering. Not logged in.")
 
+    def scrape_offering_parallel(self, no_workers=4, urls=None):
+        """Method to obtain the name and offer deadline for each available apartment with a pool of
+        browsers, and insert them into the database in one batch. The detail URLs are read once
+        from the list page and split across the workers, this browser being one of them.
+
+        Args:
+            no_workers: number of browsers fetching detail pages concurrently.
+            urls: detail page URLs to scrape, instead of every apartment of the list page.
+
+        Raises:
+            ApartmentException: If some apartments could not be scraped, once the others are stored.
+        """
+
+        if not self.logged_in:
+            # Apartments from current offering
+            print("Cannot get offering. Not logged in.")
+            return
+
+        if urls is None:
+            urls = self.get_apartment_urls()
+        # No browser is launched for workers which would have nothing to fetch
+        chunks = [chunk for chunk in (urls[k::no_workers] for k in range(no_workers)) if chunk]
+        if not chunks:
+            return
+
+        def work(k):
+            if k == 0:
+                return self.scrape_urls(chunks[k])
+
+            worker = SSSBApartmentOffer()
+            try:
+                worker.login()
+                return worker.scrape_urls(chunks[k])
+            finally:
+                worker.close_browser()
+
+        offers = []
+        failed = []
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            futures = [executor.submit(work, k) for k in range(len(chunks))]
+
+            # A failing worker must not discard what the others scraped
+            for k, future in enumerate(futures):
+                try:
+                    chunk_offers, chunk_failed = future.result()
+                except Exception as e:
+                    print("Worker {0} failed: {1}".format(k, str(e)))
+                    chunk_offers, chunk_failed = [], chunks[k]
+
+                offers.extend(chunk_offers)
+                failed.extend(chunk_failed)
+
+        try:
+            with db_connection.session():
+                db_connection.set_offered_apartments(offers)
+
+        except DatabaseException as e:
+            print(str(e))
+
+        if failed:
+            raise ApartmentException("Cannot get past apartments: {0}".format(", ".join(failed)))
+
     def close_browser(self):
         """Method to close the current webdriver session and all open Firefox windows spawned by this class.
         """
 
         self.browser.quit()
+
+
+class SSSBBrowserSession:
+    """Class managing a single headless browser for the duration of a job. The browser is launched
+    and logged in at most once, and lent to every step needing it.
+
+    """
+
+    def __init__(self):
+        self.crawler = None
+        self.launch_time = None
+        self.login_time = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def launch(self):
+        """Method to get the session's crawler, launching the browser on first use.
+
+        Returns:
+            SSSBApartmentOffer: crawler wrapping the live browser.
+        """
+
+        if self.crawler is None:
+            start = time.time()
+            self.crawler = SSSBApartmentOffer()
+            self.launch_time = time.time() - start
+
+        return self.crawler
+
+    def login(self):
+        """Method to get the session's crawler, logged into the SSSB webpage.
+
+        Returns:
+            SSSBApartmentOffer: logged-in crawler wrapping the live browser.
+        """
+
+        crawler = self.launch()
+
+        if not crawler.logged_in:
+            start = time.time()
+            crawler.browser.get(SSSB_FRONTPAGE)
+            crawler.login()
+            self.login_time = time.time() - start
+
+        return crawler
+
+    def get_timings(self):
+        """Method to get the time spent launching the browser and logging in, in seconds.
+
+        Returns:
+            dict: launch and login timings, None for steps that did not take place.
+        """
+
+        return {'launch': self.launch_time, 'login': self.login_time}
+
+    def close(self):
+        """Method to close the browser, if it was ever launched.
+        """
+
+        if self.crawler is not None:
+            self.crawler.close_browser()
+            self.crawler = None
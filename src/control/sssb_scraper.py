@@ -5,6 +5,9 @@
 
 __author__ = 'Andres'
 
+import hashlib
+import json
+import os
 import time
 
 import scrapy
@@ -15,6 +18,114 @@ from src.control.item_loaders import SSSBApartmentLoader, SSSBApartmentStateLoad
 from src.control.items import SSSBApartmentItem, SSSBApartmentStateItem
 
 
+# File keeping the widget validators and last seen listing values between runs
+CRAWL_STATE_PATH = os.path.join(os.path.dirname(__file__), '.crawl_state.json')
+
+# Number of listings requested per widget page
+PAGE_SIZE = 100
+
+WIDGET_URL = ('https://www.sssb.se/widgets/?pagination={0}&paginationantal={1}'
+              '&callback=jQuery17208255315905375711_1549963009511'
+              '&widgets%5B%5D=alert&widgets%5B%5D=objektsummering%40lagenheter&widgets%5B%5D=objektfilter'
+              '%40lagenheter&widgets%5B%5D=objektsortering%40lagenheter&widgets%5B%5D=objektlistabilder'
+              '%40lagenheter&widgets%5B%5D=paginering%40lagenheter&widgets%5B%5D=pagineringantal%40lagenheter'
+              '&widgets%5B%5D=pagineringgofirst%40lagenheter&widgets%5B%5D=pagineringgonew%40lagenheter&widgets'
+              '%5B%5D=pagineringlista%40lagenheter&widgets%5B%5D=pagineringgoold%40lagenheter&widgets%5B%5D'
+              '=pagineringgolast%40lagenheter')
+
+
+def get_widget_url(page, page_size=PAGE_SIZE):
+    """Function to get the URL of a page of the listing widget.
+
+    Args:
+        page: page index, starting at 0.
+        page_size: number of listings per page.
+
+    Returns:
+        string: URL of the page.
+
+    """
+
+    return WIDGET_URL.format(page, page_size)
+
+
+def get_no_pages(no_listings, page_size=PAGE_SIZE):
+    """Function to get the number of widget pages holding the whole listing.
+
+    Args:
+        no_listings: total number of listings.
+        page_size: number of listings per page.
+
+    Returns:
+        int: number of pages, at least 1.
+
+    """
+
+    return max(1, -(-no_listings // page_size))
+
+
+def get_listings(response):
+    """Function to select the block of every listing in a widget page, i.e. the element holding
+    both its intro (address, type, properties) and its details (zone, rent, applicants). Every
+    field is read relative to its own block, so a listing missing a field cannot shift the values
+    of the following ones.
+
+    Args:
+        response: HTTP response.
+
+    Returns:
+        scrapy.selector.SelectorList: one selector per listing, in listing order.
+
+    """
+
+    return response.xpath('//div[contains(@class, \'ObjektIntro\')]/..')
+
+
+def get_no_listings(response):
+    """Function to read the total number of listings shown in a widget page.
+
+    Args:
+        response: HTTP response.
+
+    Returns:
+        int: number of listings over all pages.
+
+    """
+
+    return int(response.xpath('(//strong)[1]/text()').extract()[0])
+
+
+def load_crawl_state(path):
+    """Function to load the change-detection state stored by a previous crawl.
+
+    Args:
+        path: path of the state file.
+
+    Returns:
+        dict: stored state, empty if there is none.
+
+    """
+
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_crawl_state(path, state):
+    """Function to store the change-detection state of the current crawl.
+
+    Args:
+        path: path of the state file.
+        state: dictionary to store.
+
+    """
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+
+
 def get_timestamp():
     """Function to get today's date.
 
@@ -26,20 +137,75 @@ def get_timestamp():
     return time.strftime('%Y-%m-%d %H:%M:%S')
 
 
-class SSSBApartmentInfoSpider(scrapy.Spider):
+class SSSBWidgetSpider(scrapy.Spider):
+    """Base class for the spiders crawling the paginated SSSB listing widget.
+
+    """
+
+    start_urls = [get_widget_url(0)]
+
+    def __init__(self, *args, **kwargs):
+        """Constructor taking the timestamp of the crawl.
+
+        """
+
+        super(SSSBWidgetSpider, self).__init__(*args, **kwargs)
+
+        # Taken per crawl rather than at import, as one process may run many crawls
+        self.date = get_timestamp()
+
+        # Set by the pipelines when scraped items could not be stored
+        self.store_failed = False
+
+    def start_requests(self):
+        """Method issuing the request for the first widget page, which tells how many follow.
+
+        """
+
+        yield self.get_page_request(0)
+
+    def get_page_request(self, page):
+        """Method building the request for a widget page.
+
+        Args:
+            page: page index, starting at 0.
+
+        Returns:
+            scrapy.Request: request for the page.
+
+        """
+
+        return scrapy.Request(get_widget_url(page), dont_filter=True, meta={'page': page})
+
+    def get_next_page_requests(self, no_listings):
+        """Method building the requests for every widget page after the first one. They are all
+        yielded at once, so Scrapy downloads them concurrently.
+
+        Args:
+            no_listings: total number of listings.
+
+        Returns:
+            list: requests for the remaining pages.
+
+        """
+
+        return [self.get_page_request(page) for page in range(1, get_no_pages(no_listings))]
+
+
+class SSSBApartmentInfoSpider(SSSBWidgetSpider):
     """Class for scraping SSSB apartment offerings meta data.
 
     """
 
     name = "sssb_apt_spider"
-    start_urls = ['https://www.sssb.se/widgets/?paginationantal=100&callback=jQuery17208255315905375711_1549963009511'
-                  '&widgets%5B%5D=alert&widgets%5B%5D=objektsummering%40lagenheter&widgets%5B%5D=objektfilter'
-                  '%40lagenheter&widgets%5B%5D=objektsortering%40lagenheter&widgets%5B%5D=objektlistabilder'
-                  '%40lagenheter&widgets%5B%5D=paginering%40lagenheter&widgets%5B%5D=pagineringantal%40lagenheter'
-                  '&widgets%5B%5D=pagineringgofirst%40lagenheter&widgets%5B%5D=pagineringgonew%40lagenheter&widgets'
-                  '%5B%5D=pagineringlista%40lagenheter&widgets%5B%5D=pagineringgoold%40lagenheter&widgets%5B%5D'
-                  '=pagineringgolast%40lagenheter']
-    date = get_timestamp()
+
+    def __init__(self, *args, **kwargs):
+        """Constructor for the set of already parsed apartments.
+
+        """
+
+        super(SSSBApartmentInfoSpider, self).__init__(*args, **kwargs)
+        self.seen_apartments = set()
 
     def parse(self, response):
         """Method in charge of retrieving relevant data from Bloomberg quotes
@@ -50,57 +216,243 @@ class SSSBApartmentInfoSpider(scrapy.Spider):
 
         """
 
-        n = int(response.xpath('(//strong)[1]/text()').extract()[0])
-        selectors = response.xpath('//div[contains(@class, \'ObjektIntro\')]')
+        if response.meta.get('page', 0) == 0:
+            for request in self.get_next_page_requests(get_no_listings(response)):
+                yield request
+
+        for item in self.parse_apartments(response):
+            yield item
 
-        for i in range(1, n + 1):
-            l = SSSBApartmentLoader(item=SSSBApartmentItem(), selector=selectors[i - 1])
+    def parse_apartments(self, response):
+        """Method in charge of parsing the meta data of every listing in a widget page. Listings
+            already parsed from another page, e.g. because the listing shifted between pages
+            during the crawl, are skipped.
+
+        Args:
+            response: HTTP response.
+
+        """
+
+        for listing in get_listings(response):
+            l = SSSBApartmentLoader(item=SSSBApartmentItem(), selector=listing)
             l.add_xpath('apt_name', './/h4[@class=\'\\"ObjektAdress\\"\']/a/text()')
             l.add_xpath('apt_type', './/h3[@class=\'\\"ObjektTyp\\"\']/a/text()')
-            l.add_xpath('apt_zone', '(//dd[@class=\'\\"ObjektOmrade\\"\']/a)[{0}]/text()'.format(i))
-            l.add_xpath('apt_price', '(//dd[@class=\'\\"ObjektHyra\\"\'])[{0}]/text()'.format(i))
+            l.add_xpath('apt_zone', './/dd[@class=\'\\"ObjektOmrade\\"\']/a/text()')
+            l.add_xpath('apt_price', './/dd[@class=\'\\"ObjektHyra\\"\']/text()')
             l.add_xpath('furnitured', './/div[@class=\'\\"ObjektEgenskaper\\"\']/div['
                                       '@data-title=\'\\"Möblerad\\"\']/span/text()')
             l.add_xpath('electricity', './/div[@class=\'\\"ObjektEgenskaper\\"\']/div['
                                        '@data-title=\'\\"Elström\']/span/text()')
             l.add_xpath('_10_month', './/div[@class=\'\\"ObjektEgenskaper\\"\']/div['
                                      '@data-title=\'\\"10-månadershyra\']/span/text()')
-            yield l.load_item()
+            item = l.load_item()
+
+            if item.get('apt_name') is None or item.get('apt_name') in self.seen_apartments:
+                continue
+
+            self.seen_apartments.add(item.get('apt_name'))
+            yield item
 
 
-class SSSBApartmentStateSpider(scrapy.Spider):
+class SSSBApartmentStateSpider(SSSBWidgetSpider):
     """Class for scraping SSSB apartments dynamic info.
 
     """
 
     name = "sssb_st_spider"
-    start_urls = ['https://www.sssb.se/widgets/?paginationantal=100&callback=jQuery17208255315905375711_1549963009511'
-                  '&widgets%5B%5D=alert&widgets%5B%5D=objektsummering%40lagenheter&widgets%5B%5D=objektfilter'
-                  '%40lagenheter&widgets%5B%5D=objektsortering%40lagenheter&widgets%5B%5D=objektlistabilder'
-                  '%40lagenheter&widgets%5B%5D=paginering%40lagenheter&widgets%5B%5D=pagineringantal%40lagenheter'
-                  '&widgets%5B%5D=pagineringgofirst%40lagenheter&widgets%5B%5D=pagineringgonew%40lagenheter&widgets'
-                  '%5B%5D=pagineringlista%40lagenheter&widgets%5B%5D=pagineringgoold%40lagenheter&widgets%5B%5D'
-                  '=pagineringgolast%40lagenheter']
-    date = get_timestamp()
+    handle_httpstatus_list = [304]
+
+    def __init__(self, incremental=False, state_path=CRAWL_STATE_PATH, *args, **kwargs):
+        """Constructor loading the change-detection state of the previous crawl.
+
+        Args:
+            incremental: if true, pages and listings whose values did not change since the previous
+                crawl are skipped.
+            state_path: path of the file keeping the change-detection state between crawls.
+
+        """
+
+        super(SSSBApartmentStateSpider, self).__init__(*args, **kwargs)
+        self.incremental = incremental in (True, 'True', 'true', '1')
+        self.state_path = state_path
+        self.crawl_state = load_crawl_state(state_path)
+        self.seen_states = set()
+
+        # Listings of pages which turn out unchanged are carried over from the previous crawl
+        self.new_crawl_state = {
+            'count': self.crawl_state.get('count', 0),
+            'pages': {},
+            'listings': dict(self.crawl_state.get('listings', {})),
+        }
+
+    def get_page_request(self, page):
+        """Method building the request for a widget page. In an incremental crawl it is made
+            conditional, whenever the server provided validators for the page before.
+
+        Args:
+            page: page index, starting at 0.
+
+        Returns:
+            scrapy.Request: request for the page.
+
+        """
+
+        request = super(SSSBApartmentStateSpider, self).get_page_request(page)
+        if not self.incremental:
+            return request
+
+        validators = self.crawl_state.get('pages', {}).get(request.url, {})
+
+        if validators.get('etag'):
+            request.headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            request.headers['If-Modified-Since'] = validators['last_modified']
+
+        return request
 
     def parse(self, response):
-        """Method in charge of retrieving dynamic data from a current apartment offering.
+        """Method in charge of retrieving dynamic data from a current apartment offering. An
+            incremental crawl skips every page which did not change since the previous crawl.
+
+        Args:
+            response: HTTP response.
+
+        """
+
+        page = response.meta.get('page', 0)
+        last_page = self.crawl_state.get('pages', {}).get(response.url, {})
+
+        if self.incremental and response.status == 304:
+            self.logger.info('Widget page {0} not modified, skipping'.format(page))
+            self.new_crawl_state['pages'][response.url] = last_page
+            if page == 0:
+                for request in self.get_next_page_requests(self.crawl_state.get('count', 0)):
+                    yield request
+            return
+
+        if page == 0:
+            self.new_crawl_state['count'] = get_no_listings(response)
+            for request in self.get_next_page_requests(self.new_crawl_state['count']):
+                yield request
+
+        content_hash = hashlib.sha1(response.body).hexdigest()
+        if self.incremental and content_hash == last_page.get('hash'):
+            self.logger.info('Widget page {0} content unchanged, skipping'.format(page))
+            self.new_crawl_state['pages'][response.url] = last_page
+            return
+
+        for item in self.parse_page(response, content_hash):
+            yield item
+
+    def parse_page(self, response, content_hash):
+        """Method in charge of parsing a widget page, unless an incremental crawl found it unchanged.
 
         Args:
             response: HTTP response.
+            content_hash: SHA-1 hash of the response body.
 
         """
 
-        n = int(response.xpath('(//strong)[1]/text()').extract()[0])
+        return self.track_states(response, content_hash)
 
-        for i in range(1, n + 1):
-            l = SSSBApartmentStateLoader(item=SSSBApartmentStateItem(), response=response)
+    def track_states(self, response, content_hash):
+        """Method in charge of parsing the state of every listing of a page while recording the
+            values seen, so that the next crawl can tell which pages and listings changed.
+
+        Args:
+            response: HTTP response.
+            content_hash: SHA-1 hash of the response body.
+
+        """
+
+        last_listings = self.crawl_state.get('listings', {})
+        listings = self.new_crawl_state['listings']
+
+        for item in self.parse_states(response):
+            values = [item.get('apt_no_applicants'), item.get('apt_top_credits')]
+            listings[item.get('apt_name')] = values
+
+            if self.incremental and last_listings.get(item.get('apt_name')) == values:
+                continue
+
+            yield item
+
+        self.new_crawl_state['pages'][response.url] = {
+            'etag': response.headers.get('ETag', b'').decode('latin-1'),
+            'last_modified': response.headers.get('Last-Modified', b'').decode('latin-1'),
+            'hash': content_hash,
+        }
+
+    def parse_states(self, response):
+        """Method in charge of parsing the state of every listing in a widget page. Listings
+            already parsed from another page, or without applicant data, are skipped.
+
+        Args:
+            response: HTTP response.
+
+        """
+
+        for listing in get_listings(response):
+            interest = listing.xpath('.//dd[@class=\'\\"ObjektAntalIntresse\']/text()').extract()
+
+            l = SSSBApartmentStateLoader(item=SSSBApartmentStateItem(), selector=listing)
             l.add_value('state_timestamp', self.date)
-            l.add_xpath('apt_name', '(//h4[@class=\'\\"ObjektAdress\\"\']/a)[{0}]/text()'.format(i))
-            l.add_xpath('apt_no_applicants', '(//dd[@class=\'\\"ObjektAntalIntresse\'])[{0}]/text()'.format(i))
-            l.add_xpath('apt_top_credits', '(//dd[@class=\'\\"ObjektAntalIntresse\'])[{0}]/text()'.format(i))
+            l.add_xpath('apt_name', './/h4[@class=\'\\"ObjektAdress\\"\']/a/text()')
+            l.add_value('apt_no_applicants', interest)
+            l.add_value('apt_top_credits', interest)
+            item = l.load_item()
+
+            if 'apt_no_applicants' not in item or 'apt_top_credits' not in item:
+                self.logger.warning('No applicant data for {0}, skipping'.format(item.get('apt_name')))
+                continue
+
+            if item.get('apt_name') is None or item.get('apt_name') in self.seen_states:
+                continue
+
+            self.seen_states.add(item.get('apt_name'))
+            yield item
+
+    def closed(self, reason):
+        """Method storing the change-detection state once the crawl finished successfully and its
+            items were stored. Otherwise the next crawl processes the same pages again.
+
+        Args:
+            reason: reason why the spider was closed.
+
+        """
+
+        if self.store_failed:
+            self.logger.error('Scraped items could not be stored, keeping the previous crawl state')
+            return
+
+        if reason == 'finished' and self.new_crawl_state['pages']:
+            save_crawl_state(self.state_path, self.new_crawl_state)
+
+
+class SSSBApartmentSpider(SSSBApartmentStateSpider, SSSBApartmentInfoSpider):
+    """Class for scraping both SSSB apartment meta data and dynamic info out of a single download
+        of each widget page. On every page, apartment items are yielded before state items.
+        In an incremental crawl, pages which did not change since the previous crawl are skipped
+        altogether, as neither their catalog nor their states changed.
+
+    """
+
+    name = "sssb_spider"
+
+    def parse_page(self, response, content_hash):
+        """Method in charge of retrieving both meta data and dynamic data from a widget page.
+
+        Args:
+            response: HTTP response.
+            content_hash: SHA-1 hash of the response body.
+
+        """
+
+        for item in self.parse_apartments(response):
+            yield item
 
-            yield l.load_item()
+        for item in self.track_states(response, content_hash):
+            yield item
 
 
 if __name__ == "__main__":
@@ -6,6 +6,11 @@
 __author__ = 'Andres'
 
 import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from contextlib import contextmanager
+import threading
+from decimal import Decimal, InvalidOperation
 import logging
 import os
 import subprocess
@@ -13,10 +18,15 @@ import pandas as pd
 import pandas.io.sql as sqlio
 from dotenv import load_dotenv
 import time
+import src.data.id_cache as id_cache
 
-# Initialization of global db connection and logging config.
+# Initialization of global db connection, connection pool and logging config.
 
 conn = None
+connection_users = 0
+pool = None
+pool_lock = threading.Lock()
+local = threading.local()
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -25,6 +35,8 @@ db_name = os.getenv("DB_NAME")
 db_user = os.getenv("DB_USER")
 db_host = os.getenv("DB_HOST")
 db_pass = os.getenv("DB_PASS")
+db_pool_min = int(os.getenv("DB_POOL_MIN") or 1)
+db_pool_max = int(os.getenv("DB_POOL_MAX") or 10)
 
 dirname = os.path.dirname(__file__)
 hdlr = logging.FileHandler(os.path.join(dirname,
@@ -49,6 +61,94 @@ class DatabaseException(Exception):
     pass
 
 
+def get_pool():
+    """Function to get the process-wide connection pool, creating it on first use.
+
+    Raises:
+        DatabaseException: If something impedes to connect to the database.
+
+    Returns:
+        psycopg2.pool.ThreadedConnectionPool: pool of connections to the database.
+
+    """
+
+    global pool, log
+
+    with pool_lock:
+        if pool is None:
+            try:
+                pool = ThreadedConnectionPool(db_pool_min,
+                                              db_pool_max,
+                                              "dbname={0} user={1} host={2} password={3}".format(db_name,
+                                                                                                 db_user,
+                                                                                                 db_host,
+                                                                                                 db_pass))
+            except Exception as e:
+                log.exception("Failed to connect")
+                raise DatabaseException("Failed to connect\n" + str(e))
+
+    return pool
+
+
+def close_pool():
+    """Function in charge of closing every connection held by the pool.
+
+    """
+
+    global pool
+
+    with pool_lock:
+        if pool is not None:
+            pool.closeall()
+            pool = None
+
+
+def get_connection():
+    """Function to get the connection to be used by the current thread: the one checked out by an
+    enclosing session, if any, or the module-wide connection otherwise.
+
+    Returns:
+        psycopg2.extensions.connection: connection to the database.
+
+    """
+
+    return getattr(local, 'conn', None) or conn
+
+
+@contextmanager
+def session():
+    """Context manager checking out a pooled connection for one unit of work. Every db_ops function
+    called by the same thread inside the block uses that connection. Nested sessions reuse it.
+
+    Raises:
+        DatabaseException: If something impedes to connect to the database.
+
+    Yields:
+        psycopg2.extensions.connection: connection to the database.
+
+    """
+
+    outer = getattr(local, 'conn', None)
+    if outer is not None:
+        yield outer
+        return
+
+    session_pool = get_pool()
+    try:
+        session_conn = session_pool.getconn()
+        session_conn.set_client_encoding("utf-8")
+    except Exception as e:
+        log.exception("Failed to connect")
+        raise DatabaseException("Failed to connect\n" + str(e))
+
+    local.conn = session_conn
+    try:
+        yield session_conn
+    finally:
+        local.conn = None
+        session_pool.putconn(session_conn)
+
+
 def is_connected():
     """Function to determine if there is currently an active connection to db.
 
@@ -57,45 +157,52 @@ def is_connected():
 
     """
 
-    global conn
-
-    return True if conn is not None else False
+    return True if get_connection() is not None else False
 
 
 def connect():
-    """Function in charge of connecting to the database "sssb_data".
+    """Function in charge of checking out a pooled connection as the module-wide connection.
+    Calls are counted, so that the connection is shared by every user until the last disconnects.
 
     Raises:
         DatabaseException: If something impedes to connect to the database.
 
     """
 
-    global conn, log
+    global conn, log, connection_users
+
+    connection_users += 1
+    if conn is not None:
+        return
 
     try:
-        conn = psycopg2.connect("dbname={0} user={1} host={2} password={3}".format(db_name,
-                                                                                   db_user,
-                                                                                   db_host,
-                                                                                   db_pass))
+        conn = get_pool().getconn()
         conn.set_client_encoding("utf-8")
 
     except Exception as e:
+        connection_users -= 1
         log.exception("Failed to connect")
         raise DatabaseException("Failed to connect\n" + str(e))
 
 
 def disconnect():
-    """Function in charge of disconnecting from database.
+    """Function in charge of returning the module-wide connection to the pool, once every user
+    that connected has disconnected.
 
     Raises:
         DatabaseException: If something impedes to disconnect from database.
 
     """
 
-    global conn, log
+    global conn, log, connection_users
+
+    connection_users = max(connection_users - 1, 0)
+    if connection_users > 0:
+        return
 
     try:
-        conn.close()
+        if conn is not None:
+            get_pool().putconn(conn)
         conn = None
     except Exception as e:
         log.exception("Unable to disconnect from database")
@@ -134,7 +241,8 @@ def set_apartment(apt_name, apt_type, apt_zone, apt_price, furnitured='False', e
 
     """
 
-    global conn, log
+    global log
+    conn = get_connection()
 
     cur = conn.cursor()
     try:
@@ -147,6 +255,7 @@ def set_apartment(apt_name, apt_type, apt_zone, apt_price, furnitured='False', e
         log.info('Apartment: Committing transaction')
         conn.commit()
         cur.close()
+        id_cache.apartments.add(apt_name, apartment_id)
         return apartment_id
     except Exception as e:
         conn.rollback()
@@ -155,12 +264,105 @@ def set_apartment(apt_name, apt_type, apt_zone, apt_price, furnitured='False', e
         raise DatabaseException(str(e))
 
 
-def set_offer(end_date, start_date=get_timestamp()):
+def _catalog_row(apt_type, apt_zone, apt_price, furnitured, electricity, _10_month):
+    """Function to normalize apartment attributes so scraped values compare equal to stored ones.
+
+    Returns:
+        tuple: normalized (type, zone, price, furnitured, electricity, _10_month).
+
+    """
+
+    def to_bool(x):
+        return x if isinstance(x, bool) else str(x).strip().lower() == 'true'
+
+    try:
+        price = Decimal(str(apt_price))
+    except (InvalidOperation, ValueError):
+        price = apt_price
+
+    return apt_type, apt_zone, price, to_bool(furnitured), to_bool(electricity), to_bool(_10_month)
+
+
+def sync_apartments(apartments):
+    """Function for synchronizing the "apartment" table with a scraped catalog. Scraped apartments
+    are diffed against the stored ones, and new or changed rows are applied in one upsert batch.
+
+    Args:
+        apartments: list of (apt_name, apt_type, apt_zone, apt_price, furnitured, electricity, _10_month)
+                    tuples.
+
+    Raises:
+        DatabaseException: In case the synchronization was not possible.
+
+    Returns:
+        dict: number of inserted, updated and unchanged apartments.
+
+    """
+
+    global log
+    conn = get_connection()
+
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    if not apartments:
+        return counts
+
+    cur = conn.cursor()
+    try:
+        log.info('Apartment: Synchronizing {0} apartments'.format(len(apartments)))
+        catalog = {}
+        for apt in apartments:
+            catalog[apt[0]] = _catalog_row(*apt[1:])
+
+        cur.execute("""SELECT name, type, zone, price, furnitured, electricity, _10_month
+                          FROM apartment
+                          WHERE name = ANY(%s)""", (list(catalog),))
+        stored = {row[0]: _catalog_row(*row[1:]) for row in cur.fetchall()}
+
+        rows = []
+        for name, attributes in catalog.items():
+            if name not in stored:
+                counts['inserted'] += 1
+            elif stored[name] != attributes:
+                counts['updated'] += 1
+            else:
+                counts['unchanged'] += 1
+                continue
+            rows.append((name,) + attributes)
+
+        sql = """INSERT INTO apartment (name, type, zone, price, furnitured, electricity, _10_month) 
+                    VALUES %s
+                    ON CONFLICT (name) DO UPDATE 
+                    SET type = EXCLUDED.type, 
+                        zone = EXCLUDED.zone, 
+                        price = EXCLUDED.price, 
+                        furnitured = EXCLUDED.furnitured, 
+                        electricity = EXCLUDED.electricity, 
+                        _10_month = EXCLUDED._10_month"""
+        execute_values(cur, sql, rows, page_size=1000)
+
+        log.info('Apartment: Committing transaction')
+        conn.commit()
+        cur.close()
+
+        if counts['inserted']:
+            id_cache.apartments.invalidate()
+
+        log.info('Apartment: Synchronized catalog: {0}'.format(counts))
+        return counts
+
+    except Exception as e:
+        conn.rollback()
+        log.error('Apartment: Rolling back transaction')
+        log.exception("Apartment: Couldn't synchronize catalog")
+        raise DatabaseException(str(e))
+
+
+def set_offer(end_date, start_date=None):
     """Function for inserting a new valid row into the "offer" table.
         In case of success the corresponding id is returned.
 
     Args:
-        start_date: string representing the starting date and time of an offer.
+        start_date: string representing the starting date and time of an offer. Defaults to now.
         end_date: string representing the ending date and time of an offer.
 
     Raises:
@@ -171,7 +373,11 @@ def set_offer(end_date, start_date=get_timestamp()):
 
     """
 
-    global conn, log
+    global log
+    conn = get_connection()
+
+    if start_date is None:
+        start_date = get_timestamp()
 
     cur = conn.cursor()
     try:
@@ -184,6 +390,7 @@ def set_offer(end_date, start_date=get_timestamp()):
         log.info('Offer: Committing transaction')
         conn.commit()
         cur.close()
+        id_cache.offers.add(offer_id, start_date, end_date)
         return offer_id
     except Exception as e:
         conn.rollback()
@@ -205,7 +412,8 @@ def set_is_offered(apt_address, time_stamp):
 
     """
 
-    global conn, log
+    global log
+    conn = get_connection()
 
     cur = conn.cursor()
     try:
@@ -232,6 +440,210 @@ def set_is_offered(apt_address, time_stamp):
         raise DatabaseException(str(e))
 
 
+def set_offered_apartments(offerings):
+    """Function for inserting a batch of rows into the "is_offered" table within a single transaction,
+    creating the offers whose deadlines are not yet known.
+
+    Args:
+        offerings: list of (apt_address, time_stamp) pairs, time_stamp being the offer deadline.
+
+    Raises:
+        DatabaseException: In case no insertion was possible.
+
+    Returns:
+        int: number of processed relationships.
+
+    """
+
+    global log
+    conn = get_connection()
+
+    if not offerings:
+        return 0
+
+    cur = conn.cursor()
+    try:
+        log.info('Apartment-Offer: Inserting {0} relationships'.format(len(offerings)))
+        cur.execute("""SELECT name, nIdApartment
+                          FROM apartment
+                          WHERE name = ANY(%s)""", (list({offering[0] for offering in offerings}),))
+        apartment_ids = dict(cur.fetchall())
+
+        offer_ids = {}
+        new_offers = []
+        start_date = get_timestamp()
+        for time_stamp in {offering[1] for offering in offerings}:
+            cur.execute("""SELECT nIdOffer
+                              FROM Offer
+                              WHERE start_date <= %s AND end_date >= %s""", (time_stamp, time_stamp))
+            res = cur.fetchone()
+            if res is None:
+                cur.execute("""INSERT INTO offer (start_date, end_date) 
+                                  VALUES (%s, %s) 
+                                  RETURNING nIdOffer""", (start_date, time_stamp))
+                res = cur.fetchone()
+                new_offers.append((res[0], start_date, time_stamp))
+            offer_ids[time_stamp] = res[0]
+
+        rows = []
+        for apt_address, time_stamp in offerings:
+            if apt_address not in apartment_ids:
+                log.error('Apartment-Offer: No matching apartment for: {0}'.format(apt_address))
+                continue
+            rows.append((apartment_ids[apt_address], offer_ids[time_stamp]))
+
+        sql = """INSERT INTO isOffered (nIdApartment, nIdOffer) 
+                    VALUES %s 
+                    ON CONFLICT (nIdApartment, nIdOffer) DO NOTHING"""
+        execute_values(cur, sql, rows, page_size=1000)
+
+        log.info('Apartment-Offer: Committing transaction')
+        conn.commit()
+        cur.close()
+
+        for offer in new_offers:
+            id_cache.offers.add(*offer)
+
+        return len(rows)
+
+    except Exception as e:
+        conn.rollback()
+        log.error('Apartment-Offer: Rolling back transaction')
+        log.exception("Apartment-Offer: Couldn't insert successfully")
+        raise DatabaseException(str(e))
+
+
+def _upsert_latest_states(cur, rows):
+    """Function keeping the "latest_state" table up to date with newly inserted states, within the
+    caller's transaction. States older than the stored ones are ignored.
+
+    Args:
+        cur: cursor of the ongoing transaction.
+        rows: list of (time_stamp, nIdApartment, nIdOffer, no_applicants, top_credits) tuples.
+
+    """
+
+    # A single statement cannot update the same row twice, so keep the newest state per apartment
+    latest = {}
+    for row in rows:
+        if row[1] not in latest or latest[row[1]][0] <= row[0]:
+            latest[row[1]] = row
+
+    sql = """INSERT INTO LatestState (time_stamp, nIdApartment, nIdOffer, no_applicants, top_credits) 
+                VALUES %s 
+                ON CONFLICT (nIdApartment) DO UPDATE 
+                SET time_stamp = EXCLUDED.time_stamp, 
+                    nIdOffer = EXCLUDED.nIdOffer, 
+                    no_applicants = EXCLUDED.no_applicants, 
+                    top_credits = EXCLUDED.top_credits 
+                WHERE LatestState.time_stamp <= EXCLUDED.time_stamp"""
+    execute_values(cur, sql, list(latest.values()), page_size=1000)
+
+
+def check_latest_state(repair=True):
+    """Function for checking the "latest_state" table against the newest row per apartment in
+    "state", rebuilding it from "state" when they disagree.
+
+    Args:
+        repair: if true, the table is rebuilt in case of inconsistencies.
+
+    Raises:
+        DatabaseException: If something impedes to check or rebuild the table.
+
+    Returns:
+        int: number of inconsistent apartments found.
+
+    """
+
+    global log
+    conn = get_connection()
+
+    cur = conn.cursor()
+    try:
+        log.info('Latest State: Checking consistency')
+        newest = """SELECT DISTINCT ON (nIdApartment) time_stamp, nIdApartment, nIdOffer, no_applicants, top_credits
+                      FROM state
+                      ORDER BY nIdApartment, time_stamp DESC"""
+        cur.execute("""SELECT count(*) FROM ({0}) newest
+                          FULL OUTER JOIN LatestState latest
+                          ON newest.nIdApartment = latest.nIdApartment
+                          WHERE (newest.time_stamp, newest.nIdOffer, newest.no_applicants, newest.top_credits)
+                            IS DISTINCT FROM
+                            (latest.time_stamp, latest.nIdOffer, latest.no_applicants, latest.top_credits)
+                          """.format(newest))
+        inconsistent = int(cur.fetchone()[0])
+
+        if inconsistent and repair:
+            log.info('Latest State: Rebuilding {0} inconsistent apartments'.format(inconsistent))
+            cur.execute("""DELETE FROM LatestState""")
+            cur.execute("""INSERT INTO LatestState (time_stamp, nIdApartment, nIdOffer, no_applicants, top_credits) 
+                              {0}""".format(newest))
+
+        log.info('Latest State: Committing transaction')
+        conn.commit()
+        cur.close()
+        return inconsistent
+
+    except Exception as e:
+        conn.rollback()
+        log.error('Latest State: Rolling back transaction')
+        log.exception("Latest State: Couldn't check consistency")
+        raise DatabaseException(str(e))
+
+
+def set_win_credits(offer_id=None):
+    """Function for closing offers out, storing the top credits of the last state of each apartment as
+    its winning credits. It is idempotent, and updates all closed offers at once if none is given.
+
+    Args:
+        offer_id: id of the offer to close out. All closed offers if None.
+
+    Raises:
+        DatabaseException: In case no update was possible.
+
+    Returns:
+        int: number of updated relationships.
+
+    """
+
+    global log
+    conn = get_connection()
+
+    cur = conn.cursor()
+    try:
+        log.info('Apartment-Offer: Setting winning credits for offer: {0}'.format(offer_id))
+        sql = """UPDATE isOffered 
+                    SET win_credits = last_state.top_credits 
+                    FROM (
+                      SELECT DISTINCT ON (nIdApartment, nIdOffer) nIdApartment, nIdOffer, top_credits 
+                        FROM state 
+                        WHERE {0} 
+                        ORDER BY nIdApartment, nIdOffer, time_stamp DESC
+                      ) last_state 
+                    JOIN offer 
+                      ON offer.nIdOffer = last_state.nIdOffer 
+                    WHERE isOffered.nIdApartment = last_state.nIdApartment 
+                    AND isOffered.nIdOffer = last_state.nIdOffer 
+                    AND offer.end_date < now() 
+                    AND isOffered.win_credits IS DISTINCT FROM last_state.top_credits"""
+        if offer_id is None:
+            cur.execute(sql.format('TRUE'))
+        else:
+            cur.execute(sql.format('nIdOffer = %s'), (offer_id,))
+        updated = cur.rowcount
+
+        log.info('Apartment-Offer: Committing transaction')
+        conn.commit()
+        cur.close()
+        return updated
+
+    except Exception as e:
+        conn.rollback()
+        log.error('Apartment-Offer: Rolling back transaction')
+        log.exception("Apartment-Offer: Couldn't set winning credits")
+        raise DatabaseException(str(e))
+
+
 def set_apartment_state(state_timestamp, apt_address, no_applicants, top_credits):
     """Function in charge of inserting valid new rows into apartment State table.
 
@@ -246,7 +658,8 @@ def set_apartment_state(state_timestamp, apt_address, no_applicants, top_credits
 
     """
 
-    global conn, log
+    global log
+    conn = get_connection()
 
     cur = conn.cursor()
     try:
@@ -254,7 +667,9 @@ def set_apartment_state(state_timestamp, apt_address, no_applicants, top_credits
         sql = """INSERT INTO State (time_stamp, nIdApartment, nIdOffer, no_applicants, top_credits) 
                     VALUES (%s, %s, %s, %s, %s)"""
         offer = get_offer_id(state_timestamp)
-        cur.execute(sql, (state_timestamp, get_apartment_id(apt_address), offer, no_applicants, top_credits))
+        apt_id = get_apartment_id(apt_address)
+        cur.execute(sql, (state_timestamp, apt_id, offer, no_applicants, top_credits))
+        _upsert_latest_states(cur, [(state_timestamp, apt_id, offer, no_applicants, top_credits)])
 
         log.info('Apartment State: Committing transaction')
         conn.commit()
@@ -267,6 +682,168 @@ def set_apartment_state(state_timestamp, apt_address, no_applicants, top_credits
         raise DatabaseException(str(e))
 
 
+def set_apartment_states(states, last_states=None):
+    """Function in charge of inserting a batch of rows into apartment State table within a single
+    transaction. Apartment names are resolved in one query and offers once per distinct timestamp.
+
+    Args:
+        states: list of (state_timestamp, apt_address, no_applicants, top_credits) tuples.
+        last_states: optional dictionary mapping (nIdApartment, nIdOffer) to the last known
+                     (no_applicants, top_credits). If given, only transitions are inserted and
+                     the dictionary is updated with them.
+
+    Raises:
+        DatabaseException: If something impedes to insert new data, such as repeated entries.
+
+    Returns:
+        int: number of inserted rows.
+
+    """
+
+    global log
+    conn = get_connection()
+
+    if not states:
+        return 0
+
+    cur = conn.cursor()
+    try:
+        log.info('Apartment State: Inserting {0} states'.format(len(states)))
+        names = list({state[1] for state in states})
+        cur.execute("""SELECT name, nIdApartment
+                          FROM apartment
+                          WHERE name = ANY(%s)""", (names,))
+        apartment_ids = dict(cur.fetchall())
+
+        offer_ids = {}
+        for time_stamp in {state[0] for state in states}:
+            cur.execute("""SELECT nIdOffer
+                              FROM Offer
+                              WHERE start_date <= %s AND end_date >= %s""", (time_stamp, time_stamp))
+            res = cur.fetchone()
+            offer_ids[time_stamp] = res[0] if res is not None else None
+
+        rows = []
+        transitions = {}
+        for state_timestamp, apt_address, no_applicants, top_credits in sorted(states):
+            if apt_address not in apartment_ids:
+                log.error('Apartment State: No matching apartment for: {0}'.format(apt_address))
+                continue
+
+            key = (apartment_ids[apt_address], offer_ids[state_timestamp])
+            values = (int(no_applicants), int(top_credits))
+            if last_states is not None:
+                if transitions.get(key, last_states.get(key)) == values:
+                    continue
+                transitions[key] = values
+
+            rows.append((state_timestamp, key[0], key[1], no_applicants, top_credits))
+
+        sql = """INSERT INTO State (time_stamp, nIdApartment, nIdOffer, no_applicants, top_credits) 
+                    VALUES %s"""
+        execute_values(cur, sql, rows, page_size=1000)
+        _upsert_latest_states(cur, rows)
+
+        log.info('Apartment State: Committing transaction')
+        conn.commit()
+        cur.close()
+
+        if last_states is not None:
+            last_states.update(transitions)
+
+        return len(rows)
+
+    except Exception as e:
+        conn.rollback()
+        log.error('Apartment State: Rolling back transaction')
+        log.exception("Apartment State: Couldn't insert successfully")
+        raise DatabaseException(str(e))
+
+
+def warm_id_caches():
+    """Function for loading every apartment id and offer window into the process-local id caches,
+    using one bulk query per table.
+
+    Raises:
+        DatabaseException: If something impedes to query the database.
+
+    """
+
+    global log
+    conn = get_connection()
+
+    cur = conn.cursor()
+    try:
+        log.info('Id cache: Warming apartment and offer caches')
+        cur.execute("""SELECT name, nIdApartment FROM apartment""")
+        id_cache.apartments.load(cur.fetchall())
+        cur.execute("""SELECT nIdOffer, start_date, end_date FROM offer""")
+        id_cache.offers.load(cur.fetchall())
+        conn.commit()
+        cur.close()
+
+    except Exception as e:
+        conn.rollback()
+        log.error('Id cache: Rolling back transaction')
+        log.exception("Id cache: Couldn't warm caches")
+        raise DatabaseException(str(e))
+
+
+def invalidate_id_caches():
+    """Function for dropping every entry from the id caches, forcing a re-warm on the next lookup.
+
+    """
+
+    id_cache.apartments.invalidate()
+    id_cache.offers.invalidate()
+
+
+def get_id_cache_stats():
+    """Function for retrieving the hit/miss counters of the id caches.
+
+    Returns:
+        dict: hits and misses for both the apartment and the offer cache.
+
+    """
+
+    return {'apartment': {'hits': id_cache.apartments.hits, 'misses': id_cache.apartments.misses},
+            'offer': {'hits': id_cache.offers.hits, 'misses': id_cache.offers.misses}}
+
+
+def get_last_states():
+    """Function for retrieving the last stored state of every apartment in the offers still open.
+
+    Raises:
+        DatabaseException: If something impedes to query the database.
+
+    Returns:
+        dict: dictionary mapping (nIdApartment, nIdOffer) to (no_applicants, top_credits).
+
+    """
+
+    global log
+    conn = get_connection()
+
+    cur = conn.cursor()
+    try:
+        log.info('Apartment State (get): Querying last states')
+        sql = """SELECT DISTINCT ON (nIdApartment, nIdOffer) nIdApartment, nIdOffer, no_applicants, top_credits
+                    FROM state
+                    WHERE nIdOffer IN (SELECT nIdOffer FROM offer WHERE end_date >= now())
+                    ORDER BY nIdApartment, nIdOffer, time_stamp DESC"""
+        cur.execute(sql)
+        res = cur.fetchall()
+        conn.commit()
+        cur.close()
+        return {(r[0], r[1]): (r[2], r[3]) for r in res}
+
+    except Exception as e:
+        conn.rollback()
+        log.error('Apartment State (get): Rolling back transaction')
+        log.exception("Apartment State (get): Couldn't retrieve last states")
+        raise DatabaseException(str(e))
+
+
 def get_apartment_id(address):
     """Function for retrieving the id of a certain apartment.
 
@@ -278,10 +855,18 @@ def get_apartment_id(address):
 
     """
 
-    global conn, log
+    global log
+    conn = get_connection()
 
-    cur = conn.cursor()
     try:
+        if not id_cache.apartments.warmed:
+            warm_id_caches()
+
+        apt_id = id_cache.apartments.get(address)
+        if apt_id is not None:
+            return apt_id
+
+        cur = conn.cursor()
         log.info('Apartment (get): Querying for: {0}'.format(address))
         sql = """SELECT nIdapartment 
                   FROM apartment
@@ -292,7 +877,9 @@ def get_apartment_id(address):
         conn.commit()
         cur.close()
         if res is not None:
-            return int(res[0])
+            apt_id = int(res[0])
+            id_cache.apartments.add(address, apt_id)
+            return apt_id
         else:
             conn.rollback()
             log.error('Apartment (get): Rolling back transaction')
@@ -317,12 +904,20 @@ def get_offer_id(time_stamp):
 
     """
 
-    global conn, log
+    global log
+    conn = get_connection()
 
-    cur = conn.cursor()
     try:
+        if not id_cache.offers.warmed:
+            warm_id_caches()
+
+        offer_id = id_cache.offers.get(time_stamp)
+        if offer_id is not None:
+            return offer_id
+
+        cur = conn.cursor()
         log.info('Offer (get): Querying for: {0}'.format(time_stamp))
-        sql = """SELECT nIdOffer 
+        sql = """SELECT nIdOffer, start_date, end_date 
                   FROM Offer
                   WHERE start_date <= %s AND end_date >= %s"""
         cur.execute(sql, (time_stamp, time_stamp))
@@ -331,6 +926,7 @@ def get_offer_id(time_stamp):
         conn.commit()
         cur.close()
         if res is not None:
+            id_cache.offers.add(res[0], res[1], res[2])
             return res[0]
         else:
             return None
@@ -350,7 +946,8 @@ def get_current_offer_dates():
 
     """
 
-    global conn, log
+    global log
+    conn = get_connection()
 
     cur = conn.cursor()
     try:
@@ -384,7 +981,8 @@ def get_current_offer_id():
 
     """
 
-    global conn, log
+    global log
+    conn = get_connection()
 
     cur = conn.cursor()
     try:
@@ -418,7 +1016,8 @@ def get_current_offer_size():
 
     """
 
-    global conn, log
+    global log
+    conn = get_connection()
 
     cur = conn.cursor()
     try:
@@ -453,7 +1052,8 @@ def get_apartment_history(apartment, offer):
 
     """
 
-    global conn, log
+    global log
+    conn = get_connection()
 
     try:
         log.info('Apartment State (get): Querying historical data')
@@ -486,19 +1086,20 @@ def get_secured_apartments(credit_days):
         pandas.DataFrame: data frame object containing desired apartments, if any.
     """
 
-    global conn, log
+    global log
+    conn = get_connection()
 
     try:
         log.info('Apartment State (get): Querying historical data')
-        sql = """ select * from apartment where nidapartment in (
-                    select nidapartment from state 
-                    where top_credits < %s 
-                    and time_stamp in (
-                      select time_stamp from state 
+        sql = """ select apartment.* from apartment 
+                    join latestState 
+                    on latestState.nidapartment = apartment.nidapartment 
+                    where latestState.top_credits < %s 
+                    and latestState.nidoffer = (
+                      select nidoffer from latestState 
                       order by time_stamp 
                       desc limit 1
-                      )
-                    )"""
+                      )"""
         df = sqlio.read_sql_query(sql, conn, params=(credit_days,))
         return df
 
@@ -517,19 +1118,20 @@ def get_current_state():
         pandas.DataFrame: data frame object containing ordered apartment state snapshot.
     """
 
-    global conn, log
+    global log
+    conn = get_connection()
 
     try:
         log.info('Apartment State (get): Querying last timestamp')
-        sql = """select state.nidapartment, name, type, top_credits, no_applicants from state 
+        sql = """select latestState.nidapartment, name, type, top_credits, no_applicants from latestState 
                   join apartment 
-                  on state.nidapartment = apartment.nidapartment 
-                  where state.time_stamp in (
-                    select time_stamp from state 
+                  on latestState.nidapartment = apartment.nidapartment 
+                  where latestState.nidoffer = (
+                    select nidoffer from latestState 
                     order by time_stamp 
                     desc limit 1
                   ) 
-                  group by apartment.type, state.top_credits, state.no_applicants, state.nidapartment, apartment.name;"""
+                  order by type, top_credits, no_applicants;"""
         df = sqlio.read_sql_query(sql, conn)
         return df
 
@@ -540,26 +1142,117 @@ def get_current_state():
         DatabaseException(str(e))
 
 
-def get_all_top_credits(offer_id, apt_list):
-    global conn, log
+def get_offer_dates(offer_id):
+    """Function for retrieving the start and end dates of a given apartment offering.
+
+    Args:
+        offer_id: id of desired apartment offering.
+
+    Raises:
+        DatabaseException: If something impedes to query the database.
+
+    Returns:
+        (datetime.datetime, datetime.datetime): tuple representing the desired timestamps, None if
+                                                there is no such offer.
+
+    """
+
+    global log
+    conn = get_connection()
+
+    cur = conn.cursor()
+    try:
+        log.info('Offer (get): Querying dates of offer: {0}'.format(offer_id))
+        sql = """SELECT start_date, end_date 
+                    FROM offer 
+                    WHERE nidoffer = %s"""
+        cur.execute(sql, (offer_id,))
+        res = cur.fetchone()
+        log.info('Offer (get): Committing transaction')
+        conn.commit()
+        cur.close()
+        return res
+
+    except Exception as e:
+        conn.rollback()
+        log.error('Offer (get): Rolling back transaction')
+        log.exception("Offer (get): Couldn't retrieve dates")
+        raise DatabaseException(str(e))
+
+
+def extend_series(df, end_date):
+    """Function to rebuild the step functions of a pivoted time series frame. Rows only exist where
+    some apartment changed, so each apartment's last value is carried forward over the union of
+    timestamps, and up to the end of the offer (or up to now, for an offer still open) so that the
+    series do not stop at the last change.
+
+    Args:
+        df: data frame indexed by timestamp.
+        end_date: end date of the offer, naive timestamps being taken as UTC. None to not extend.
+
+    Returns:
+        pandas.DataFrame: forward-filled data frame.
+
+    """
+
+    df = df.sort_index()
+
+    if end_date is not None and len(df.index):
+        end = pd.Timestamp(end_date)
+        end = end.tz_localize('UTC') if end.tzinfo is None else end
+        end = min(end, pd.Timestamp.now(tz='UTC'))
+
+        last = df.index[-1]
+        end = end.tz_convert(last.tzinfo) if last.tzinfo is not None else end.tz_convert('UTC').tz_localize(None)
+
+        if end > last:
+            df = df.reindex(df.index.append(pd.DatetimeIndex([end], name=df.index.name)))
+
+    return df.ffill()
+
+
+# Last value of a State column per apartment and time bucket, buckets being "resolution" wide
+# (any PostgreSQL interval, e.g. '1 hour') and aligned to the epoch.
+BUCKETED_SERIES_SQL = """SELECT name, bucket AS time_stamp, {column} FROM (
+                            SELECT DISTINCT ON (state.nidapartment, bucket) apartment.name, state.{column}, 
+                                   to_timestamp(floor(extract(epoch FROM state.time_stamp) 
+                                                      / extract(epoch FROM %s::interval)) 
+                                                * extract(epoch FROM %s::interval)) AS bucket
+                              FROM state JOIN apartment 
+                                ON state.nidapartment = apartment.nidapartment
+                              WHERE nidoffer = %s 
+                              AND state.nidapartment in %s
+                              ORDER BY state.nidapartment, bucket, state.time_stamp DESC
+                            ) buckets"""
+
+
+def get_all_top_credits(offer_id, apt_list, resolution=None):
+    global log
+    conn = get_connection()
 
     apartments_sql = tuple(apt_list)
 
     try:
         log.info('Apartment State (get): Querying top credits')
-        sql = """SELECT apartment.name, time_stamp, top_credits
-                    FROM state JOIN apartment 
-                      ON state.nidapartment = apartment.nidapartment
-                    WHERE nidoffer = %s 
-                    AND state.nidapartment in %s"""
+        if resolution is None:
+            sql = """SELECT apartment.name, time_stamp, top_credits
+                        FROM state JOIN apartment 
+                          ON state.nidapartment = apartment.nidapartment
+                        WHERE nidoffer = %s 
+                        AND state.nidapartment in %s"""
+            params = (offer_id, apartments_sql)
+        else:
+            sql = BUCKETED_SERIES_SQL.format(column='top_credits')
+            params = (resolution, resolution, offer_id, apartments_sql)
 
         df = pd.read_sql_query(sql,
                                con=conn,
                                index_col='time_stamp',
                                parse_dates='time_stamp',
-                               params=(offer_id, apartments_sql))
+                               params=params)
 
-        return df.pivot(columns='name', values='top_credits')
+        dates = get_offer_dates(offer_id)
+        return extend_series(df.pivot(columns='name', values='top_credits'), dates[1] if dates else None)
 
     except Exception as e:
         conn.rollback()
@@ -568,26 +1261,33 @@ def get_all_top_credits(offer_id, apt_list):
         raise DatabaseException()
 
 
-def get_all_no_applicants(offer_id, apt_list):
-    global conn, log
+def get_all_no_applicants(offer_id, apt_list, resolution=None):
+    global log
+    conn = get_connection()
 
     apartments_sql = tuple(apt_list)
 
     try:
         log.info('Apartment State (get): Querying number of applicants')
-        sql = """SELECT apartment.name, time_stamp, no_applicants
-                    FROM state JOIN apartment 
-                      ON state.nidapartment = apartment.nidapartment
-                    WHERE nidoffer = %s 
-                    AND state.nidapartment in %s"""
+        if resolution is None:
+            sql = """SELECT apartment.name, time_stamp, no_applicants
+                        FROM state JOIN apartment 
+                          ON state.nidapartment = apartment.nidapartment
+                        WHERE nidoffer = %s 
+                        AND state.nidapartment in %s"""
+            params = (offer_id, apartments_sql)
+        else:
+            sql = BUCKETED_SERIES_SQL.format(column='no_applicants')
+            params = (resolution, resolution, offer_id, apartments_sql)
 
         df = pd.read_sql_query(sql,
                                con=conn,
                                index_col='time_stamp',
                                parse_dates='time_stamp',
-                               params=(offer_id, apartments_sql))
+                               params=params)
 
-        return df.pivot(columns='name', values='no_applicants')
+        dates = get_offer_dates(offer_id)
+        return extend_series(df.pivot(columns='name', values='no_applicants'), dates[1] if dates else None)
 
     except Exception as e:
         conn.rollback()
@@ -596,8 +1296,157 @@ def get_all_no_applicants(offer_id, apt_list):
         raise DatabaseException()
 
 
+def get_state_history_by_type(offer_id, apt_type, resolution=None):
+    """Function to get both the top credits and the number of applicants time series of the
+    apartments of a given type offered in the given offer, in one query.
+
+    Args:
+        offer_id: id of desired apartment offering.
+        apt_type: apartment type to use for filtering results.
+        resolution: optional PostgreSQL interval (e.g. '1 hour'). If given, the series are bucketed
+                    by the database, keeping the last values per bucket.
+
+    Returns:
+        pandas.DataFrame: data frame indexed by timestamp, with ("top_credits" | "no_applicants", name)
+                          column pairs.
+    """
+
+    global log
+    conn = get_connection()
+
+    try:
+        log.info('Apartment State (get): Querying top credits and number of applicants')
+        if resolution is None:
+            sql = """SELECT apartment.name, state.time_stamp, state.top_credits, state.no_applicants
+                        FROM state 
+                        JOIN apartment 
+                          ON state.nidapartment = apartment.nidapartment
+                        JOIN isoffered 
+                          ON isoffered.nidapartment = state.nidapartment 
+                          AND isoffered.nidoffer = state.nidoffer
+                        WHERE state.nidoffer = %s 
+                        AND apartment.type = %s"""
+            params = (offer_id, apt_type)
+        else:
+            sql = """SELECT name, bucket AS time_stamp, top_credits, no_applicants FROM (
+                        SELECT DISTINCT ON (state.nidapartment, bucket) apartment.name, 
+                               state.top_credits, state.no_applicants, 
+                               to_timestamp(floor(extract(epoch FROM state.time_stamp) 
+                                                  / extract(epoch FROM %s::interval)) 
+                                            * extract(epoch FROM %s::interval)) AS bucket
+                          FROM state 
+                          JOIN apartment 
+                            ON state.nidapartment = apartment.nidapartment
+                          JOIN isoffered 
+                            ON isoffered.nidapartment = state.nidapartment 
+                            AND isoffered.nidoffer = state.nidoffer
+                          WHERE state.nidoffer = %s 
+                          AND apartment.type = %s
+                          ORDER BY state.nidapartment, bucket, state.time_stamp DESC
+                        ) buckets"""
+            params = (resolution, resolution, offer_id, apt_type)
+
+        df = pd.read_sql_query(sql,
+                               con=conn,
+                               index_col='time_stamp',
+                               parse_dates='time_stamp',
+                               params=params)
+
+        dates = get_offer_dates(offer_id)
+        return extend_series(df.pivot(columns='name')[['top_credits', 'no_applicants']], dates[1] if dates else None)
+
+    except Exception as e:
+        conn.rollback()
+        log.error('Apartment State (get): Rolling back transaction')
+        log.exception("Apartment State (get): Couldn't get data")
+        raise DatabaseException()
+
+
+def get_closed_offer_trajectories(exclude_offers=()):
+    """Function to get every state of the closed offers, along with the offer progress at which it
+    was taken and the final credits of its apartment: the winning credits where known, the last
+    top credits otherwise.
+
+    Args:
+        exclude_offers: ids of offers to leave out, e.g. those already learnt from.
+
+    Returns:
+        pandas.DataFrame: data frame with nidapartment, nidoffer, progress (0 at the start of the offer,
+                          1 at its end), top_credits, no_applicants and final_credits columns.
+    """
+
+    global log
+    conn = get_connection()
+
+    try:
+        log.info('Apartment State (get): Querying closed offer trajectories')
+        sql = """SELECT state.nidapartment, state.nidoffer, 
+                        extract(epoch FROM state.time_stamp - offer.start_date) 
+                          / nullif(extract(epoch FROM offer.end_date - offer.start_date), 0) AS progress, 
+                        state.top_credits, state.no_applicants, 
+                        coalesce(isoffered.win_credits, last_state.top_credits) AS final_credits
+                    FROM state 
+                    JOIN offer 
+                      ON state.nidoffer = offer.nidoffer
+                    JOIN (
+                      SELECT DISTINCT ON (nidapartment, nidoffer) nidapartment, nidoffer, top_credits 
+                        FROM state 
+                        ORDER BY nidapartment, nidoffer, time_stamp DESC
+                      ) last_state 
+                      ON last_state.nidapartment = state.nidapartment 
+                      AND last_state.nidoffer = state.nidoffer
+                    LEFT JOIN isoffered 
+                      ON isoffered.nidapartment = state.nidapartment 
+                      AND isoffered.nidoffer = state.nidoffer
+                    WHERE offer.end_date < now() 
+                    AND NOT state.nidoffer = ANY(%s)"""
+        df = sqlio.read_sql_query(sql, conn, params=([int(x) for x in exclude_offers],))
+        return df
+
+    except Exception as e:
+        conn.rollback()
+        log.error('Apartment State (get): Rolling back transaction')
+        log.exception("Apartment State (get): Couldn't get data")
+        raise DatabaseException(str(e))
+
+
+def get_open_offer_states():
+    """Function to get the latest state of every apartment in the offers still open, along with
+    the current offer progress.
+
+    Returns:
+        pandas.DataFrame: data frame with nidapartment, nidoffer, name, type, progress (0 at the start of the
+                          offer, 1 at its end), top_credits and no_applicants columns.
+    """
+
+    global log
+    conn = get_connection()
+
+    try:
+        log.info('Apartment State (get): Querying open offer states')
+        sql = """SELECT latestState.nidapartment, latestState.nidoffer, apartment.name, apartment.type, 
+                        least(extract(epoch FROM now() - offer.start_date) 
+                          / nullif(extract(epoch FROM offer.end_date - offer.start_date), 0), 1) AS progress, 
+                        latestState.top_credits, latestState.no_applicants
+                    FROM latestState 
+                    JOIN offer 
+                      ON latestState.nidoffer = offer.nidoffer
+                    JOIN apartment 
+                      ON latestState.nidapartment = apartment.nidapartment
+                    WHERE offer.end_date >= now()"""
+        df = sqlio.read_sql_query(sql, conn)
+        return df
+
+    except Exception as e:
+        conn.rollback()
+        log.error('Apartment State (get): Rolling back transaction')
+        log.exception("Apartment State (get): Couldn't get data")
+        raise DatabaseException(str(e))
+
+
 def get_apartment_ids(apt_list):
-    global conn, log
+    global log
+    conn = get_connection()
 
     cur = conn.cursor()
     try:
@@ -626,7 +1475,8 @@ def get_apartment_ids(apt_list):
 
 
 def get_offered_apartments(offer_id):
-    global conn, log
+    global log
+    conn = get_connection()
 
     cur = conn.cursor()
     try:
@@ -655,7 +1505,8 @@ def get_offered_apartments(offer_id):
 
 
 def get_offered_apartments_by_type(offer_id, type):
-    global conn, log
+    global log
+    conn = get_connection()
 
     cur = conn.cursor()
     try:
@@ -0,0 +1,222 @@
+# coding=utf-8
+"""Module for exporting the historical apartment data of sssb_data database into columnar files,
+streaming each table through a server-side cursor so memory stays constant whatever its size.
+
+Offers are written as one partition each (state/nidoffer=<id>/), in Parquet. pyarrow is part of
+the requirements; where it is missing, gzip-compressed CSV is written instead.
+
+"""
+
+__author__ = 'Andres'
+
+import argparse
+import csv
+import gzip
+import os
+
+import src.data.db_ops as db_connection
+from src.data.db_ops import DatabaseException
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+DEFAULT_CHUNK_SIZE = 10000
+
+# Arrow type of every PostgreSQL type found in sssb_data, by type OID. NUMERIC (1700) depends on
+# the precision and scale of the column, and any other type is exported as text.
+NUMERIC_OID = 1700
+ARROW_TYPES = {} if pa is None else {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    25: pa.string(),
+    700: pa.float32(),
+    701: pa.float64(),
+    1042: pa.string(),
+    1043: pa.string(),
+    1082: pa.date32(),
+    1114: pa.timestamp('us'),
+    1184: pa.timestamp('us', tz='UTC'),
+}
+
+
+def get_extension():
+    """Function to get the extension of the files written by this module.
+
+    Returns:
+        string: ".parquet" if pyarrow is available, ".csv.gz" otherwise.
+
+    """
+
+    return '.parquet' if pq is not None else '.csv.gz'
+
+
+def get_arrow_schema(description):
+    """Function to build the Arrow schema of a query result out of the column types reported by the
+    server, so that every chunk is written with the same schema, even chunks where a column only
+    holds NULLs.
+
+    Args:
+        description: cursor description of the query result.
+
+    Returns:
+        (pyarrow.Schema, list): schema, and the function converting the values of each column.
+
+    """
+
+    fields = []
+    converters = []
+    for column in description:
+        if column.type_code == NUMERIC_OID and column.precision is not None and column.precision <= 38:
+            arrow_type, convert = pa.decimal128(column.precision, column.scale or 0), None
+        elif column.type_code == NUMERIC_OID:
+            # Unconstrained NUMERIC, e.g. apartment.price, has no fixed scale to store it with
+            arrow_type, convert = pa.float64(), float
+        elif column.type_code in ARROW_TYPES:
+            arrow_type, convert = ARROW_TYPES[column.type_code], None
+        else:
+            arrow_type, convert = pa.string(), str
+
+        fields.append(pa.field(column.name, arrow_type))
+        converters.append(convert)
+
+    return pa.schema(fields), converters
+
+
+def write_query(conn, sql, params, path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Function to stream the result of a query into a file, chunk by chunk. The file is written
+    under a temporary name and moved into place once complete.
+
+    Args:
+        conn: connection to the database.
+        sql: query to export.
+        params: query parameters.
+        path: path of the file to write.
+        chunk_size: number of rows fetched from the server at a time.
+
+    Returns:
+        int: number of exported rows.
+
+    """
+
+    tmp_path = path + '.tmp'
+    exported = 0
+
+    # Named cursors live on the server, which hands rows over chunk by chunk
+    cur = conn.cursor(name='sssb_export')
+    cur.itersize = chunk_size
+    try:
+        cur.execute(sql, params)
+        rows = cur.fetchmany(chunk_size)
+        columns = [column[0] for column in cur.description]
+
+        if pq is not None:
+            writer = None
+            try:
+                while rows:
+                    if writer is None:
+                        schema, converters = get_arrow_schema(cur.description)
+                        writer = pq.ParquetWriter(tmp_path, schema, compression='snappy')
+                    table = pa.Table.from_pydict(
+                        {column: [row[i] if convert is None or row[i] is None else convert(row[i]) for row in rows]
+                         for i, (column, convert) in enumerate(zip(columns, converters))},
+                        schema=schema)
+                    writer.write_table(table)
+                    exported += len(rows)
+                    rows = cur.fetchmany(chunk_size)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+            if writer is None:
+                # Empty result: nothing to write
+                return 0
+
+        else:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                while rows:
+                    writer.writerows(rows)
+                    exported += len(rows)
+                    rows = cur.fetchmany(chunk_size)
+
+    finally:
+        cur.close()
+
+    os.replace(tmp_path, path)
+    return exported
+
+
+def export_history(out_dir, incremental=True, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Function to export the apartment, offer and state tables into the given directory.
+
+    Args:
+        out_dir: directory where the files are written.
+        incremental: if true, closed offers which were already exported are skipped.
+        chunk_size: number of rows fetched from the server at a time.
+
+    Raises:
+        DatabaseException: If something impedes to read from the database.
+
+    Returns:
+        dict: number of exported rows per file.
+
+    """
+
+    log = db_connection.log
+    extension = get_extension()
+    exported = {}
+
+    with db_connection.session() as conn:
+        try:
+            os.makedirs(os.path.join(out_dir, 'state'), exist_ok=True)
+
+            for table in ('apartment', 'offer', 'isoffered'):
+                path = os.path.join(out_dir, table + extension)
+                log.info('Export: Writing {0}'.format(path))
+                exported[path] = write_query(conn, 'SELECT * FROM {0}'.format(table), None, path, chunk_size)
+
+            cur = conn.cursor()
+            cur.execute("""SELECT nidoffer, end_date < now() FROM offer ORDER BY nidoffer""")
+            offers = cur.fetchall()
+            cur.close()
+
+            for offer_id, closed in offers:
+                partition = os.path.join(out_dir, 'state', 'nidoffer={0}'.format(offer_id))
+                path = os.path.join(partition, 'part' + extension)
+
+                # Closed offers do not change anymore, so an existing partition is final
+                if incremental and closed and os.path.exists(path):
+                    continue
+
+                os.makedirs(partition, exist_ok=True)
+                log.info('Export: Writing {0}'.format(path))
+                exported[path] = write_query(conn,
+                                             """SELECT * FROM state WHERE nidoffer = %s ORDER BY time_stamp""",
+                                             (offer_id,), path, chunk_size)
+
+            conn.commit()
+            return exported
+
+        except Exception as e:
+            conn.rollback()
+            log.exception("Export: Couldn't export history")
+            raise DatabaseException(str(e))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the sssb_data history into columnar files.')
+    parser.add_argument('out_dir', help='directory where the files are written')
+    parser.add_argument('--full', action='store_true', help='re-export offers which were already exported')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='number of rows fetched from the server at a time')
+    args = parser.parse_args()
+
+    for path, rows in sorted(export_history(args.out_dir, not args.full, args.chunk_size).items()):
+        print('{0}: {1} rows'.format(path, rows))
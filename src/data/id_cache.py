@@ -0,0 +1,224 @@
+# coding=utf-8
+"""Module providing process-local caches for resolving apartment names and offer timestamps
+into their database ids.
+
+"""
+
+__author__ = 'Andres'
+
+import bisect
+import datetime
+import threading
+
+from pytz import timezone
+
+DB_TIMEZONE = timezone('Europe/Stockholm')
+
+
+def to_datetime(time_stamp):
+    """Function to normalize a timestamp into a timezone-aware datetime, so it can be compared
+    against the offer windows returned by the database.
+
+    Args:
+        time_stamp: either a string in the format '%Y-%m-%d %H:%M:%S' or a datetime object.
+
+    Returns:
+        datetime.datetime: timezone-aware datetime. None if the timestamp cannot be interpreted.
+
+    """
+
+    if isinstance(time_stamp, str):
+        try:
+            time_stamp = datetime.datetime.strptime(time_stamp, '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            return None
+
+    if not isinstance(time_stamp, datetime.datetime):
+        return None
+
+    if time_stamp.tzinfo is None:
+        time_stamp = DB_TIMEZONE.localize(time_stamp)
+
+    return time_stamp
+
+
+class ApartmentIdCache(object):
+    """Class for caching the mapping between apartment names and their nIdApartment.
+
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.warmed = False
+        self.hits = 0
+        self.misses = 0
+
+        # Pooled connections may resolve ids from several threads at once
+        self.lock = threading.Lock()
+
+    def load(self, rows):
+        """Method to (re)populate the cache from a bulk query result.
+
+        Args:
+            rows: iterable of (name, nIdApartment) tuples.
+
+        """
+
+        ids = dict(rows)
+        with self.lock:
+            self.ids = ids
+            self.warmed = True
+
+    def get(self, name):
+        """Method to look up the id of an apartment.
+
+        Args:
+            name: string representing an apartment.
+
+        Returns:
+            int: apartment id, or None on a cache miss.
+
+        """
+
+        with self.lock:
+            apt_id = self.ids.get(name)
+            if apt_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return apt_id
+
+    def add(self, name, apt_id):
+        """Method to register a newly known apartment id.
+
+        Args:
+            name: string representing an apartment.
+            apt_id: id of the apartment.
+
+        """
+
+        with self.lock:
+            self.ids[name] = apt_id
+
+    def invalidate(self, name=None):
+        """Method to drop a single entry, or the whole cache if no name is given.
+
+        Args:
+            name: string representing an apartment.
+
+        """
+
+        with self.lock:
+            if name is None:
+                self.ids = {}
+                self.warmed = False
+            else:
+                self.ids.pop(name, None)
+
+
+class OfferIdCache(object):
+    """Class for caching offer windows, answering timestamp lookups with an interval search.
+
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.offers = []
+        self.max_ends = []
+        self.warmed = False
+        self.hits = 0
+        self.misses = 0
+
+        # Pooled connections may resolve ids from several threads at once
+        self.lock = threading.Lock()
+
+    def index(self):
+        """Method to rebuild the start dates and the running maximum of the end dates of the sorted
+        offer windows, which bounds the search of get. Must be called holding the lock.
+
+        """
+
+        self.starts = [offer[0] for offer in self.offers]
+        self.max_ends = []
+        for offer in self.offers:
+            self.max_ends.append(max(offer[1], self.max_ends[-1]) if self.max_ends else offer[1])
+
+    def load(self, rows):
+        """Method to (re)populate the cache from a bulk query result.
+
+        Args:
+            rows: iterable of (nIdOffer, start_date, end_date) tuples.
+
+        """
+
+        offers = sorted((to_datetime(start_date), to_datetime(end_date), offer_id)
+                        for offer_id, start_date, end_date in rows
+                        if start_date is not None and end_date is not None)
+        with self.lock:
+            self.offers = offers
+            self.index()
+            self.warmed = True
+
+    def get(self, time_stamp):
+        """Method to look up the offer whose window contains the given timestamp. Windows may
+        overlap, e.g. a long offer running alongside shorter ones, so the windows starting before
+        the timestamp are scanned from the latest one until one contains it, or none of the
+        earlier ones reaches it.
+
+        Args:
+            time_stamp: string or datetime representing a timestamp.
+
+        Returns:
+            int: offer id, or None on a cache miss.
+
+        """
+
+        time_stamp = to_datetime(time_stamp)
+
+        with self.lock:
+            if time_stamp is not None:
+                i = bisect.bisect_right(self.starts, time_stamp) - 1
+                while i >= 0 and time_stamp <= self.max_ends[i]:
+                    if time_stamp <= self.offers[i][1]:
+                        self.hits += 1
+                        return self.offers[i][2]
+                    i -= 1
+
+            self.misses += 1
+            return None
+
+    def add(self, offer_id, start_date, end_date):
+        """Method to register a newly known offer window, replacing the one cached for the same
+        offer, if any.
+
+        Args:
+            offer_id: id of the offer.
+            start_date: starting timestamp of the offer.
+            end_date: ending timestamp of the offer.
+
+        """
+
+        offer = (to_datetime(start_date), to_datetime(end_date), offer_id)
+        if offer[0] is None or offer[1] is None:
+            return
+
+        with self.lock:
+            offers = [cached for cached in self.offers if cached[2] != offer_id]
+            bisect.insort(offers, offer)
+            self.offers = offers
+            self.index()
+
+    def invalidate(self):
+        """Method to drop every cached offer window.
+
+        """
+
+        with self.lock:
+            self.starts = []
+            self.offers = []
+            self.max_ends = []
+            self.warmed = False
+
+
+apartments = ApartmentIdCache()
+offers = OfferIdCache()
@@ -0,0 +1,286 @@
+# coding=utf-8
+"""Module managing a local, read-optimized SQLite copy of the offers and state history of sssb_data
+database, so metrics and plots can be computed without querying the primary database.
+
+The copy is synchronized incrementally: offers and apartments are small and refreshed as a whole,
+while states are appended past the highest nIdState already stored (the watermark).
+
+"""
+
+__author__ = 'Andres'
+
+import datetime
+import os
+import sqlite3
+
+import pandas as pd
+
+import src.data.db_ops as db_connection
+from src.data.db_ops import DatabaseException
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'sssb_local.db')
+SYNC_CHUNK_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS apartment(
+    nidapartment    INTEGER PRIMARY KEY,
+    name            TEXT UNIQUE,
+    type            TEXT,
+    zone            TEXT,
+    price           REAL,
+    furnitured      INTEGER,
+    electricity     INTEGER,
+    _10_month       INTEGER
+);
+CREATE TABLE IF NOT EXISTS offer(
+    nidoffer        INTEGER PRIMARY KEY,
+    start_date      TEXT,
+    end_date        TEXT
+);
+CREATE TABLE IF NOT EXISTS isoffered(
+    nidapartment    INTEGER,
+    nidoffer        INTEGER,
+    win_credits     INTEGER,
+    PRIMARY KEY (nidapartment, nidoffer)
+);
+CREATE TABLE IF NOT EXISTS state(
+    nidstate        INTEGER PRIMARY KEY,
+    time_stamp      TEXT,
+    nidapartment    INTEGER,
+    nidoffer        INTEGER,
+    no_applicants   INTEGER,
+    top_credits     INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_state_offer_apartment_time ON state (nidoffer, nidapartment, time_stamp);
+"""
+
+
+def to_text(x):
+    """Function to convert a value read from PostgreSQL into one SQLite can store and sort.
+    Timestamps are stored as UTC ISO strings.
+
+    Args:
+        x: value to convert.
+
+    Returns:
+        value ready to be stored.
+
+    """
+
+    if isinstance(x, datetime.datetime):
+        if x.tzinfo is not None:
+            x = x.astimezone(datetime.timezone.utc)
+        return x.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(x, bool):
+        return int(x)
+    if x is not None and not isinstance(x, (int, float, str)):
+        return float(x)
+    return x
+
+
+class LocalStore(object):
+    """Class wrapping the local copy of the database, mirroring the read functions of db_ops.
+
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        """Method to close the local database.
+
+        """
+
+        self.conn.close()
+
+    def get_watermark(self):
+        """Method to get the highest nIdState stored locally.
+
+        Returns:
+            int: watermark, 0 if no state is stored.
+
+        """
+
+        return self.conn.execute("""SELECT coalesce(max(nidstate), 0) FROM state""").fetchone()[0]
+
+    def sync(self, chunk_size=SYNC_CHUNK_SIZE):
+        """Method to bring the local copy up to date with the primary database.
+
+        Args:
+            chunk_size: number of state rows fetched from the server at a time.
+
+        Raises:
+            DatabaseException: If something impedes to read from the primary database.
+
+        Returns:
+            int: number of new states copied.
+
+        """
+
+        log = db_connection.log
+        synced = 0
+
+        with db_connection.session() as conn:
+            cur = conn.cursor()
+            try:
+                log.info('Local store: Synchronizing from watermark {0}'.format(self.get_watermark()))
+                for table in ('apartment', 'offer', 'isoffered'):
+                    cur.execute('SELECT * FROM {0}'.format(table))
+                    rows = [tuple(to_text(x) for x in row) for row in cur.fetchall()]
+                    self.conn.execute('DELETE FROM {0}'.format(table))
+                    if rows:
+                        self.conn.executemany('INSERT INTO {0} VALUES ({1})'.format(table, ', '.join('?' * len(rows[0]))),
+                                              rows)
+
+                cur.close()
+
+                # Named cursors live on the server, which hands the new states over chunk by chunk
+                cur = conn.cursor(name='sssb_local_sync')
+                cur.itersize = chunk_size
+                cur.execute("""SELECT nidstate, time_stamp, nidapartment, nidoffer, no_applicants, top_credits
+                                  FROM state
+                                  WHERE nidstate > %s
+                                  ORDER BY nidstate""", (self.get_watermark(),))
+                rows = cur.fetchmany(chunk_size)
+                while rows:
+                    self.conn.executemany('INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?, ?, ?)',
+                                          [tuple(to_text(x) for x in row) for row in rows])
+                    synced += len(rows)
+                    rows = cur.fetchmany(chunk_size)
+
+                cur.close()
+                conn.commit()
+                self.conn.commit()
+                log.info('Local store: Copied {0} new states'.format(synced))
+                return synced
+
+            except Exception as e:
+                conn.rollback()
+                self.conn.rollback()
+                log.exception("Local store: Couldn't synchronize")
+                raise DatabaseException(str(e))
+
+    def read_series(self, sql, params):
+        """Method to read a time series query into a data frame indexed by timestamp. Timestamps are
+        stored in UTC, and converted to Stockholm time like the ones the database returns.
+
+        Args:
+            sql: query to run.
+            params: query parameters.
+
+        Returns:
+            pandas.DataFrame: query result.
+
+        """
+
+        df = pd.read_sql_query(sql, con=self.conn, index_col='time_stamp', params=params)
+        df.index = pd.to_datetime(df.index, utc=True).tz_convert('Europe/Stockholm')
+        return df
+
+    def get_current_offer_id(self):
+        """Method for retrieving the id of the current apartment offering.
+
+        Returns:
+            int: integer representing the desired id.
+
+        """
+
+        res = self.conn.execute("""SELECT nidoffer FROM offer ORDER BY nidoffer DESC LIMIT 1""").fetchone()
+        return res[0] if res is not None else None
+
+    def get_offer_end_date(self, offer_id):
+        """Method for retrieving the end date of a given apartment offering.
+
+        Args:
+            offer_id: id of desired apartment offering.
+
+        Returns:
+            string: end date as a UTC timestamp, None if there is no such offer.
+
+        """
+
+        res = self.conn.execute("""SELECT end_date FROM offer WHERE nidoffer = ?""", (offer_id,)).fetchone()
+        return res[0] if res is not None else None
+
+    def get_offered_apartments(self, offer_id):
+        """Method to get a list of apartment ids for a given offer.
+
+        Args:
+            offer_id: id of desired apartment offering.
+
+        Returns:
+            list: list containing the ids of the desired apartments.
+
+        """
+
+        rows = self.conn.execute("""SELECT nidapartment FROM isoffered WHERE nidoffer = ?""", (offer_id,))
+        return [r[0] for r in rows]
+
+    def get_all_series(self, column, offer_id, apt_list, resolution=None):
+        """Method to get the time series of a State column for the specified offer and apartments.
+
+        Args:
+            column: either "top_credits" or "no_applicants".
+            offer_id: id of desired apartment offering.
+            apt_list: list of apartment ids whose info we want to retrieve.
+            resolution: optional bucket width (e.g. '1 hour'), keeping the last value per bucket.
+
+        Returns:
+            pandas.DataFrame: data frame containing the times series for each apartment.
+
+        """
+
+        apt_list = list(apt_list)
+        sql = """SELECT apartment.name, time_stamp, {0}
+                    FROM state JOIN apartment
+                      ON state.nidapartment = apartment.nidapartment
+                    WHERE nidoffer = ?
+                    AND state.nidapartment IN ({1})
+                    ORDER BY time_stamp""".format(column, ', '.join('?' * len(apt_list)))
+        df = self.read_series(sql, [offer_id] + apt_list)
+
+        if resolution is not None:
+            df = df.groupby([df.index.floor(pd.Timedelta(resolution)), 'name']).last().reset_index('name')
+
+        return db_connection.extend_series(df.pivot(columns='name', values=column), self.get_offer_end_date(offer_id))
+
+    def get_all_top_credits(self, offer_id, apt_list, resolution=None):
+        return self.get_all_series('top_credits', offer_id, apt_list, resolution)
+
+    def get_all_no_applicants(self, offer_id, apt_list, resolution=None):
+        return self.get_all_series('no_applicants', offer_id, apt_list, resolution)
+
+    def get_state_history_by_type(self, offer_id, apt_type, resolution=None):
+        """Method to get both the top credits and the number of applicants time series of the
+        apartments of a given type offered in the given offer.
+
+        Args:
+            offer_id: id of desired apartment offering.
+            apt_type: apartment type to use for filtering results.
+            resolution: optional bucket width (e.g. '1 hour'), keeping the last values per bucket.
+
+        Returns:
+            pandas.DataFrame: data frame indexed by timestamp, with ("top_credits" | "no_applicants", name)
+                              column pairs.
+
+        """
+
+        sql = """SELECT apartment.name, state.time_stamp, state.top_credits, state.no_applicants
+                    FROM state
+                    JOIN apartment
+                      ON state.nidapartment = apartment.nidapartment
+                    JOIN isoffered
+                      ON isoffered.nidapartment = state.nidapartment
+                      AND isoffered.nidoffer = state.nidoffer
+                    WHERE state.nidoffer = ?
+                    AND apartment.type = ?
+                    ORDER BY state.time_stamp"""
+        df = self.read_series(sql, (offer_id, apt_type))
+
+        if resolution is not None:
+            df = df.groupby([df.index.floor(pd.Timedelta(resolution)), 'name']).last().reset_index('name')
+
+        return db_connection.extend_series(df.pivot(columns='name')[['top_credits', 'no_applicants']],
+                                           self.get_offer_end_date(offer_id))
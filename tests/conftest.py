@@ -0,0 +1,48 @@
+"""Shared pytest configuration and fixtures.
+
+"""
+
+__author__ = 'Andres'
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'tests', 'fixtures')
+
+sys.path.insert(0, ROOT)
+
+# db_ops logs into this directory as soon as it is imported
+os.makedirs(os.path.join(ROOT, 'Logs'), exist_ok=True)
+
+
+@pytest.fixture
+def fixture_dir():
+    """Directory with the recorded widget and detail pages of a three-apartment offering.
+
+    """
+
+    return os.path.join(FIXTURES, 'sssb')
+
+
+@pytest.fixture
+def state_path(tmpdir):
+    """Path of a change-detection state file private to the test.
+
+    """
+
+    return str(tmpdir.join('crawl_state.json'))
+
+
+@pytest.fixture
+def server(fixture_dir):
+    """Base URL of a local server answering with the recorded pages.
+
+    """
+
+    from fixture_server import serve
+
+    with serve(fixture_dir) as base_url:
+        yield base_url
@@ -0,0 +1,114 @@
+# coding=utf-8
+"""Local HTTP server answering with the recorded pages, whatever the host they were recorded from,
+for tests going through a real network stack.
+
+"""
+
+__author__ = 'Andres'
+
+import os
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from src.control.fixtures import load_index
+
+PASSWORD = 'hunter2'
+
+LOGIN_PAGE = '''<html><body>
+<form id="header-loginform" action="/wp-login.php" method="post">
+<input type="hidden" name="redirect_to" value="/en/my-pages/">
+<input type="text" id="user_login" name="log">
+<input type="password" id="user_pass" name="pwd">
+<button type="submit">Log in</button>
+</form>
+</body></html>'''
+
+MEMBER_PAGE = '''<html><body>
+<a id="logout" href="/wp-login.php?action=logout">Log out</a>
+</body></html>'''
+
+
+def make_handler(fixture_dir):
+    """Function to build a request handler answering with the recorded pages, plus a login form
+    which only accepts PASSWORD.
+
+    Args:
+        fixture_dir: directory holding the recorded responses.
+
+    Returns:
+        class: request handler.
+
+    """
+
+    recorded = {}
+    for url, entry in load_index(fixture_dir).items():
+        parts = urlsplit(url)
+        recorded[parts.path + ('?' + parts.query if parts.query else '')] = entry
+
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, body, content_type='text/html; charset=utf-8'):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/en':
+                self.reply(LOGIN_PAGE.encode('utf-8'))
+            elif self.path in recorded:
+                entry = recorded[self.path]
+                with open(os.path.join(fixture_dir, entry['file']), 'rb') as f:
+                    self.reply(f.read(), entry['headers']['Content-Type'])
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+            accepted = form.get('pwd') == [PASSWORD] and form.get('redirect_to') == ['/en/my-pages/']
+            self.reply((MEMBER_PAGE if accepted else LOGIN_PAGE).encode('utf-8'))
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+@contextmanager
+def serve(fixture_dir):
+    """Context manager running a local server answering with the recorded pages.
+
+    Args:
+        fixture_dir: directory holding the recorded responses.
+
+    Yields:
+        string: base URL of the server.
+
+    """
+
+    httpd = HTTPServer(('127.0.0.1', 0), make_handler(fixture_dir))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield 'http://127.0.0.1:{0}'.format(httpd.server_address[1])
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get_local_url(base_url, url):
+    """Function to get the URL under which the local server answers a recorded URL.
+
+    Args:
+        base_url: base URL of the server.
+        url: recorded URL.
+
+    Returns:
+        string: local URL.
+
+    """
+
+    parts = urlsplit(url)
+    return base_url + parts.path + ('?' + parts.query if parts.query else '')
@@ -0,0 +1,109 @@
+# coding=utf-8
+"""Builders of synthetic widget pages, with the markup of the recorded ones, for tests and
+benchmarks needing arbitrary listing sizes.
+
+"""
+
+__author__ = 'Andres'
+
+import hashlib
+import json
+import os
+
+from scrapy.http import HtmlResponse
+
+from src.control.fixtures import INDEX_FILE
+from src.control.sssb_scraper import PAGE_SIZE, get_widget_url
+
+DETAIL_URL = 'https://www.sssb.se/soka-bostad/sok-ledigt/lediga-bostader/lagenhet/?refid={0}'
+
+
+def make_listing(i, zone=True, interest=True):
+    """Function to build the markup of the i-th synthetic listing.
+
+    Args:
+        i: listing number, which determines its values.
+        zone: if false, the listing has no zone.
+        interest: if false, the listing has no applicant data.
+
+    Returns:
+        string: escaped markup of the listing, as found in the widget payload.
+
+    """
+
+    url = DETAIL_URL.format(i)
+    details = []
+    if zone:
+        details.append('<dt>Område</dt><dd class=\\"ObjektOmrade\\"><a href=\\"https://www.sssb.se/omrade/\\">'
+                       'Zone {0}</a></dd>'.format(i % 7))
+    details.append('<dt>Hyra</dt><dd class=\\"ObjektHyra\\">{0} kr/mån</dd>'.format(3000 + i))
+    if interest:
+        details.append('<dt>Intresse</dt><dd class=\\"ObjektAntalIntresse right\\">{0} ({1}st)</dd>'.format(
+            10 * i, i % 50))
+
+    return ('<div class=\\"Box ObjektListItem\\">'
+            '<div class=\\"ObjektIntro\\">'
+            '<h3 class=\\"ObjektTyp\\"><a href=\\"{url}\\">Korridorrum</a></h3>'
+            '<h4 class=\\"ObjektAdress\\"><a href=\\"{url}\\">Testvägen {i} / {i:04d}</a></h4>'
+            '<div class=\\"ObjektEgenskaper\\"><div data-title=\\"Möblerad\\"><span>Möblerad</span></div></div>'
+            '</div>'
+            '<dl class=\\"ObjektDetaljer\\">{details}</dl>'
+            '</div>').format(url=url, i=i, details=''.join(details))
+
+
+def make_widget_body(listings, no_listings=None):
+    """Function to build a widget payload.
+
+    Args:
+        listings: markup of the listings of the page.
+        no_listings: total number of listings shown in the summary, the page size by default.
+
+    Returns:
+        bytes: widget payload.
+
+    """
+
+    no_listings = len(listings) if no_listings is None else no_listings
+    return ('jQuery17208255315905375711_1549963009511({"html":{'
+            '"objektsummering@lagenheter":"<p class=\\"ObjektSummering\\">Just nu finns <strong>' + str(no_listings) +
+            '</strong> lediga bostäder</p>",'
+            '"objektlistabilder@lagenheter":"<div class=\\"ObjektLista\\">' + ''.join(listings) + '</div>"'
+            '}});').encode('utf-8')
+
+
+def make_widget_response(listings, no_listings=None, page=0):
+    """Function to build the response of a widget page.
+
+    Args:
+        listings: markup of the listings of the page.
+        no_listings: total number of listings shown in the summary, the page size by default.
+        page: page index.
+
+    Returns:
+        scrapy.http.HtmlResponse: widget response.
+
+    """
+
+    return HtmlResponse(url=get_widget_url(page), body=make_widget_body(listings, no_listings), encoding='utf-8')
+
+
+def write_widget_fixture(fixture_dir, pages, no_listings):
+    """Function to write widget pages into a fixture directory, as the fixtures module records them.
+
+    Args:
+        fixture_dir: directory where the pages are written.
+        pages: markup of the listings of every page.
+        no_listings: total number of listings shown in the summary.
+
+    """
+
+    index = {}
+    for page, listings in enumerate(pages):
+        url = get_widget_url(page, PAGE_SIZE)
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest() + '.html'
+        with open(os.path.join(fixture_dir, name), 'wb') as f:
+            f.write(make_widget_body(listings, no_listings))
+        index[url] = {'file': name, 'status': 200, 'headers': {'Content-Type': 'text/javascript; charset=utf-8'}}
+
+    with open(os.path.join(fixture_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump(index, f)
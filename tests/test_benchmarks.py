@@ -0,0 +1,119 @@
+# coding=utf-8
+"""Throughput benchmarks of the widget parsers and of the loader processors, run with
+pytest-benchmark over recorded responses.
+
+"""
+
+__author__ = 'Andres'
+
+import time
+
+import pytest
+
+from src.control.fixtures import get_widget_responses
+from src.control.item_loaders import SSSBApartmentLoader, SSSBApartmentStateLoader
+from src.control.sssb_scraper import SSSBApartmentInfoSpider, SSSBApartmentStateSpider
+from synthetic import make_listing, make_widget_response
+
+
+@pytest.fixture
+def responses(fixture_dir):
+    return get_widget_responses(fixture_dir)
+
+
+def report_rate(benchmark, count, unit='items'):
+    """Function adding the throughput of the fastest round to the benchmark report.
+
+    """
+
+    if benchmark.stats:
+        benchmark.extra_info['{0}/s'.format(unit)] = count / benchmark.stats.stats.min
+
+
+def test_info_parser(benchmark, responses):
+    def parse():
+        spider = SSSBApartmentInfoSpider()
+        return [item for response in responses for item in spider.parse_apartments(response)]
+
+    items = benchmark(parse)
+    report_rate(benchmark, len(items))
+    assert len(items) == 3
+
+
+def test_state_parser(benchmark, responses, state_path):
+    def parse():
+        spider = SSSBApartmentStateSpider(state_path=state_path)
+        return [item for response in responses for item in spider.parse_states(response)]
+
+    items = benchmark(parse)
+    report_rate(benchmark, len(items))
+    assert len(items) == 3
+
+
+def test_apartment_loader_processors(benchmark, responses):
+    names = [x for r in responses for x in r.xpath('//h4[@class=\'\\"ObjektAdress\\"\']/a/text()').extract()]
+    prices = [x for r in responses for x in r.xpath('//dd[@class=\'\\"ObjektHyra\\"\']/text()').extract()]
+
+    def process():
+        return SSSBApartmentLoader.apt_name_in(names) + SSSBApartmentLoader.apt_price_in(prices)
+
+    values = benchmark(process)
+    report_rate(benchmark, len(values), 'values')
+    assert values[3:] == ['3862', '6234', '4120']
+
+
+def test_state_loader_processors(benchmark, responses):
+    interests = [x for r in responses
+                 for x in r.xpath('//dd[@class=\'\\"ObjektAntalIntresse\']/text()').extract()]
+
+    def process():
+        return (SSSBApartmentStateLoader.apt_no_applicants_in(interests),
+                SSSBApartmentStateLoader.apt_top_credits_in(interests))
+
+    no_applicants, top_credits = benchmark(process)
+    report_rate(benchmark, len(no_applicants) + len(top_credits), 'values')
+    assert no_applicants == ['12', '148', '3']
+    assert top_credits == ['421', '1290', '87']
+
+
+@pytest.mark.parametrize('no_listings', [100, 1000, 10000])
+def test_info_parser_scaling(benchmark, no_listings):
+    benchmark.group = 'info parser scaling'
+    response = make_widget_response([make_listing(i) for i in range(no_listings)])
+
+    def parse():
+        return list(SSSBApartmentInfoSpider().parse_apartments(response))
+
+    items = benchmark.pedantic(parse, rounds=3)
+    report_rate(benchmark, len(items))
+    assert len(items) == no_listings
+
+
+@pytest.mark.parametrize('no_listings', [100, 1000, 10000])
+def test_state_parser_scaling(benchmark, no_listings, state_path):
+    benchmark.group = 'state parser scaling'
+    response = make_widget_response([make_listing(i) for i in range(no_listings)])
+
+    def parse():
+        return list(SSSBApartmentStateSpider(state_path=state_path).parse_states(response))
+
+    items = benchmark.pedantic(parse, rounds=3)
+    report_rate(benchmark, len(items))
+    assert len(items) == no_listings
+
+
+def test_state_parser_scales_linearly(state_path):
+    per_listing = []
+    for no_listings in (500, 5000):
+        response = make_widget_response([make_listing(i) for i in range(no_listings)])
+
+        best = float('inf')
+        for _ in range(2):
+            start = time.perf_counter()
+            list(SSSBApartmentStateSpider(state_path=state_path).parse_states(response))
+            best = min(best, time.perf_counter() - start)
+
+        per_listing.append(best / no_listings)
+
+    # A quadratic parse would take about ten times longer per listing on the larger page
+    assert per_listing[1] < 3 * per_listing[0]
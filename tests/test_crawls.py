@@ -0,0 +1,35 @@
+# coding=utf-8
+"""Tests of the crawl orchestration, running real crawls against the recorded pages served from a
+local server.
+
+"""
+
+__author__ = 'Andres'
+
+import pytest
+
+import src.control.functions as fn
+import src.control.sssb_scraper as sssb_scraper
+from src.control.sssb_scraper import SSSBApartmentInfoSpider, SSSBApartmentStateSpider
+from fixture_server import get_local_url
+
+
+@pytest.fixture
+def local_widget(server, monkeypatch):
+    widget_url = sssb_scraper.get_widget_url(0, 100)
+    monkeypatch.setattr(sssb_scraper, 'get_widget_url', lambda page, page_size=100: get_local_url(server, widget_url))
+
+
+def get_scraped(crawlers):
+    return [crawler.stats.get_value('item_scraped_count') for crawler in crawlers]
+
+
+def test_several_crawls_in_one_process(local_widget, tmpdir):
+    info = (SSSBApartmentInfoSpider, fn.get_crawl_settings({}), {})
+
+    def states(name):
+        return SSSBApartmentStateSpider, fn.get_crawl_settings({}), {'state_path': str(tmpdir.join(name))}
+
+    assert get_scraped(fn.crawl([info])) == [3]
+    assert get_scraped(fn.crawl([info, states('chained.json')])) == [3, 3]
+    assert get_scraped(fn.crawl([info, states('concurrent.json')], chained=False)) == [3, 3]
@@ -0,0 +1,105 @@
+# coding=utf-8
+"""Tests of the Parquet export, over an in-memory cursor reporting the column types the server would.
+
+"""
+
+__author__ = 'Andres'
+
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from psycopg2.extensions import Column
+from pytz import utc
+
+from src.data import export
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+
+class FakeCursor(object):
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = list(rows)
+        self.itersize = None
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchmany(self, size):
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = rows
+
+    def cursor(self, name=None):
+        return FakeCursor(self.description, self.rows)
+
+
+STATE_DESCRIPTION = [
+    Column(name='nidstate', type_code=23),
+    Column(name='time_stamp', type_code=1184),
+    Column(name='nidapartment', type_code=23),
+    Column(name='nidoffer', type_code=23),
+    Column(name='no_applicants', type_code=23),
+    Column(name='top_credits', type_code=23),
+]
+
+
+def test_get_arrow_schema():
+    schema, converters = export.get_arrow_schema([
+        Column(name='flag', type_code=16),
+        Column(name='big', type_code=20),
+        Column(name='price', type_code=1700),
+        Column(name='fee', type_code=1700, precision=10, scale=2),
+        Column(name='day', type_code=1082),
+        Column(name='local', type_code=1114),
+        Column(name='name', type_code=1043),
+        Column(name='other', type_code=114),
+    ])
+
+    assert schema.types == [pa.bool_(), pa.int64(), pa.float64(), pa.decimal128(10, 2), pa.date32(),
+                            pa.timestamp('us'), pa.string(), pa.string()]
+    assert converters == [None, None, float, None, None, None, None, str]
+
+
+def test_chunks_share_the_schema(tmpdir):
+    rows = [(1, datetime(2019, 3, 1, 12, tzinfo=utc), 1, 7, 3, 120),
+            (2, datetime(2019, 3, 1, 13, tzinfo=utc), 2, 7, 4, 130),
+            # Second chunk: states stored outside any offer
+            (3, datetime(2019, 3, 9, 12, tzinfo=utc), 1, None, 5, 140),
+            (4, datetime(2019, 3, 9, 13, tzinfo=utc), 2, None, 6, 150)]
+    path = str(tmpdir.join('state.parquet'))
+
+    exported = export.write_query(FakeConnection(STATE_DESCRIPTION, rows), 'SELECT', None, path, chunk_size=2)
+
+    table = pq.read_table(path)
+    assert exported == 4
+    assert table.schema.field('nidoffer').type == pa.int32()
+    assert table.schema.field('time_stamp').type == pa.timestamp('us', tz='UTC')
+    assert table.column('nidoffer').to_pylist() == [7, 7, None, None]
+
+
+def test_numeric_and_dates(tmpdir):
+    description = [Column(name='price', type_code=1700), Column(name='day', type_code=1082)]
+    rows = [(None, None), (Decimal('3862.50'), date(2019, 3, 4))]
+    path = str(tmpdir.join('apartment.parquet'))
+
+    export.write_query(FakeConnection(description, rows), 'SELECT', None, path, chunk_size=1)
+
+    assert pq.read_table(path).to_pydict() == {'price': [None, 3862.5], 'day': [None, date(2019, 3, 4)]}
+
+
+def test_empty_result(tmpdir):
+    path = str(tmpdir.join('empty.parquet'))
+
+    assert export.write_query(FakeConnection(STATE_DESCRIPTION, []), 'SELECT', None, path) == 0
+    assert not tmpdir.join('empty.parquet').exists()
@@ -0,0 +1,94 @@
+# coding=utf-8
+"""Tests of the final credits forecaster, over synthetic offers whose final credits grow linearly
+with the state.
+
+"""
+
+__author__ = 'Andres'
+
+import numpy as np
+import pytest
+
+from src.control.forecast import FinalCreditsForecaster
+
+
+def make_offer(offer_id, no_states=40, seed=0):
+    """Function to build the states of a closed offer, whose final credits are 50 + 1.2 top credits
+    + 2 applicants, plus some noise.
+
+    Returns:
+        tuple: offer ids, progress, top credits, numbers of applicants and final credits.
+
+    """
+
+    rng = np.random.RandomState(seed + offer_id)
+    progress = rng.uniform(0, 1, no_states)
+    top_credits = rng.uniform(100, 1000, no_states)
+    no_applicants = rng.randint(1, 200, no_states)
+    final_credits = 50 + 1.2 * top_credits + 2 * no_applicants + rng.normal(0, 5, no_states)
+    return np.full(no_states, offer_id), progress, top_credits, no_applicants, final_credits
+
+
+def concat(*offers):
+    return tuple(np.concatenate(columns) for columns in zip(*offers))
+
+
+@pytest.fixture
+def model():
+    return FinalCreditsForecaster(no_bins=4).partial_fit(*concat(*[make_offer(k) for k in range(1, 6)]))
+
+
+def test_same_offer_twice_is_ignored(model):
+    xtx, xty = model.xtx.copy(), model.xty.copy()
+
+    model.partial_fit(*make_offer(3))
+
+    np.testing.assert_array_equal(model.xtx, xtx)
+    np.testing.assert_array_equal(model.xty, xty)
+    assert model.offers == {1, 2, 3, 4, 5}
+
+
+def test_incremental_fit_matches_fit_at_once(model):
+    incremental = FinalCreditsForecaster(no_bins=4)
+    for k in range(1, 6):
+        incremental.partial_fit(*make_offer(k))
+
+    np.testing.assert_allclose(incremental.get_weights(), model.get_weights())
+    assert incremental.offers == model.offers
+
+
+def test_save_and_load(model, tmpdir):
+    path = str(tmpdir.join('model.npz'))
+    model.save(path)
+
+    loaded = FinalCreditsForecaster.load(path)
+    progress, top_credits, no_applicants = [0.1, 0.5, 0.9], [200, 400, 800], [10, 50, 150]
+
+    assert loaded.no_bins == model.no_bins
+    assert loaded.offers == model.offers
+    np.testing.assert_array_equal(loaded.predict(progress, top_credits, no_applicants),
+                                  model.predict(progress, top_credits, no_applicants))
+
+
+def test_load_without_model(tmpdir):
+    model = FinalCreditsForecaster.load(str(tmpdir.join('missing.npz')), no_bins=8)
+
+    assert model.no_bins == 8
+    assert model.offers == set()
+
+
+def test_predict(model):
+    prediction = model.predict([0.1, 0.6], [300, 700], [20, 100])
+
+    np.testing.assert_allclose(prediction, [50 + 1.2 * 300 + 2 * 20, 50 + 1.2 * 700 + 2 * 100], rtol=0.02)
+
+
+def test_predictions_never_below_the_top_credits(model):
+    # A model trained on final credits below the top credits would otherwise forecast a drop
+    _, progress, top_credits, no_applicants, _ = make_offer(6)
+    shrinking = FinalCreditsForecaster(no_bins=4).partial_fit(np.full(40, 6), progress, top_credits, no_applicants,
+                                                              top_credits / 2)
+
+    top = np.array([150., 500., 900.])
+    assert (shrinking.predict([0.2, 0.5, 0.8], top, [5, 50, 150]) >= top).all()
+    assert (model.predict([0.2, 0.5, 0.8], top, [5, 50, 150]) >= top).all()
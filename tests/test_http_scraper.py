@@ -0,0 +1,97 @@
+# coding=utf-8
+"""Tests of the plain-HTTP offer crawler against the recorded pages, served from a local server.
+
+"""
+
+__author__ = 'Andres'
+
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import pytest
+from pytz import timezone
+
+import src.control.http_scraper as http_scraper
+from src.control.selenium_scraper import parse_offer_deadline
+from fixture_server import PASSWORD
+
+
+@pytest.fixture
+def crawler():
+    crawler = http_scraper.SSSBApartmentOfferHTTP(max_workers=2, timeout=5)
+    yield crawler
+    crawler.close()
+
+
+def deadline(*args):
+    return timezone('Europe/Stockholm').localize(datetime(*args))
+
+
+@pytest.mark.parametrize('offering, expected', [
+    ('Erbjudandet publiceras till 2019-03-04 kl 12:00', deadline(2019, 3, 4, 12, 0)),
+    ('Sista dag att anmäla intresse: 2019-03-04 klockan 12:00', deadline(2019, 3, 4, 12, 0)),
+    ('The offer is published until 2019-03-05 at 9:00', deadline(2019, 3, 5, 9, 0)),
+])
+def test_parse_offer_deadline(offering, expected):
+    assert parse_offer_deadline(offering) == expected
+
+
+def test_parse_offer_deadline_without_deadline():
+    with pytest.raises(ValueError):
+        parse_offer_deadline('Erbjudandet är avslutat')
+
+
+def test_get_apartment_urls(server, crawler, monkeypatch):
+    widget_url = urlsplit(http_scraper.get_widget_url(0))
+    monkeypatch.setattr(http_scraper, 'get_widget_url',
+                        lambda page: '{0}{1}?{2}'.format(server, widget_url.path, widget_url.query))
+
+    assert crawler.get_apartment_urls() == [
+        'https://www.sssb.se/soka-bostad/sok-ledigt/lediga-bostader/lagenhet/?refid={0:04d}'.format(i)
+        for i in range(1, 4)]
+
+
+@pytest.mark.parametrize('refid, expected', [
+    ('0001', ['Körsbärsvägen 4 C / 1024', deadline(2019, 3, 4, 12, 0)]),
+    ('0002', ['Professorsslingan 23 / 1102', deadline(2019, 3, 4, 12, 0)]),
+    ('0003', ['Strix, Vitterhetsvägen 12 / 0507', deadline(2019, 3, 5, 9, 0)]),
+])
+def test_get_apartment_and_offer(server, crawler, refid, expected):
+    url = '{0}/soka-bostad/sok-ledigt/lediga-bostader/lagenhet/?refid={1}'.format(server, refid)
+
+    assert crawler.get_apartment_and_offer(url) == expected
+
+
+def test_get_apartment_and_offer_missing_page(server, crawler):
+    assert crawler.get_apartment_and_offer(server + '/missing/') is None
+
+
+@pytest.mark.parametrize('password, logged_in', [(PASSWORD, True), ('wrong', False)])
+def test_login(server, crawler, monkeypatch, password, logged_in):
+    monkeypatch.setattr(http_scraper, 'SSSB_FRONTPAGE', server + '/en')
+    monkeypatch.setenv('SSSB_USERNAME', 'user')
+    monkeypatch.setenv('SSSB_PASS', password)
+
+    crawler.login()
+
+    assert crawler.logged_in is logged_in
+
+
+def test_scrape_offering_stores_one_batch(server, crawler, monkeypatch):
+    urls = ['{0}/soka-bostad/sok-ledigt/lediga-bostader/lagenhet/?refid={1}'.format(server, refid)
+            for refid in ['0001', 'missing', '0003']]
+    batches = []
+
+    @contextmanager
+    def session():
+        yield None
+
+    monkeypatch.setattr(crawler, 'get_apartment_urls', lambda: urls)
+    monkeypatch.setattr(http_scraper.db_connection, 'session', session)
+    monkeypatch.setattr(http_scraper.db_connection, 'set_offered_apartments', batches.append)
+    crawler.logged_in = True
+
+    assert crawler.scrape_offering() == [urls[1]]
+    assert batches == [[['Körsbärsvägen 4 C / 1024', deadline(2019, 3, 4, 12, 0)],
+                        ['Strix, Vitterhetsvägen 12 / 0507', deadline(2019, 3, 5, 9, 0)]]]
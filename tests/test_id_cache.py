@@ -0,0 +1,100 @@
+# coding=utf-8
+"""Tests of the apartment and offer id caches.
+
+"""
+
+__author__ = 'Andres'
+
+import threading
+
+import pytest
+
+from src.data.id_cache import ApartmentIdCache, OfferIdCache
+
+
+@pytest.fixture
+def offers():
+    """Offer cache with two consecutive weekly offers and a long offer overlapping both.
+
+    """
+
+    cache = OfferIdCache()
+    cache.load([(1, '2019-03-01 10:00:00', '2019-03-08 10:00:00'),
+                (2, '2019-03-08 12:00:00', '2019-03-15 10:00:00'),
+                (3, '2019-03-02 10:00:00', '2019-03-30 10:00:00')])
+    return cache
+
+
+@pytest.mark.parametrize('time_stamp, offer_id', [
+    ('2019-03-01 12:00:00', 1),
+    # Inside both the first and the long offer, the latest one to start is taken
+    ('2019-03-05 12:00:00', 3),
+    # Inside the long offer only, though another one started later
+    ('2019-03-20 12:00:00', 3),
+    ('2019-03-08 12:00:00', 2),
+    ('2019-02-28 12:00:00', None),
+    ('2019-04-01 12:00:00', None),
+    ('not a timestamp', None),
+])
+def test_offer_lookup(offers, time_stamp, offer_id):
+    assert offers.get(time_stamp) == offer_id
+
+
+def test_offer_lookup_counts(offers):
+    offers.get('2019-03-01 12:00:00')
+    offers.get('2019-04-01 12:00:00')
+
+    assert (offers.hits, offers.misses) == (1, 1)
+
+
+def test_offer_added_twice(offers):
+    offers.add(4, '2019-04-01 10:00:00', '2019-04-08 10:00:00')
+    offers.add(4, '2019-04-01 10:00:00', '2019-04-08 10:00:00')
+
+    assert [offer[2] for offer in offers.offers] == [1, 3, 2, 4]
+    assert offers.get('2019-04-02 12:00:00') == 4
+
+
+def test_offer_added_again_with_a_new_window(offers):
+    offers.add(2, '2019-03-08 12:00:00', '2019-03-16 10:00:00')
+
+    assert [offer[2] for offer in offers.offers] == [1, 3, 2]
+    assert offers.get('2019-03-15 12:00:00') == 2
+
+
+def test_offer_invalidate(offers):
+    offers.invalidate()
+
+    assert not offers.warmed
+    assert offers.get('2019-03-01 12:00:00') is None
+
+
+def test_apartment_lookup():
+    cache = ApartmentIdCache()
+    cache.load([('A', 1), ('B', 2)])
+    cache.add('C', 3)
+    cache.invalidate('A')
+
+    assert [cache.get(name) for name in ['A', 'B', 'C']] == [None, 2, 3]
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_concurrent_lookups(offers):
+    apartments = ApartmentIdCache()
+
+    def work(k):
+        for i in range(500):
+            apartments.add('Apartment {0}'.format(i % 50), i % 50)
+            apartments.get('Apartment {0}'.format(i))
+            offers.add(10 + k, '2019-05-01 10:00:00', '2019-05-08 10:00:00')
+            offers.get('2019-03-20 12:00:00')
+
+    threads = [threading.Thread(target=work, args=(k,)) for k in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert apartments.hits + apartments.misses == 8 * 500
+    assert offers.hits == 8 * 500
+    assert sorted(offer[2] for offer in offers.offers) == [1, 2, 3] + list(range(10, 18))
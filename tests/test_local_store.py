@@ -0,0 +1,84 @@
+# coding=utf-8
+"""Tests of the readers of the local SQLite copy, over rows written straight into it.
+
+"""
+
+__author__ = 'Andres'
+
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from src.data.local_store import LocalStore, to_text
+
+
+@pytest.fixture
+def store(tmpdir):
+    """Local store with a closed offer (1) and an open one (2), two apartments of type "Korridorrum"
+    offered in both and a state change of each apartment early in every offer.
+
+    """
+
+    store = LocalStore(str(tmpdir.join('local.db')))
+    now = datetime.utcnow().replace(microsecond=0)
+
+    store.conn.executemany('INSERT INTO apartment VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           [(1, 'A', 'Korridorrum', 'Lappis', 3000, 0, 0, 0),
+                            (2, 'B', 'Korridorrum', 'Lappis', 3100, 0, 0, 0)])
+    store.conn.executemany('INSERT INTO offer VALUES (?, ?, ?)',
+                           [(1, '2019-03-01 10:00:00', '2019-03-08 10:00:00'),
+                            (2, to_text(now - timedelta(days=2)), to_text(now + timedelta(days=5)))])
+    store.conn.executemany('INSERT INTO isoffered VALUES (?, ?, ?)',
+                           [(1, 1, None), (2, 1, None), (1, 2, None), (2, 2, None)])
+    store.conn.executemany('INSERT INTO state VALUES (?, ?, ?, ?, ?, ?)',
+                           [(1, '2019-03-01 12:00:00', 1, 1, 3, 100),
+                            (2, '2019-03-01 12:20:00', 2, 1, 5, 200),
+                            (3, '2019-03-01 12:40:00', 1, 1, 4, 150),
+                            (4, to_text(now - timedelta(days=1)), 1, 2, 1, 50),
+                            (5, to_text(now - timedelta(hours=20)), 2, 2, 2, 60)])
+    store.conn.commit()
+
+    yield store
+    store.close()
+
+
+def test_closed_offer_series_extend_to_the_end_date(store):
+    df = store.get_all_top_credits(1, [1, 2])
+
+    assert str(df.index.tz) == 'Europe/Stockholm'
+    assert df.index[-1] == pd.Timestamp('2019-03-08 11:00:00', tz='Europe/Stockholm')
+    assert df.iloc[-1].to_dict() == {'A': 150, 'B': 200}
+
+
+def test_open_offer_series_extend_to_now(store):
+    before = pd.Timestamp.now(tz='UTC').floor('s')
+    df = store.get_all_no_applicants(2, [1, 2])
+
+    assert before <= df.index[-1] <= pd.Timestamp.now(tz='UTC')
+    assert df.iloc[-1].to_dict() == {'A': 1, 'B': 2}
+
+
+def test_state_history_by_type_extends_to_the_end_date(store):
+    df = store.get_state_history_by_type(1, 'Korridorrum')
+
+    assert df.index[-1] == pd.Timestamp('2019-03-08 10:00:00', tz='UTC')
+    assert df['top_credits'].iloc[-1].to_dict() == {'A': 150, 'B': 200}
+    assert df['no_applicants'].iloc[-1].to_dict() == {'A': 4, 'B': 5}
+
+
+def test_bucketed_series(store):
+    df = store.get_all_top_credits(1, [1, 2], resolution='1 hour')
+
+    assert list(df.index) == [pd.Timestamp('2019-03-01 12:00:00', tz='UTC'),
+                              pd.Timestamp('2019-03-08 10:00:00', tz='UTC')]
+    assert df.iloc[0].to_dict() == {'A': 150, 'B': 200}
+
+
+def test_bucketed_state_history_by_type(store):
+    df = store.get_state_history_by_type(1, 'Korridorrum', resolution='1 hour')
+
+    assert list(df.index) == [pd.Timestamp('2019-03-01 12:00:00', tz='UTC'),
+                              pd.Timestamp('2019-03-08 10:00:00', tz='UTC')]
+    assert df['top_credits'].iloc[0].to_dict() == {'A': 150, 'B': 200}
+    assert df['no_applicants'].iloc[0].to_dict() == {'A': 4, 'B': 5}
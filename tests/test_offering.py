@@ -0,0 +1,185 @@
+# coding=utf-8
+"""Tests of the offering helpers of functions, over the recorded pages served from a local server
+and with the browsers replaced by canned sessions.
+
+"""
+
+__author__ = 'Andres'
+
+from contextlib import contextmanager
+
+import pytest
+
+import src.control.functions as fn
+import src.control.http_scraper as http_scraper
+import src.control.selenium_scraper as selenium_scraper
+from src.control.selenium_scraper import SSSBApartmentOffer
+from fixture_server import get_local_url
+
+URLS = ['https://www.sssb.se/?refid={0:04d}'.format(i) for i in range(1, 8)]
+
+
+class CannedCrawler(object):
+    """Selenium crawler answering every URL without a browser, recording what it scraped.
+
+    """
+
+    def __init__(self):
+        self.scraped = None
+
+    def scrape_offering(self):
+        self.scraped = 'all'
+
+    def scrape_offering_parallel(self, no_workers=4, urls=None):
+        self.scraped = urls
+
+
+class CannedBrowserSession(object):
+    """Browser session whose crawler reports a fixed offering size, recording its launches.
+
+    """
+
+    def __init__(self, no_apartments=5):
+        self.no_apartments = no_apartments
+        self.launches = 0
+        self.crawler = CannedCrawler()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def launch(self):
+        self.launches += 1
+        return self
+
+    def login(self):
+        return self.crawler
+
+    def get_no_apartments(self):
+        return self.no_apartments
+
+
+@pytest.fixture
+def local_widget(server, monkeypatch):
+    widget_url = http_scraper.get_widget_url(0)
+    monkeypatch.setattr(http_scraper, 'get_widget_url', lambda page: get_local_url(server, widget_url))
+
+
+def test_live_offering_size_over_http(local_widget):
+    browser = CannedBrowserSession()
+
+    assert fn.get_live_offering_size(browser) == 3
+    assert browser.launches == 0
+
+
+def test_live_offering_size_falls_back_to_the_browser(server, monkeypatch):
+    monkeypatch.setattr(http_scraper, 'get_widget_url', lambda page: server + '/missing/')
+    browser = CannedBrowserSession()
+
+    assert fn.get_live_offering_size(browser) == 5
+    assert browser.launches == 1
+
+
+@pytest.mark.parametrize('logged_in, failed, scraped', [
+    (True, [], None),
+    (True, ['https://www.sssb.se/?refid=0002'], ['https://www.sssb.se/?refid=0002']),
+    (False, None, 'all'),
+])
+def test_offering_falls_back_to_the_browser(monkeypatch, logged_in, failed, scraped):
+    def login(self):
+        self.logged_in = logged_in
+
+    monkeypatch.setattr(http_scraper.SSSBApartmentOfferHTTP, 'login', login)
+    monkeypatch.setattr(http_scraper.SSSBApartmentOfferHTTP, 'scrape_offering', lambda self: failed)
+    browser = CannedBrowserSession()
+
+    fn.scrape_offering(browser)
+
+    # Only what the HTTP crawler missed is left to the browser
+    assert browser.crawler.scraped == scraped
+
+
+class CannedOffer(SSSBApartmentOffer):
+    """Selenium crawler answering every URL without a browser, recording the URLs it was given.
+
+    """
+
+    created = []
+
+    def __init__(self):
+        self.logged_in = False
+        self.closed = False
+        self.urls = []
+        CannedOffer.created.append(self)
+
+    def login(self):
+        self.logged_in = True
+
+    def get_apartment_urls(self):
+        return URLS
+
+    def get_apartment_and_offer_by_url(self, url):
+        self.urls.append(url)
+        return [url, '2019-03-04 12:00:00']
+
+    def close_browser(self):
+        self.closed = True
+
+
+class CannedOfferSession(object):
+    """Browser session logging in a canned crawler.
+
+    """
+
+    def login(self):
+        crawler = CannedOffer()
+        crawler.login()
+        return crawler
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    """Offerings written to the database, per batch.
+
+    """
+
+    stored = []
+
+    @contextmanager
+    def session():
+        yield None
+
+    monkeypatch.setattr(selenium_scraper, 'SSSBApartmentOffer', CannedOffer)
+    monkeypatch.setattr(selenium_scraper.db_connection, 'session', session)
+    monkeypatch.setattr(selenium_scraper.db_connection, 'set_offered_apartments', stored.append)
+    monkeypatch.setattr(CannedOffer, 'created', [])
+    return stored
+
+
+def test_offer_workers(monkeypatch):
+    monkeypatch.setenv('SSSB_OFFER_WORKERS', '3')
+
+    assert fn.get_offer_workers() == 3
+
+
+def test_browser_pool(stored):
+    fn.scrape_offering_with_browser(CannedOfferSession(), no_workers=3)
+
+    # The session's browser and two more, sharing the apartments and storing them in one batch
+    assert len(CannedOffer.created) == 3
+    assert all(crawler.logged_in for crawler in CannedOffer.created)
+    assert all(crawler.closed for crawler in CannedOffer.created[1:])
+    assert sorted(url for crawler in CannedOffer.created for url in crawler.urls) == URLS
+    assert all(crawler.urls for crawler in CannedOffer.created)
+    assert len(stored) == 1
+    assert sorted(info[0] for info in stored[0]) == URLS
+
+
+def test_browser_pool_for_the_missed_apartments(stored):
+    fn.scrape_offering_with_browser(CannedOfferSession(), no_workers=3, urls=URLS[:2])
+
+    # No browser is launched for a worker without apartments
+    assert len(CannedOffer.created) == 2
+    assert sorted(info[0] for info in stored[0]) == URLS[:2]
@@ -0,0 +1,56 @@
+# coding=utf-8
+"""Replay tests of the widget spiders over an offering spanning several pages.
+
+"""
+
+__author__ = 'Andres'
+
+import pytest
+
+from src.control.fixtures import replay
+from src.control.items import SSSBApartmentItem, SSSBApartmentStateItem
+from src.control.sssb_scraper import PAGE_SIZE, SSSBApartmentInfoSpider, SSSBApartmentStateSpider, \
+    SSSBApartmentSpider, get_widget_url
+from synthetic import make_listing, write_widget_fixture
+
+NO_LISTINGS = 1000
+NO_PAGES = NO_LISTINGS // PAGE_SIZE
+
+
+@pytest.fixture
+def paginated_dir(tmpdir):
+    """Directory with a recorded 1,000-listing offering. Every page after the first starts with
+    the last listing of the previous one, as happens when a listing disappears during a crawl.
+
+    """
+
+    pages = []
+    for page in range(NO_PAGES):
+        start = page * PAGE_SIZE
+        shifted = [make_listing(start - 1)] if page > 0 else []
+        pages.append(shifted + [make_listing(i) for i in range(start, start + PAGE_SIZE)])
+
+    write_widget_fixture(str(tmpdir), pages, NO_LISTINGS)
+    return str(tmpdir)
+
+
+def get_names(items, item_type):
+    return [item['apt_name'] for item in items if isinstance(item, item_type)]
+
+
+@pytest.mark.parametrize('spider_class', [SSSBApartmentInfoSpider, SSSBApartmentStateSpider, SSSBApartmentSpider])
+def test_every_page_is_crawled_once(paginated_dir, state_path, spider_class):
+    spider = spider_class() if spider_class is SSSBApartmentInfoSpider else spider_class(state_path=state_path)
+    fetched = []
+    items = replay(spider, paginated_dir, fetched)
+
+    assert sorted(fetched) == sorted(get_widget_url(page) for page in range(NO_PAGES))
+
+    expected = ['Testvägen {0} / {0:04d}'.format(i) for i in range(NO_LISTINGS)]
+    for item_type in (SSSBApartmentItem, SSSBApartmentStateItem):
+        names = get_names(items, item_type)
+        if names:
+            # Listings repeated across pages are only yielded once
+            assert sorted(names) == sorted(expected)
+
+    assert len(items) == NO_LISTINGS * (2 if spider_class is SSSBApartmentSpider else 1)
@@ -0,0 +1,48 @@
+# coding=utf-8
+"""Tests of the state time series behind the plots, stored as changes only, against the full
+snapshots they stand for.
+
+"""
+
+__author__ = 'Andres'
+
+import pandas as pd
+
+import src.control.functions as fn
+from src.data.db_ops import extend_series
+
+# Scrapes every 10 minutes, applicants per apartment
+SCRAPES = pd.date_range('2019-03-01 12:00', periods=7, freq='10min', tz='UTC')
+SNAPSHOTS = pd.DataFrame({'A': [1, 1, 1, 4, 4, 4, 4], 'B': [2, 2, 3, 3, 3, 3, 6]}, index=SCRAPES)
+END_DATE = '2019-03-01 14:00:00'
+
+
+def get_changes(snapshots):
+    """Function to keep only the states which differ from the previous one of the apartment, as a
+    change-only upload stores them.
+
+    """
+
+    states = snapshots.stack().rename('value').reset_index()
+    states.columns = ['time_stamp', 'name', 'value']
+    states = states.sort_values(['name', 'time_stamp'])
+    changes = states[states.groupby('name')['value'].diff() != 0]
+    return changes.pivot(index='time_stamp', columns='name', values='value')
+
+
+def test_change_only_series_match_the_snapshots():
+    df = extend_series(get_changes(SNAPSHOTS), END_DATE)
+
+    # Sampled at every scrape, the step functions give back every snapshot
+    assert (df.reindex(SCRAPES, method='ffill') == SNAPSHOTS).all().all()
+    assert df.index[-1] == pd.Timestamp(END_DATE, tz='UTC')
+    assert df.iloc[-1].to_dict() == {'A': 4, 'B': 6}
+
+
+def test_series_are_drawn_as_steps():
+    df = extend_series(get_changes(SNAPSHOTS), END_DATE)
+    f = fn.plot_time_series(False, df)
+
+    lines = f.axes[0].get_lines()
+    assert [line.get_drawstyle() for line in lines] == ['steps-post'] * 2
+    assert [list(line.get_ydata()) for line in lines] == [list(df['A']), list(df['B'])]
@@ -0,0 +1,90 @@
+# coding=utf-8
+"""Tests of the win probability model, plus a benchmark over thousands of synthetic apartments.
+
+"""
+
+__author__ = 'Andres'
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.control.probability import WinProbabilityModel, compute_win_probabilities
+
+
+@pytest.fixture
+def model():
+    """Model over four buckets, with history in the first two only. Top credits grow by 0, 10, 20 or
+    30 days early in an offer, and by 100 or 200 days later on.
+
+    """
+
+    progress = [0.1, 0.1, 0.1, 0.1, 0.3, 0.3]
+    top_credits = [100, 100, 100, 100, 500, 500]
+    final_credits = [100, 110, 120, 130, 600, 700]
+    return WinProbabilityModel(no_bins=4).fit(progress, top_credits, final_credits)
+
+
+def test_predict_per_bucket(model):
+    probability = model.predict([0.0, 0.2, 0.4, 0.45], [100, 100, 100, 100], [115, 131, 250, 100])
+
+    # Growths strictly below the margin win: ties go to the current best applicant
+    np.testing.assert_allclose(probability, [0.5, 1.0, 0.5, 0.0])
+
+
+def test_predict_pooled_fallback(model):
+    # Buckets 2 and 3 have no history, so every growth observed is used: 0, 10, 20, 30, 100, 200
+    probability = model.predict([0.6, 0.99, 1.0], [100, 100, 100], [125, 150, 1000])
+
+    np.testing.assert_allclose(probability, [3 / 6., 4 / 6., 1.0])
+
+
+def test_predict_scalar_own_credits(model):
+    probability = model.predict([0.1, 0.3], [100, 100], 115)
+
+    np.testing.assert_allclose(probability, [0.5, 0.0])
+
+
+def test_predict_without_history():
+    model = WinProbabilityModel(no_bins=4).fit([], [], [])
+
+    np.testing.assert_array_equal(model.predict([0.1, 0.5, 0.9], [100, 200, 300], 200), [1.0, 0.0, 0.0])
+
+
+def test_fit_ignores_missing_final_credits():
+    model = WinProbabilityModel(no_bins=2).fit([0.1, 0.1, 0.1], [100, 100, 100], [110, np.nan, 150])
+
+    np.testing.assert_array_equal(model.counts, [2, 0])
+    np.testing.assert_allclose(model.predict([0.1], [100], [120]), [0.5])
+
+
+def test_compute_win_probabilities():
+    history = pd.DataFrame({'progress': [0.1, 0.1], 'top_credits': [100, 100], 'final_credits': [100, 120]})
+    current = pd.DataFrame({'apt_name': ['A', 'B'], 'progress': [0.1, 0.1], 'top_credits': [100, 200]})
+
+    result = compute_win_probabilities(history, current, 110, no_bins=2)
+
+    assert list(result['probability']) == [0.5, 0.0]
+    assert 'probability' not in current
+
+
+@pytest.mark.parametrize('no_apartments', [1000, 10000])
+def test_predict_benchmark(benchmark, no_apartments):
+    benchmark.group = 'win probability'
+    rng = np.random.RandomState(0)
+
+    # A few years of completed offers, twenty states per apartment
+    no_states = 200000
+    top_credits = rng.randint(0, 3000, no_states)
+    model = WinProbabilityModel().fit(rng.uniform(size=no_states), top_credits,
+                                      top_credits + rng.exponential(200, no_states).astype(int))
+
+    progress = rng.uniform(size=no_apartments)
+    current = rng.randint(0, 3000, no_apartments)
+
+    probability = benchmark(model.predict, progress, current, 1500)
+
+    if benchmark.stats:
+        benchmark.extra_info['apartments/s'] = no_apartments / benchmark.stats.stats.min
+    assert probability.shape == (no_apartments,)
+    assert ((probability >= 0) & (probability <= 1)).all()
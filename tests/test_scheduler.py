@@ -0,0 +1,124 @@
+# coding=utf-8
+"""Tests of the scheduler, with the upload jobs replaced by recorders.
+
+"""
+
+__author__ = 'Andres'
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from pytz import utc
+
+import src.control.scheduler as scheduler
+from src.control.scheduler import Scheduler, get_state_interval, MIN_STATE_INTERVAL, MAX_STATE_INTERVAL, \
+    ROLLOVER_GRACE
+
+NOW = datetime(2019, 3, 4, 12, 0, tzinfo=utc)
+
+
+@pytest.mark.parametrize('remaining, expected', [
+    (timedelta(days=3), MAX_STATE_INTERVAL),
+    (timedelta(hours=12), 30 * 60),
+    (timedelta(hours=1), MIN_STATE_INTERVAL),
+    (timedelta(0), ROLLOVER_GRACE),
+    (timedelta(minutes=-10), ROLLOVER_GRACE),
+])
+def test_get_state_interval(remaining, expected):
+    assert get_state_interval(NOW + remaining, NOW) == expected
+
+
+class FrozenDatetime(object):
+    """Stand-in for the datetime module, frozen at NOW.
+
+    """
+
+    class datetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return NOW.astimezone(tz)
+
+
+class Jobs(object):
+    """Recorder of the upload jobs, reporting the given offer timestamps and the offer id 7.
+
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.timestamps = (NOW - timedelta(days=2), NOW + timedelta(hours=12))
+
+    def get_last_offer_timestamps(self):
+        return self.timestamps
+
+    def record(self, name, result=None):
+        def job(*args):
+            self.calls.append((name,) + args)
+            return result
+        return job
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    jobs = Jobs()
+
+    monkeypatch.setattr(scheduler.fn, 'get_last_offer_timestamps', jobs.get_last_offer_timestamps)
+    monkeypatch.setattr(scheduler.fn, 'get_last_offer_id', jobs.record('get_last_offer_id', 7))
+    for name in ['close_offer', 'scrape_apartments', 'scrape_offering', 'scrape_apartments_and_states',
+                 'send_slack_notification']:
+        monkeypatch.setattr(scheduler.fn, name, jobs.record(name))
+    monkeypatch.setattr(scheduler.fn, 'get_offer_workers', lambda: 3)
+    monkeypatch.setattr(scheduler, 'datetime', FrozenDatetime)
+    return jobs
+
+
+def tick(s):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(s.tick())
+    finally:
+        loop.close()
+
+
+def test_open_offer(jobs):
+    s = Scheduler()
+
+    assert tick(s) == 30 * 60
+    assert jobs.calls == [('scrape_apartments_and_states', False, True)]
+
+
+def test_rollover_waits_for_the_new_offering(jobs):
+    jobs.timestamps = (NOW - timedelta(days=7), NOW - timedelta(minutes=1))
+
+    assert tick(Scheduler()) == ROLLOVER_GRACE - 60
+    assert jobs.calls == []
+
+
+def test_rollover(jobs):
+    jobs.timestamps = (NOW - timedelta(days=7), NOW - timedelta(hours=1))
+    s = Scheduler()
+
+    assert tick(s) == MIN_STATE_INTERVAL
+    assert jobs.calls == [('get_last_offer_id',), ('close_offer', 7), ('scrape_apartments',),
+                          ('scrape_offering', None, 3)]
+
+    # The offer is closed out once, while the catalog and offering are retried until it rolls over
+    del jobs.calls[:]
+    tick(s)
+
+    assert jobs.calls == [('get_last_offer_id',), ('scrape_apartments',), ('scrape_offering', None, 3)]
+
+
+def test_failed_job(jobs, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("Crawl failed")
+
+    monkeypatch.setattr(scheduler.fn, 'scrape_apartments_and_states', fail)
+    s = Scheduler()
+    tick(s)
+    tick(s)
+
+    assert jobs.calls == [('send_slack_notification', 'Apartment state upload', 0, 'Crawl failed')] * 2
+    assert s.metrics.get()['Apartment state upload']['runs'] == 2
+    assert s.metrics.get()['Apartment state upload']['failures'] == 2
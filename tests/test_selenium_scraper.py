@@ -0,0 +1,101 @@
+# coding=utf-8
+"""Tests of the parallel Selenium offering scrape, with the browsers replaced by canned crawlers.
+
+"""
+
+__author__ = 'Andres'
+
+from contextlib import contextmanager
+
+import pytest
+
+import src.control.selenium_scraper as selenium_scraper
+from src.control.selenium_scraper import ApartmentException, SSSBApartmentOffer
+
+URLS = ['https://www.sssb.se/?refid={0:04d}'.format(i) for i in range(1, 6)]
+
+
+class CannedOffer(SSSBApartmentOffer):
+    """Crawler answering every URL without a browser, except the broken ones, which are never
+    answered, and the crashing ones, on which the browser dies.
+
+    """
+
+    broken_urls = set()
+    crashing_urls = set()
+    created = []
+
+    def __init__(self):
+        self.logged_in = True
+        self.closed = False
+        CannedOffer.created.append(self)
+
+    def login(self):
+        pass
+
+    def get_apartment_urls(self):
+        return URLS
+
+    def get_apartment_and_offer_by_url(self, url):
+        if url in self.crashing_urls:
+            raise RuntimeError("Browser died")
+        return None if url in self.broken_urls else [url, '2019-03-04 12:00:00']
+
+    def close_browser(self):
+        self.closed = True
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    """Offerings written to the database.
+
+    """
+
+    stored = []
+
+    @contextmanager
+    def session():
+        yield None
+
+    monkeypatch.setattr(selenium_scraper, 'SSSBApartmentOffer', CannedOffer)
+    monkeypatch.setattr(selenium_scraper.db_connection, 'session', session)
+    monkeypatch.setattr(selenium_scraper.db_connection, 'set_offered_apartments', stored.extend)
+    monkeypatch.setattr(CannedOffer, 'created', [])
+    return stored
+
+
+def test_every_apartment_is_stored(stored):
+    CannedOffer().scrape_offering_parallel(no_workers=2)
+
+    assert sorted(info[0] for info in stored) == URLS
+    assert all(worker.closed for worker in CannedOffer.created[1:])
+
+
+def test_no_browser_for_empty_chunks(stored):
+    CannedOffer().scrape_offering_parallel(no_workers=8)
+
+    # This crawler plus one worker per remaining apartment
+    assert len(CannedOffer.created) == len(URLS)
+    assert sorted(info[0] for info in stored) == URLS
+
+
+def test_failed_apartments_are_reported_after_storing_the_rest(stored, monkeypatch):
+    monkeypatch.setattr(CannedOffer, 'broken_urls', {URLS[1]})
+
+    with pytest.raises(ApartmentException) as e:
+        CannedOffer().scrape_offering_parallel(no_workers=2)
+
+    assert sorted(info[0] for info in stored) == URLS[:1] + URLS[2:]
+    assert URLS[1] in str(e.value)
+
+
+def test_failed_worker_keeps_the_others(stored, monkeypatch):
+    # The third worker dies on its first apartment, losing its whole chunk
+    monkeypatch.setattr(CannedOffer, 'crashing_urls', {URLS[2]})
+
+    with pytest.raises(ApartmentException) as e:
+        CannedOffer().scrape_offering_parallel(no_workers=3)
+
+    lost = URLS[2::3]
+    assert sorted(info[0] for info in stored) == sorted(set(URLS) - set(lost))
+    assert all(url in str(e.value) for url in lost)
@@ -0,0 +1,136 @@
+# coding=utf-8
+"""Replay tests of the widget spiders against recorded responses.
+
+"""
+
+__author__ = 'Andres'
+
+import pytest
+
+from src.control.fixtures import replay
+from src.control.items import SSSBApartmentItem, SSSBApartmentStateItem
+from src.control.sssb_scraper import SSSBApartmentInfoSpider, SSSBApartmentStateSpider, SSSBApartmentSpider
+from synthetic import make_listing, make_widget_response
+
+APARTMENTS = [
+    {'apt_name': 'Körsbärsvägen 4 C / 1024', 'apt_type': 'Korridorrum', 'apt_zone': 'Lappkärrsberget',
+     'apt_price': '3862', 'furnitured': 'True', 'electricity': 'True'},
+    {'apt_name': 'Professorsslingan 23 / 1102', 'apt_type': '1 rum och kök', 'apt_zone': 'Frescati',
+     'apt_price': '6234', '_10_month': 'True'},
+    {'apt_name': 'Strix, Vitterhetsvägen 12 / 0507', 'apt_type': 'Korridorrum', 'apt_zone': 'Kungshamra',
+     'apt_price': '4120', 'furnitured': 'True'},
+]
+
+STATES = [
+    ('Körsbärsvägen 4 C / 1024', '12', '421'),
+    ('Professorsslingan 23 / 1102', '148', '1290'),
+    ('Strix, Vitterhetsvägen 12 / 0507', '3', '87'),
+]
+
+
+def get_states(items):
+    return [(item['apt_name'], item['apt_no_applicants'], item['apt_top_credits']) for item in items]
+
+
+def test_info_spider(fixture_dir):
+    items = replay(SSSBApartmentInfoSpider(), fixture_dir)
+
+    assert all(isinstance(item, SSSBApartmentItem) for item in items)
+    assert [dict(item) for item in items] == APARTMENTS
+
+
+def test_state_spider(fixture_dir, state_path):
+    spider = SSSBApartmentStateSpider(state_path=state_path)
+    items = replay(spider, fixture_dir)
+
+    assert all(isinstance(item, SSSBApartmentStateItem) for item in items)
+    assert get_states(items) == STATES
+    assert {item['state_timestamp'] for item in items} == {spider.date}
+
+
+def test_state_spider_skips_unchanged_pages(fixture_dir, state_path):
+    spider = SSSBApartmentStateSpider(state_path=state_path)
+    replay(spider, fixture_dir)
+    spider.closed('finished')
+
+    assert replay(SSSBApartmentStateSpider(incremental=True, state_path=state_path), fixture_dir) == []
+
+
+def test_state_spider_full_crawl_over_unchanged_pages(fixture_dir, state_path):
+    spider = SSSBApartmentStateSpider(incremental=True, state_path=state_path)
+    replay(spider, fixture_dir)
+    spider.closed('finished')
+
+    assert get_states(replay(SSSBApartmentStateSpider(state_path=state_path), fixture_dir)) == STATES
+
+
+@pytest.mark.parametrize('incremental, conditional', [(True, True), (False, False)])
+def test_state_spider_conditional_requests(state_path, incremental, conditional):
+    spider = SSSBApartmentStateSpider(incremental=incremental, state_path=state_path)
+    url = spider.get_page_request(0).url
+    spider.crawl_state['pages'] = {url: {'etag': '"abc"', 'last_modified': 'Mon, 04 Mar 2019 12:00:00 GMT'}}
+
+    request = spider.get_page_request(0)
+
+    assert ('If-None-Match' in request.headers) is conditional
+    assert ('If-Modified-Since' in request.headers) is conditional
+
+
+def test_state_spider_keeps_state_when_storing_failed(fixture_dir, state_path):
+    spider = SSSBApartmentStateSpider(state_path=state_path)
+    replay(spider, fixture_dir)
+    spider.store_failed = True
+    spider.closed('finished')
+
+    assert get_states(replay(SSSBApartmentStateSpider(state_path=state_path), fixture_dir)) == STATES
+
+
+def test_state_spider_incremental(fixture_dir, state_path):
+    spider = SSSBApartmentStateSpider(state_path=state_path)
+    replay(spider, fixture_dir)
+    spider.closed('finished')
+
+    # Forget the page hashes, so the page is parsed again and compared listing by listing
+    spider = SSSBApartmentStateSpider(incremental=True, state_path=state_path)
+    spider.crawl_state['pages'] = {}
+
+    assert replay(spider, fixture_dir) == []
+
+
+def test_apartment_spider(fixture_dir, state_path):
+    items = replay(SSSBApartmentSpider(state_path=state_path), fixture_dir)
+
+    # The whole catalog of a page comes before its states
+    assert [type(item) for item in items] == [SSSBApartmentItem] * 3 + [SSSBApartmentStateItem] * 3
+    assert [dict(item) for item in items[:3]] == APARTMENTS
+    assert get_states(items[3:]) == STATES
+
+
+def test_apartment_spider_full_crawl_over_unchanged_pages(fixture_dir, state_path):
+    spider = SSSBApartmentSpider(state_path=state_path)
+    replay(spider, fixture_dir)
+    spider.closed('finished')
+
+    items = replay(SSSBApartmentSpider(state_path=state_path), fixture_dir)
+
+    assert [dict(item) for item in items[:3]] == APARTMENTS
+    assert get_states(items[3:]) == STATES
+
+
+def test_listing_without_applicant_data(state_path):
+    response = make_widget_response([make_listing(1), make_listing(2, interest=False), make_listing(3)])
+    items = list(SSSBApartmentStateSpider(state_path=state_path).parse_states(response))
+
+    # The listing without data is skipped, without shifting the values of the next one
+    assert get_states(items) == [('Testvägen 1 / 0001', '1', '10'), ('Testvägen 3 / 0003', '3', '30')]
+
+
+def test_listing_without_zone():
+    response = make_widget_response([make_listing(1), make_listing(2, zone=False), make_listing(3)])
+    items = list(SSSBApartmentInfoSpider().parse_apartments(response))
+
+    assert [(item['apt_name'], item.get('apt_zone'), item['apt_price']) for item in items] == [
+        ('Testvägen 1 / 0001', 'Zone 1', '3001'),
+        ('Testvägen 2 / 0002', None, '3002'),
+        ('Testvägen 3 / 0003', 'Zone 3', '3003'),
+    ]